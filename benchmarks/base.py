@@ -0,0 +1,98 @@
+import os
+import statistics
+import time
+from urllib.parse import urlparse
+
+from decouple import config
+from pymongo import MongoClient
+
+from lib.db import MongoBackend
+
+
+class BenchmarkDatabase:
+    """
+    Creates a separate database for benchmarks and drops it on exit.
+    `DB_NAME` must be a database administrator (as for running tests)
+    """
+
+    def __init__(self):
+        self.name = 'bench_' + config('DB_NAME')
+        self.client = MongoClient('{host}:{port}'.format(host=config('DB_HOST'), port=config('DB_PORT')))
+        self.client.admin.authenticate(config('DB_USER'), config('DB_PASS'))
+        self.client[self.name].add_user(
+            config('DB_USER'),
+            config('DB_PASS'),
+            roles=[{'role': 'readWrite', 'db': self.name}]
+        )
+        self.db = MongoBackend(db_name=self.name)
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *args):
+        self.client.drop_database(self.name)
+
+
+# benchmarks write dedup, outbox, rate limit and metrics keys into this database
+# of the Redis server in REDIS_URL, it is flushed after a run
+BENCH_REDIS_DB = config('BENCH_REDIS_DB', default=15, cast=int)
+
+
+def use_benchmark_redis():
+    """
+    Points REDIS_URL to BENCH_REDIS_DB, so keys written by benchmarks don't mix with keys
+    of running services. Has to be called before web.app is imported
+    """
+    url = config('REDIS_URL', default='') or config('CELERY_BROKER_URL', default='')
+    if not url:
+        return
+    parsed = urlparse(url)
+    if parsed.path.strip('/') == str(BENCH_REDIS_DB):
+        raise ValueError(f'REDIS_URL already uses the benchmark database {BENCH_REDIS_DB}, set BENCH_REDIS_DB')
+    os.environ['REDIS_URL'] = parsed._replace(path=f'/{BENCH_REDIS_DB}').geturl()
+
+
+class BenchmarkRedis:
+    """Flushes the benchmark Redis database on exit"""
+
+    def __enter__(self):
+        from web.app import redis_conn
+        if redis_conn.connection_pool.connection_kwargs.get('db') != BENCH_REDIS_DB:
+            raise RuntimeError('web.app was imported before the benchmark Redis database was set')
+        self.redis = redis_conn
+        return redis_conn
+
+    def __exit__(self, *args):
+        self.redis.flushdb()
+
+
+def measure(func, repeat=50):
+    """
+    Calls a function several times
+    :return: list of elapsed times in milliseconds
+    """
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(title, rows):
+    """
+    Prints a result table
+    :param rows: list of tuples (label, timings in milliseconds)
+    """
+    print(f'\n{title}')
+    print('{:<40}{:>12}{:>12}{:>12}'.format('case', 'mean, ms', 'p50, ms', 'p99, ms'))
+    for label, timings in rows:
+        print('{:<40}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+            label, statistics.mean(timings), percentile(timings, 50), percentile(timings, 99)
+        ))
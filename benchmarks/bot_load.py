@@ -0,0 +1,161 @@
+"""
+Load test of the whole bot through the local stand-in of the Telegram Bot API.
+
+Starts benchmarks.telegram_mock and simulates users who send commands and tap
+inline buttons of the replies (pagination and menus). The bot has to be started
+separately with TELEGRAM_API_URL=http://localhost:8081 (and as many WORKERS as needed).
+Latency is measured from an update becoming available to getUpdates to the first
+message sent or edited by the bot in the chat. Users with the ids from --first-user-id
+have to be connected in the bot database to exercise Jira queries. Run from the project root:
+    python -m benchmarks.bot_load --users 1000 --actions 5 --concurrency 100
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from .base import percentile
+from .telegram_mock import add_arguments, create_server
+
+COMMANDS = ('/help', '/start', '/listunresolved my', '/liststatus my', '/filter', '/schedulelist')
+
+_query_ids = count(1)
+_message_ids = count(1)
+
+
+def make_user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'}
+
+
+def command_update(user_id, text):
+    command = text.split(None, 1)[0]
+    return {
+        'message': {
+            'message_id': next(_message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        }
+    }
+
+
+def callback_update(user_id, message, data):
+    return {
+        'callback_query': {
+            'id': str(next(_query_ids)),
+            'from': make_user(user_id),
+            'message': message,
+            'chat_instance': str(user_id),
+            'data': data,
+        }
+    }
+
+
+def inline_buttons(message):
+    """:return: callback data of inline buttons of a message"""
+    keyboard = (message.get('reply_markup') or dict()).get('inline_keyboard') or list()
+    return [button['callback_data'] for row in keyboard for button in row if button.get('callback_data')]
+
+
+class LoadDriver:
+    """
+    Simulates users of the bot
+    :param server: a running MockTelegramServer
+    :param commands: commands sent by users
+    :param tap_rate: share of replies with inline buttons on which a user taps a button
+    :param timeout: seconds to wait for a reply
+    """
+
+    def __init__(self, server, commands=COMMANDS, tap_rate=0.5, timeout=30):
+        self.server = server
+        self.commands = commands
+        self.tap_rate = tap_rate
+        self.timeout = timeout
+        self.timings = {'command': list(), 'button': list()}
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def act(self, user_id, kind, update):
+        """
+        Sends an update of a user and waits for the reply
+        :return: the reply message or None
+        """
+        self.server.clear_replies(user_id)
+        start = time.perf_counter()
+        self.server.push_update(update)
+        reply = self.server.wait_reply(user_id, self.timeout)
+        with self._lock:
+            if reply is None:
+                self.timeouts += 1
+            else:
+                self.timings[kind].append((time.perf_counter() - start) * 1000)
+        return reply
+
+    def run_user(self, user_id, actions):
+        done = 0
+        while done < actions:
+            reply = self.act(user_id, 'command', command_update(user_id, random.choice(self.commands)))
+            done += 1
+            # pages and menus are browsed while the reply has buttons
+            while reply and done < actions and random.random() < self.tap_rate:
+                buttons = inline_buttons(reply)
+                if not buttons:
+                    break
+                reply = self.act(user_id, 'button', callback_update(user_id, reply, random.choice(buttons)))
+                done += 1
+
+    def run(self, users, actions, concurrency, first_user_id):
+        """:return: elapsed seconds"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [
+                executor.submit(self.run_user, user_id, actions)
+                for user_id in range(first_user_id, first_user_id + users)
+            ]:
+                future.result()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the bot through the Telegram Bot API stand-in.')
+    add_arguments(parser)
+    parser.add_argument('--users', type=int, default=1000, help='number of simulated users')
+    parser.add_argument('--actions', type=int, default=5, help='commands and taps of every user')
+    parser.add_argument('--concurrency', type=int, default=100, help='users acting at once')
+    parser.add_argument('--first-user-id', type=int, default=900000000, help='telegram id of the first user')
+    parser.add_argument('--commands', default=','.join(COMMANDS), help='comma separated commands')
+    parser.add_argument('--tap-rate', type=float, default=0.5, help='share of replies with buttons tapped')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a reply')
+    args = parser.parse_args()
+
+    server = create_server(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Waiting for the bot on http://{server.server_address[0]}:{server.server_port}')
+    while not server.stats['getUpdates 200']:
+        time.sleep(0.5)
+
+    driver = LoadDriver(server, args.commands.split(','), args.tap_rate, args.timeout)
+    elapsed = driver.run(args.users, args.actions, args.concurrency, args.first_user_id)
+    server.shutdown()
+
+    replied = sum(len(timings) for timings in driver.timings.values())
+    print(f'\n{args.users} users, {replied} replies in {elapsed:.1f}s: {replied / elapsed:.1f} actions/s, '
+          f'{driver.timeouts} without a reply in {args.timeout}s')
+    print('{:<20}{:>10}{:>12}{:>12}{:>12}'.format('action', 'count', 'mean, ms', 'p50, ms', 'p99, ms'))
+    for kind, timings in driver.timings.items():
+        if timings:
+            print('{:<20}{:>10}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                kind, len(timings), statistics.mean(timings), percentile(timings, 50), percentile(timings, 99)
+            ))
+    print('\nBot API calls:')
+    print(json.dumps(dict(server.stats), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
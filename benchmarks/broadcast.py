@@ -0,0 +1,56 @@
+"""
+Broadcast enqueue time versus recipient count.
+
+"Per message" queues a task for every message as broadcast did before,
+"chunked" queues one task per BROADCAST_CHUNK messages. Tasks are published
+into an in-memory broker, so queued notifications of a real broker are not touched,
+payloads are stored into the benchmark Redis database (BENCH_REDIS_DB) which is flushed after the run.
+Run from the project root:
+    python -m benchmarks.broadcast
+"""
+from .base import BenchmarkRedis, measure, report, use_benchmark_redis
+
+use_benchmark_redis()
+from web.app import BULK_QUEUE, NOTIFICATIONS_QUEUE, celery
+from web.webhooks.delivery import BROADCAST_CHUNK, broadcast, prepare_payloads
+from web.webhooks.tasks import send_message
+
+RECIPIENT_COUNTS = (10, 100, 1000, 5000)
+MESSAGE = (
+    'User <b>John Doe</b> updated status from <b>In Progress</b> to <b>Done</b> '
+    'at <a href="https://jira.somecompany.com/browse/JTB-99">JTB-99</a>'
+)
+# queues of broadcast tasks, celery.control.purge() purges only the default queue
+QUEUES = (NOTIFICATIONS_QUEUE, BULK_QUEUE)
+
+
+def per_message(payloads):
+    for payload in payloads:
+        send_message.delay(payload)
+
+
+def purge():
+    """Drops tasks queued by a case"""
+    with celery.connection_for_write() as conn:
+        for queue in QUEUES:
+            celery.amqp.queues[queue](conn.default_channel).purge()
+
+
+def main():
+    celery.conf.broker_url = 'memory://'
+    rows = list()
+    with BenchmarkRedis():
+        for count in RECIPIENT_COUNTS:
+            payloads = prepare_payloads([(chat_id, MESSAGE) for chat_id in range(count)], 'HTML')
+            repeat = max(3, 2000 // count)
+            rows.append((f'{count} recipients, per message', measure(lambda: per_message(payloads), repeat)))
+            purge()
+            rows.append((
+                f'{count} recipients, chunks of {BROADCAST_CHUNK}', measure(lambda: broadcast(payloads), repeat)
+            ))
+            purge()
+    report('Broadcast enqueue time', rows)
+
+
+if __name__ == '__main__':
+    main()
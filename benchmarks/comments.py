@@ -0,0 +1,76 @@
+"""
+Comment sanitizing time on large (100 KB+) comments.
+
+"Before" is the previous implementation: a recompiled regexp per macro with
+str.replace per distinct match, six more replace passes and a separate scan
+for links. Run from the project root:
+    python -m benchmarks.comments
+"""
+import re
+
+from web.webhooks.notifier import CommentNotify, sanitize_comment
+
+from .base import measure, report
+
+MARKUP_PARAGRAPH = (
+    'Steps to reproduce:\r\n# open the {color:#ff0000}settings page{color} & click +\r\n'
+    '{code:java}int total = price + tax; // `legacy`{code}\r\n'
+    'see [docs|https://example.com/docs#install] and [https://example.com]\xa0for details\r\n'
+)
+PLAIN_PARAGRAPH = 'Checked on staging, the issue is not reproduced anymore. Closing the ticket.\n'
+SIZE = 100 * 1024
+
+
+def comment_prepare(comment):
+    regexp_replace = {
+        r'{color:?[^}]*}': ' ',
+        r'{code:?[^}]*}': ' ',
+        r'{panel:?[^}]*}': ' ',
+        r'{noformat[^}]*}': ' ',
+        r'{quote[^}]*}': ' ',
+    }
+    for search_pattern, replace_pattern in regexp_replace.items():
+        find_strings = set(re.findall(re.compile(search_pattern, re.DOTALL), comment))
+        for find_string in find_strings:
+            comment = comment.replace(find_string, replace_pattern)
+    simple_replace = {'\xa0': ' ', '`': "'", '&': '-', '#': '-', '+': '*', '\r\n': '\n'}
+    for search_item, replace_item in simple_replace.items():
+        if search_item in comment:
+            comment = comment.replace(search_item, replace_item)
+    return comment
+
+
+def get_comment_links(comment):
+    links = ''
+    raw_links = re.findall(r'\[([^\|]*)\|?([^\]]*)\]', comment)
+    if raw_links:
+        links += '\n\nLinks from comment:'
+        for raw_link in raw_links:
+            if raw_link[1]:
+                links += f'\n[{raw_link[0]}]({raw_link[1]})'
+            else:
+                links += f'\n[{raw_link[0]}]({raw_link[0]})'
+    return links
+
+
+def before(comment):
+    return comment_prepare(comment), get_comment_links(comment)
+
+
+def after(comment):
+    text, links = sanitize_comment(comment)
+    return text, CommentNotify._format_links(links)
+
+
+def main():
+    rows = list()
+    for name, paragraph in (('markup', MARKUP_PARAGRAPH), ('plain text', PLAIN_PARAGRAPH)):
+        comment = paragraph * (SIZE // len(paragraph) + 1)
+        assert before(comment) == after(comment)
+        rows.append((f'{name} {len(comment) // 1024} KB, before', measure(lambda: before(comment), 50)))
+        rows.append((f'{name} {len(comment) // 1024} KB, after', measure(lambda: after(comment), 50)))
+    report('Comment sanitizing', rows)
+
+
+if __name__ == '__main__':
+    main()
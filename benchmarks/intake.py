@@ -0,0 +1,79 @@
+"""
+CPU time of accepting an update by event type and body size.
+
+"Full parse" parses the whole body with json and then checks the event type
+as webhook views did before, "peek" finds the event type in the raw body
+and parses a supported update with ujson only. Run from the project root:
+    python -m benchmarks.intake
+"""
+import json
+import time
+
+import ujson
+
+from web.webhooks.notifier import NotifierFactory
+from web.webhooks.pipeline import peek_event
+
+from .base import report
+
+EVENTS = ('jira:issue_updated', 'comment_created', 'jira:version_released', 'sprint_started', 'board_updated')
+# number of issue comments in the body, about 160 bytes each
+BODY_SIZES = (('small', 5), ('large', 5000))
+
+
+def make_body(event, comments):
+    update = {
+        'timestamp': 1525698237764,
+        'webhookEvent': event,
+        'user': {'name': 'bob', 'displayName': 'Bob'},
+        'issue': {
+            'id': '10001',
+            'key': 'JTB-99',
+            'fields': {
+                'summary': 'Test issue',
+                'description': 'Steps to reproduce the issue',
+                'comment': {'comments': [
+                    {'id': str(i), 'body': 'Checked on staging, works as expected', 'author': {'name': 'bob'}}
+                    for i in range(comments)
+                ]},
+            },
+        },
+        'changelog': {'id': '10100', 'items': [{'field': 'status', 'fromString': 'Open', 'toString': 'Done'}]},
+    }
+    return json.dumps(update).encode()
+
+
+def full_parse(data):
+    update = json.loads(data)
+    if NotifierFactory.get_notifier(update.get('webhookEvent')):
+        return update
+
+
+def peek(data):
+    if NotifierFactory.get_notifier(peek_event(data)):
+        return ujson.loads(data)
+
+
+def measure_cpu(func, repeat):
+    """:return: list of CPU times of the calls in milliseconds"""
+    timings = list()
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        timings.append((time.process_time() - start) * 1000)
+    return timings
+
+
+def main():
+    rows = list()
+    for label, comments in BODY_SIZES:
+        repeat = max(30, 20000 // comments)
+        for event in EVENTS:
+            data = make_body(event, comments)
+            rows.append((f'{event}, {label}, full parse', measure_cpu(lambda: full_parse(data), repeat)))
+            rows.append((f'{event}, {label}, peek', measure_cpu(lambda: peek(data), repeat)))
+    report('CPU time per update', rows)
+
+
+if __name__ == '__main__':
+    main()
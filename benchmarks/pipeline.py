@@ -0,0 +1,173 @@
+"""
+Throughput of the webhook pipeline by event type and subscriber count.
+
+Generated Jira updates are posted into the webhook views through the Flask
+test client and routed inline (as with WEBHOOK_ASYNC_PROCESSING=False), so every
+event is parsed, routed, rendered and broadcast. Subscribers are created in the
+`bench_<DB_NAME>` database, tasks are published into an in-memory broker and
+dedup, outbox and metrics keys are written into the benchmark database (BENCH_REDIS_DB)
+of the Redis server in REDIS_URL, it is flushed after the run. Reported per event type:
+events/s, p50/p99 latency, Mongo commands per event and enqueued Telegram
+messages per event. Run from the project root:
+    python -m benchmarks.pipeline
+"""
+import json
+import time
+from itertools import count
+
+from bson.objectid import ObjectId
+from celery.signals import after_task_publish
+from pymongo import monitoring
+
+from .base import BenchmarkDatabase, BenchmarkRedis, percentile, use_benchmark_redis
+from .routing import ISSUE, PROJECT, populate
+
+SUBSCRIBER_COUNTS = (10, 100, 1000, 10000)
+# a comment body of about 10 KB
+COMMENT = 'Checked on staging, see [the log|https://ci.somecompany.com/job/42] {code}OK{code}\n' * 120
+# update timestamps make bodies unique, so no update is dropped as a duplicate
+TIMESTAMPS = count(int(time.time() * 1000))
+HEADERS = {'User-Agent': 'Atlassian HttpClient 1.0', 'Content-Type': 'application/json'}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to Mongo by clients created after its registration"""
+
+    def __init__(self):
+        self.commands = 0
+
+    def started(self, event):
+        self.commands += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class PublishCounter:
+    """Counts Telegram messages in the published celery tasks"""
+
+    def __init__(self):
+        self.messages = 0
+        after_task_publish.connect(self.published, weak=False)
+
+    def published(self, sender=None, body=None, **kwargs):
+        args = body[0] if isinstance(body, (list, tuple)) else body.get('args', ())
+        if sender == 'web.webhooks.tasks.send_messages':
+            self.messages += len(args[0])
+        elif sender == 'web.webhooks.tasks.send_message':
+            self.messages += 1
+
+
+def issue_updated(timestamp, changes):
+    return 'issue', {
+        'timestamp': timestamp,
+        'webhookEvent': 'jira:issue_updated',
+        'issue_event_type_name': 'issue_updated',
+        'user': {'name': 'bob', 'displayName': 'Bob'},
+        'issue': {'id': '10001', 'key': ISSUE},
+        'changelog': {'id': '10100', 'items': [
+            {'field': 'Attachment', 'fromString': None, 'toString': f'screenshot-{i}.png'} for i in range(changes)
+        ]},
+    }
+
+
+def comment_created(timestamp):
+    return 'issue', {
+        'timestamp': timestamp,
+        'webhookEvent': 'comment_created',
+        'comment': {'id': '10200', 'body': COMMENT, 'author': {'name': 'bob', 'displayName': 'Bob'}},
+    }
+
+
+def worklog_logged(timestamp):
+    return 'issue', {
+        'timestamp': timestamp,
+        'webhookEvent': 'jira:worklog_updated',
+        'issue_event_type_name': 'issue_work_logged',
+        'user': {'name': 'bob', 'displayName': 'Bob'},
+        'issue': {'id': '10001', 'key': ISSUE},
+        'changelog': {'id': '10100', 'items': [{'field': 'timespent', 'from': '3600', 'to': '9000'}]},
+    }
+
+
+def issue_event(timestamp, event):
+    return 'project', {
+        'timestamp': timestamp,
+        'webhookEvent': event,
+        'user': {'name': 'bob', 'displayName': 'Bob'},
+        'issue': {'id': '10002', 'key': f'{PROJECT}-100'},
+    }
+
+
+EVENTS = (
+    ('issue updated, 1 change', lambda ts: issue_updated(ts, 1)),
+    ('issue updated, 10 changes', lambda ts: issue_updated(ts, 10)),
+    ('comment, 10 KB', comment_created),
+    ('worklog', worklog_logged),
+    ('issue created', lambda ts: issue_event(ts, 'jira:issue_created')),
+    ('issue deleted', lambda ts: issue_event(ts, 'jira:issue_deleted')),
+)
+
+
+def run_case(client, webhook_id, make_event, events, commands, publishes):
+    """
+    Posts updates of one type one by one
+    :return: tuple(latencies in milliseconds, total seconds, Mongo commands, enqueued messages)
+    """
+    urls = {'issue': f'/webhook/{webhook_id}/{PROJECT}/{ISSUE}/', 'project': f'/webhook/{webhook_id}/{PROJECT}/'}
+    bodies = [make_event(next(TIMESTAMPS)) for _ in range(events)]
+    bodies = [(urls[kind], json.dumps(update)) for kind, update in bodies]
+
+    start_commands, start_messages = commands.commands, publishes.messages
+    timings = list()
+    start = time.perf_counter()
+    for url, body in bodies:
+        request_start = time.perf_counter()
+        response = client.post(url, data=body, headers=HEADERS)
+        timings.append((time.perf_counter() - request_start) * 1000)
+        assert response.status_code == 200, response.data
+    elapsed = time.perf_counter() - start
+    return timings, elapsed, commands.commands - start_commands, publishes.messages - start_messages
+
+
+def main():
+    # listeners are applied to clients created after the registration, i.e. to the benchmark database
+    commands = CommandCounter()
+    monitoring.register(commands)
+
+    use_benchmark_redis()
+    from web import app as web_app
+    from web.webhooks import views
+    web_app.celery.conf.broker_url = 'memory://'
+    views.ASYNC_PROCESSING = False
+    publishes = PublishCounter()
+    client = web_app.app.test_client()
+
+    with BenchmarkDatabase() as db, BenchmarkRedis():
+        db.create_routing_indexes()
+        # all modules of the web service share one database backend
+        web_app.db._conn = db.conn
+        webhook_id = db.create_webhook('https://jira.somecompany.com')
+
+        print('\nWebhook pipeline throughput')
+        print('{:<48}{:>10}{:>10}{:>10}{:>14}{:>14}'.format(
+            'case', 'events/s', 'p50, ms', 'p99, ms', 'mongo/event', 'messages/event'
+        ))
+        for subscribers in SUBSCRIBER_COUNTS:
+            populate(db, ObjectId(webhook_id), subscribers)
+            events = max(10, 2000 // subscribers)
+            for label, make_event in EVENTS:
+                timings, elapsed, mongo, messages = run_case(
+                    client, webhook_id, make_event, events, commands, publishes
+                )
+                print('{:<48}{:>10.1f}{:>10.3f}{:>10.3f}{:>14.1f}{:>14.1f}'.format(
+                    f'{subscribers} subscribers, {label}', events / elapsed,
+                    percentile(timings, 50), percentile(timings, 99), mongo / events, messages / events
+                ))
+
+
+if __name__ == '__main__':
+    main()
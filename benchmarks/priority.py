@@ -0,0 +1,128 @@
+"""
+Latency of small notifications during a bulk broadcast.
+
+Messages are queued by the real `broadcast()` into an in-memory broker and
+consumed by worker threads bound to the queues as the queues are served in
+docker-compose.yml; a request to the Telegram API takes SEND_TIME per message.
+A broadcast of BULK_MESSAGES messages of one host is queued at once, then
+notifications of one message arrive every EVENT_INTERVAL. "Single queue"
+disables the queue choice of broadcast(), so all tasks are served by all
+workers in FIFO order. With the routing rules the large fan-out goes to the
+bulk queue, so do notifications of the busy host. Payloads and rate counters
+are stored into the benchmark Redis database (BENCH_REDIS_DB), it is flushed after the run.
+The reported time is from queueing a notification to sending it.
+Run from the project root:
+    python -m benchmarks.priority
+"""
+import threading
+import time
+
+from kombu import Exchange, Queue
+
+from .base import BenchmarkRedis, report, use_benchmark_redis
+
+use_benchmark_redis()
+from web.app import BULK_QUEUE, NOTIFICATIONS_QUEUE, celery, redis_conn
+from web.webhooks import delivery
+
+SEND_TIME = 0.002
+BULK_MESSAGES = 10000
+SMALL_EVENTS = 100
+EVENT_INTERVAL = 0.01
+WORKERS = 30
+BULK_WORKERS = 10
+BULK_HOST = 'https://bench-bulk.atlassian.net'
+OTHER_HOST = 'https://bench-other.atlassian.net'
+MESSAGE = 'User <b>John Doe</b> updated status from <b>In Progress</b> to <b>Done</b>'
+# chat ids of notifications don't overlap chat ids of the bulk broadcast
+EVENT_CHATS = range(BULK_MESSAGES, BULK_MESSAGES + SMALL_EVENTS)
+
+
+def bind(name, conn):
+    # celery creates a missing queue with an exchange and a routing key of the same name
+    return Queue(name, Exchange(name), name)(conn.default_channel)
+
+
+def worker(name, stop, queued_at, latencies):
+    """Consumes tasks of a queue, a task of several messages takes SEND_TIME per message"""
+    with celery.connection_for_read() as conn:
+        tasks = bind(name, conn)
+        while not stop.is_set():
+            task = tasks.get(no_ack=True)
+            if task is None:
+                time.sleep(0.001)
+                continue
+            args, _, _ = task.decode()
+            messages = args[0]
+            time.sleep(SEND_TIME * len(messages))
+            for message in messages:
+                if message['chat_id'] in queued_at:
+                    latencies.append((time.perf_counter() - queued_at[message['chat_id']]) * 1000)
+
+
+def run(workers, event_host):
+    """
+    :param workers: list of (queue name, number of workers)
+    :param event_host: a Jira host of the notifications
+    :return: latencies of the notifications in milliseconds
+    """
+    stop, queued_at, latencies = threading.Event(), dict(), list()
+    with celery.connection_for_write() as conn:
+        queues = [bind(name, conn) for name in (NOTIFICATIONS_QUEUE, BULK_QUEUE)]
+        for queue in queues:
+            queue.declare()
+
+        threads = [
+            threading.Thread(target=worker, args=(name, stop, queued_at, latencies))
+            for name, count in workers for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+
+        bulk = delivery.prepare_payloads([(chat_id, MESSAGE) for chat_id in range(BULK_MESSAGES)], 'HTML')
+        delivery.broadcast(bulk, host=BULK_HOST)
+        for chat_id in EVENT_CHATS:
+            queued_at[chat_id] = time.perf_counter()
+            delivery.broadcast(delivery.prepare_payloads([(chat_id, MESSAGE)], 'HTML'), host=event_host)
+            time.sleep(EVENT_INTERVAL)
+
+        while len(latencies) < SMALL_EVENTS:
+            time.sleep(0.01)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for queue in queues:
+            queue.purge()
+
+    # rate counters of the hosts would send notifications of the next case into the bulk queue
+    for host in (BULK_HOST, OTHER_HOST):
+        for key in redis_conn.scan_iter(delivery.TENANT_RATE_KEY.format(host, '*')):
+            redis_conn.delete(key)
+    return latencies
+
+
+def single_queue():
+    """Queues all broadcasts into the notifications queue as broadcast did before the routing rules"""
+    small_fanout, tenant_rate = delivery.SMALL_FANOUT, delivery.TENANT_RATE
+    delivery.SMALL_FANOUT, delivery.TENANT_RATE = BULK_MESSAGES, 0
+    try:
+        return run([(NOTIFICATIONS_QUEUE, WORKERS)], OTHER_HOST)
+    finally:
+        delivery.SMALL_FANOUT, delivery.TENANT_RATE = small_fanout, tenant_rate
+
+
+def main():
+    celery.conf.broker_url = 'memory://'
+    routed = [(NOTIFICATIONS_QUEUE, WORKERS - BULK_WORKERS), (BULK_QUEUE, BULK_WORKERS)]
+    label = f'{WORKERS - BULK_WORKERS}+{BULK_WORKERS}'
+    with BenchmarkRedis():
+        rows = [
+            (f'single queue, {WORKERS} workers', single_queue()),
+            (f'routing, {label} workers, other host', run(routed, OTHER_HOST)),
+            (f'routing, {label} workers, busy host', run(routed, BULK_HOST)),
+        ]
+    report(f'Small event latency during a burst of {BULK_MESSAGES} messages', rows)
+
+
+if __name__ == '__main__':
+    main()
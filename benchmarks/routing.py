@@ -0,0 +1,63 @@
+"""
+Per-event routing latency versus subscriber count.
+
+Compares checking the connection of every recipient with a separate
+query against one batched query. Run from the project root:
+    python -m benchmarks.routing
+"""
+from bson.objectid import ObjectId
+
+from .base import BenchmarkDatabase, measure, report
+
+SUBSCRIBER_COUNTS = (10, 100, 500, 1000, 5000)
+PROJECT = 'JTB'
+ISSUE = 'JTB-99'
+
+
+def populate(db, webhook_id, count):
+    """Creates connected users subscribed half to the project and half to the issue"""
+    users = db.conn[db.collection_mapping['user']]
+    subscriptions = db.conn[db.collection_mapping['subscriptions']]
+    users.delete_many({})
+    subscriptions.delete_many({})
+    users.insert_many([
+        {'telegram_id': chat_id, 'auth_method': 'basic' if chat_id % 10 else None}
+        for chat_id in range(count)
+    ])
+    subscriptions.insert_many([
+        {
+            'chat_id': chat_id,
+            'webhook_id': webhook_id,
+            'topic': 'project' if chat_id % 2 else 'issue',
+            'name': PROJECT if chat_id % 2 else ISSUE,
+        }
+        for chat_id in range(count)
+    ])
+
+
+def route_sequential(db, webhook_id):
+    chat_ids = db.get_topic_subscribers(webhook_id, PROJECT, ISSUE)
+    return [chat_id for chat_id in chat_ids if db.is_user_connected(chat_id)]
+
+
+def route_batched(db, webhook_id):
+    chat_ids = db.get_topic_subscribers(webhook_id, PROJECT, ISSUE)
+    connected_users = db.get_connected_users(chat_ids)
+    return [chat_id for chat_id in chat_ids if chat_id in connected_users]
+
+
+def main():
+    with BenchmarkDatabase() as db:
+        db.create_routing_indexes()
+        webhook_id = ObjectId()
+        rows = list()
+        for count in SUBSCRIBER_COUNTS:
+            populate(db, webhook_id, count)
+            repeat = max(3, 5000 // count)
+            rows.append((f'{count} subscribers, per user', measure(lambda: route_sequential(db, webhook_id), repeat)))
+            rows.append((f'{count} subscribers, batched', measure(lambda: route_batched(db, webhook_id), repeat)))
+        report('Routing latency per event', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Local stand-in of the Telegram Bot API for load testing.
+
+Implements getMe, deleteWebhook, getUpdates, sendMessage, editMessageText and
+answerCallbackQuery. Responses are delayed by a configurable latency, sends fail
+with 429 (with retry_after), 403 and 400 errors at configurable rates. Run the bot
+and celery workers with TELEGRAM_API_URL=http://localhost:8081 and start it
+from the project root:
+    python -m benchmarks.telegram_mock [--latency 0.05] [--rate-429 0.01] [--rate-403 0.001]
+Numbers of calls by method and status are served at /stats.
+"""
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+BOT_USER = {'id': 100000001, 'is_bot': True, 'first_name': 'Jira Bot', 'username': 'jtb_mock_bot'}
+# injected errors: a 403 means the bot was blocked, so the chat is pruned by celery workers
+ERRORS = {
+    429: 'Too Many Requests: retry after {}',
+    403: 'Forbidden: bot was blocked by the user',
+    400: "Bad Request: can't parse entities",
+}
+SEND_METHODS = ('sendMessage', 'editMessageText')
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling every connection in a thread, http.server has it only since python 3.7"""
+    daemon_threads = True
+
+
+class MockTelegramServer(ThreadingHTTPServer):
+    """
+    Keeps incoming updates for getUpdates and messages sent by the bot
+    :param address: (host, port)
+    :param latency: seconds every method except getUpdates takes
+    :param jitter: max random seconds added to the latency
+    :param error_rates: dict {status: share of failed sends}
+    :param retry_after: retry_after of 429 errors in seconds
+    """
+
+    def __init__(self, address, latency=0, jitter=0, error_rates=None, retry_after=1):
+        super().__init__(address, MockTelegramHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rates = error_rates or dict()
+        self.retry_after = retry_after
+        self.stats = Counter()
+        self._updates = list()
+        self._update_id = 0
+        self._updates_cond = threading.Condition()
+        self._message_ids = Counter()
+        self._replies = defaultdict(list)
+        self._replies_cond = threading.Condition()
+
+    def push_update(self, update):
+        """
+        Makes an update available for getUpdates
+        :param update: dict of a Telegram update without update_id
+        :return: update_id of the update
+        """
+        with self._updates_cond:
+            self._update_id += 1
+            update['update_id'] = self._update_id
+            self._updates.append(update)
+            self._updates_cond.notify_all()
+        return update['update_id']
+
+    def wait_reply(self, chat_id, timeout):
+        """
+        Waits for a message sent or edited by the bot in a chat
+        :return: the message in dict type or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._replies_cond:
+            while not self._replies[chat_id]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._replies_cond.wait(remaining)
+            return self._replies[chat_id].pop(0)
+
+    def clear_replies(self, chat_id):
+        with self._replies_cond:
+            self._replies.pop(chat_id, None)
+
+    def get_updates(self, offset, limit, timeout):
+        """Long polling: confirms updates before the offset and waits up to timeout seconds for new ones"""
+        deadline = time.monotonic() + timeout
+        with self._updates_cond:
+            if offset:
+                self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_cond.wait(remaining)
+            return self._updates[:limit]
+
+    def send(self, method, payload):
+        """Stores a sent or edited message and returns it as Telegram does"""
+        chat_id = int(payload['chat_id'])
+        if method == 'sendMessage':
+            with self._replies_cond:
+                self._message_ids[chat_id] += 1
+                message_id = self._message_ids[chat_id]
+        else:
+            message_id = int(payload['message_id'])
+
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+            'from': BOT_USER,
+            'text': payload.get('text', ''),
+        }
+        reply_markup = payload.get('reply_markup')
+        if reply_markup:
+            message['reply_markup'] = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+
+        with self._replies_cond:
+            self._replies[chat_id].append(message)
+            self._replies_cond.notify_all()
+        return message
+
+    def draw_error(self):
+        """:return: status of an injected error or None"""
+        draw = random.random()
+        for status, rate in self.error_rates.items():
+            if draw < rate:
+                return status
+            draw -= rate
+
+    def call(self, method, payload):
+        """
+        Handles a method of the Bot API
+        :return: tuple(HTTP status, response body in dict type)
+        """
+        if method == 'getUpdates':
+            updates = self.get_updates(
+                int(payload.get('offset') or 0), int(payload.get('limit') or 100), float(payload.get('timeout') or 0)
+            )
+            return self.respond(method, 200, updates)
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if method == 'getMe':
+            return self.respond(method, 200, BOT_USER)
+        if method in ('deleteWebhook', 'answerCallbackQuery'):
+            return self.respond(method, 200, True)
+        if method in SEND_METHODS:
+            status = self.draw_error()
+            if status:
+                return self.respond(method, status)
+            return self.respond(method, 200, self.send(method, payload))
+        return self.respond(method, 404)
+
+    def respond(self, method, status, result=None):
+        self.stats[f'{method} {status}'] += 1
+        if status == 200:
+            return status, {'ok': True, 'result': result}
+
+        body = {'ok': False, 'error_code': status, 'description': ERRORS.get(status, 'Not Found')}
+        if status == 429:
+            body['description'] = body['description'].format(self.retry_after)
+            body['parameters'] = {'retry_after': self.retry_after}
+        return status, body
+
+
+class MockTelegramHandler(BaseHTTPRequestHandler):
+    """Routes /bot<token>/<method> requests to the server, keep-alive connections are supported"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        url = urlparse(self.path)
+        payload = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length)
+            if 'json' in self.headers.get('Content-Type', ''):
+                payload.update(json.loads(body))
+            else:
+                payload.update(parse_qsl(body.decode()))
+
+        if url.path == '/stats':
+            self.write(200, dict(self.server.stats))
+            return
+
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self.write(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        self.write(*self.server.call(parts[1], payload))
+
+    def write(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def add_arguments(parser):
+    """Adds options of the server into an argument parser"""
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds every call takes')
+    parser.add_argument('--jitter', type=float, default=0.02, help='max random seconds added to the latency')
+    parser.add_argument('--rate-429', type=float, default=0, help='share of sends failed with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after of 429 errors')
+    parser.add_argument('--rate-403', type=float, default=0, help='share of sends failed with 403')
+    parser.add_argument('--rate-400', type=float, default=0, help='share of sends failed with 400')
+
+
+def create_server(args):
+    """Creates the server from parsed options"""
+    return MockTelegramServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rates={429: args.rate_429, 403: args.rate_403, 400: args.rate_400},
+        retry_after=args.retry_after,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in of the Telegram Bot API.')
+    add_arguments(parser)
+    server = create_server(parser.parse_args())
+    print(f'Telegram Bot API stand-in is listening on http://{server.server_address[0]}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(dict(server.stats), indent=2, sort_keys=True))
@@ -0,0 +1,57 @@
+"""
+Notification rendering throughput before and after the templates registry.
+
+"Before" reads a template file from disk for every message as it was done
+by read_template, "after" takes the template from the registry.
+Run from the project root:
+    python -m benchmarks.templates
+"""
+import os
+from string import Template
+
+from lib.utils import BASE_DIR, read_template
+
+from .base import measure, report
+
+TEMPLATES_DIR = os.path.join('web', 'webhooks', 'templates')
+MESSAGES = 1000
+DATA = {
+    'username': 'John Doe',
+    'link': 'https://jira.somecompany.com/browse/JTB-99',
+    'link_name': 'JTB-99',
+    'old_status': 'In Progress',
+    'new_status': 'Done',
+    'user': 'John Doe',
+    'old_resolution': 'Unresolved',
+    'new_resolution': 'Done',
+    'filename': 'screenshot.png',
+    'action': 'attached',
+}
+TEMPLATES = [
+    os.path.join(TEMPLATES_DIR, name)
+    for name in ('issue_status.txt', 'issue_assignee.txt', 'issue_resolution.txt', 'issue_attachment.txt')
+]
+
+
+def read_template_from_disk(filepath):
+    with open(os.path.join(BASE_DIR, filepath)) as file:
+        return Template(file.read())
+
+
+def render(get_template):
+    for i in range(MESSAGES):
+        get_template(TEMPLATES[i % len(TEMPLATES)]).substitute(**DATA)
+
+
+def main():
+    rows = [
+        ('read from disk', measure(lambda: render(read_template_from_disk), 20)),
+        ('templates registry', measure(lambda: render(read_template), 20)),
+    ]
+    report(f'Rendering of {MESSAGES} notifications', rows)
+    for label, timings in rows:
+        print('{:<40}{:>12.0f} messages/s'.format(label, MESSAGES / (min(timings) / 1000)))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,11 +10,13 @@ from telegram import Update as TelegramUpdate
 
 from lib import utils
 from lib.db import MongoBackend
+from lib.telegram_api import BASE_URL
 import bot.commands as commands
 
 from .backends import JiraBackend
 from .messages import MessageFactory
 from .schedules import Scheduler
+from .webhooks import SYNC_DELAY, WebhookFilterSync
 from .exceptions import BaseJTBException, BotAuthError, SendMessageHandlerError, JiraReceivingDataException
 
 
@@ -37,6 +39,7 @@ class JTBApp:
         commands.CreateWebhookCommand,
         commands.UnwatchDispatcherCommand,
         commands.UnsubscribeAllUpdatesCommand,
+        commands.DigestCommand,
         commands.BasicLoginCommand,
         commands.OAuthLoginCommand,
         commands.DisconnectMenuCommand,
@@ -51,12 +54,14 @@ class JTBApp:
     def __init__(self):
         self.updater = Updater(
             config('BOT_TOKEN'),
+            base_url=f'{BASE_URL}/bot',
             workers=config('WORKERS', cast=int, default=3)
         )
 
         self.db = MongoBackend()
         self.jira = JiraBackend()
         self.AuthData = namedtuple('AuthData', 'auth_method jira_host username credentials')
+        self.webhook_sync = WebhookFilterSync(self)
 
         for command in self.commands:
             cb = command(self).command_callback()
@@ -80,6 +85,9 @@ class JTBApp:
     def start(self):
         self.updater.start_polling()
         self.run_scheduler()
+        # syncs of webhook filters scheduled before a restart are lost
+        self.updater.job_queue.run_once(self.webhook_sync.sync_all_job, 0)
+        self.updater.job_queue.run_repeating(self.webhook_sync.sync_requested_job, SYNC_DELAY)
         logger.debug("Jira bot started successfully!")
         self.updater.idle()
 
@@ -1,3 +1,4 @@
+import json
 import logging
 from collections import namedtuple
 from json.decoder import JSONDecodeError
@@ -43,6 +44,19 @@ class JiraBackend:
     Interface for working with Jira service
     """
     issue_data = namedtuple('IssueData', 'key permalink')
+    # events which are processed by webhooks, the others are not sent by Jira
+    webhook_events = [
+        'jira:issue_created',
+        'jira:issue_updated',
+        'jira:issue_deleted',
+        'jira:worklog_updated',
+        'comment_created',
+        'comment_updated',
+        'comment_deleted',
+        'project_created',
+        'project_updated',
+        'project_deleted',
+    ]
 
     @staticmethod
     def is_jira_app(host):
@@ -451,3 +465,54 @@ class JiraBackend:
             raise JiraReceivingDataException(f"getting webhooks for {host}", e.text)
         else:
             return response.json()
+
+    def _webhook_data(self, name, url, jql):
+        return {
+            'name': name,
+            'url': url,
+            'events': self.webhook_events,
+            'filters': {'issue-related-events-section': jql},
+            'excludeBody': False,
+            # Jira sends updates of all issues with an empty filter
+            'enabled': bool(jql),
+        }
+
+    @jira_connect
+    def create_webhook(self, name, url, jql, *args, **kwargs):
+        """
+        Registers a webhook in Jira, administrator permissions are required
+        :param name: name of the webhook
+        :param url: url of the webhook with ${project.key} and ${issue.key} variables
+        :param jql: filter of issue events, the webhook is disabled with an empty filter
+        :return: id of the webhook in Jira
+        """
+        jira_conn = kwargs.get('jira_conn')
+        host = kwargs.get('jira_host')
+
+        try:
+            response = jira_conn._session.post(
+                host + '/rest/webhooks/1.0/webhook', data=json.dumps(self._webhook_data(name, url, jql))
+            )
+        except jira.JIRAError as e:
+            raise JiraReceivingDataException(f"registering a webhook on {host}", e.text)
+        else:
+            return response.json()['self'].rstrip('/').rsplit('/', 1)[-1]
+
+    @jira_connect
+    def update_webhook(self, webhook_id, name, url, jql, *args, **kwargs):
+        """
+        Updates a webhook registered in Jira
+        :param webhook_id: id of the webhook in Jira
+        :param name: name of the webhook
+        :param url: url of the webhook
+        :param jql: filter of issue events, the webhook is disabled with an empty filter
+        """
+        jira_conn = kwargs.get('jira_conn')
+        host = kwargs.get('jira_host')
+
+        try:
+            jira_conn._session.put(
+                f'{host}/rest/webhooks/1.0/webhook/{webhook_id}', data=json.dumps(self._webhook_data(name, url, jql))
+            )
+        except jira.JIRAError as e:
+            raise JiraReceivingDataException(f"updating the webhook {webhook_id} on {host}", e.text)
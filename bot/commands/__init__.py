@@ -23,7 +23,8 @@ from .watch import (
     WatchDispatcherCommand,
     CreateWebhookCommand,
     UnwatchDispatcherCommand,
-    UnsubscribeAllUpdatesCommand)
+    UnsubscribeAllUpdatesCommand,
+    DigestCommand)
 
 from .schedule import (
     ScheduleCommand,
@@ -43,6 +44,7 @@ __all__ = (
     "CreateWebhookCommand",
     "UnwatchDispatcherCommand",
     "UnsubscribeAllUpdatesCommand",
+    "DigestCommand",
     "ContentPaginatorCommand",
     "OAuthLoginCommand",
     "BasicLoginCommand",
@@ -58,6 +58,12 @@ class StartCommand(AbstractCommand):
                     '/start command, username: {}'.format(update.message.from_user.username)
                 )
 
+        # subscriptions of a chat which blocked the bot are disabled until it is started again
+        chat_id = update.message.chat_id
+        if self.app.db.enable_chat_subscriptions(chat_id):
+            for webhook_id in self.app.db.get_chats_webhooks([chat_id]):
+                self.app.webhook_sync.schedule(webhook_id)
+
         bot.send_message(chat_id=update.message.chat_id, text=message)
 
     def command_callback(self):
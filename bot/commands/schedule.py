@@ -20,9 +20,7 @@ class ScheduleCommand(AbstractCommand):
     @property
     def description(self):
         schedule_description = read_file(os.path.join("bot", "templates", "schedule_description.tpl"))
-        example_description = "<b>Commands:</b>\n"
-        example_description += "--------\n".join(["{}\n".format(command.example_description)\
-                                                  for command in schedule_commands])
+        example_description = "<b>Commands:</b>\n" + schedule_commands.examples
         return "{}\n{}".format(schedule_description, example_description)
 
     @login_required
@@ -1,3 +1,4 @@
+import logging
 import os
 from itertools import zip_longest
 
@@ -5,12 +6,15 @@ from decouple import config
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackQueryHandler, CommandHandler
 
+from bot.exceptions import JiraReceivingDataException
 from bot.helpers import login_required
 from bot.inlinemenu import build_menu
 from lib import utils
 
 from .base import AbstractCommand, CommandArgumentParser
 
+WEBHOOK_NAME = 'Jira Telegram Bot'
+
 
 class WatchDispatcherCommand(AbstractCommand):
     """
@@ -75,13 +79,18 @@ class WatchDispatcherCommand(AbstractCommand):
 
 
 class CreateWebhookCommand(AbstractCommand):
-    """Creates a webhook for JIRA host"""
+    """
+    Creates a webhook for JIRA host. The webhook is registered through the Jira API
+    with a filter of watched projects and issues, if the user has no administrator
+    permissions - instructions to create it by hand are sent
+    """
     message_template = (
         'Follow the <a href="http://telegra.ph/Creating-the-Webhook-for-JiraBot-in-Jira-12-22">'
         'instructions</a> and use the link to create a WebHook in your Jira\n\n'
         'Your link: {}')
 
-    def generate_webhook_url(self, webhook_id):
+    @staticmethod
+    def generate_webhook_url(webhook_id):
         """Generates a Webhook URL for processing updates"""
         host = config('OAUTH_SERVICE_URL')
         return '{0}/webhook/{1}'.format(host, webhook_id) + '/${project.key}/${issue.key}/'
@@ -95,10 +104,26 @@ class CreateWebhookCommand(AbstractCommand):
             return self.app.send(bot, update, text='Creating a new webhook was declined')
 
         webhook_id = self.app.db.create_webhook(auth_data.jira_host)
-        if webhook_id:
+        if not webhook_id:
+            return
+
+        # the webhook is disabled until something is watched
+        try:
+            jira_webhook_id = self.app.jira.create_webhook(
+                WEBHOOK_NAME, self.generate_webhook_url(webhook_id), '', auth_data=auth_data
+            )
+        except JiraReceivingDataException as e:
+            logging.info(f'Webhook for {auth_data.jira_host} was not registered: {e.message}')
             text = self.message_template.format(self.generate_webhook_url(webhook_id))
             return self.app.send(bot, update, text=text)
 
+        self.app.db.update_webhook(
+            {'jira_webhook_id': jira_webhook_id, 'owner_id': update.callback_query.from_user.id, 'jql': ''},
+            webhook_id=webhook_id
+        )
+        text = f'Webhook was registered in {auth_data.jira_host}, now you can watch projects and issues'
+        return self.app.send(bot, update, text=text)
+
     def command_callback(self):
         return CallbackQueryHandler(self.handler, pattern=r'^create_webhook:')
 
@@ -112,7 +137,15 @@ class CreateSubscribeCommand(AbstractCommand):
         name = kwargs.get('name').upper()
         chat_id = update.message.chat_id
 
-        if self.app.db.get_subscription(chat_id, name):
+        subscription = self.app.db.get_subscription(chat_id, name)
+        if subscription and subscription.get('disabled'):
+            # the chat is reachable again, so all its subscriptions disabled by pruning are enabled
+            self.app.db.enable_chat_subscriptions(chat_id)
+            for webhook_id in self.app.db.get_chats_webhooks([chat_id]):
+                self.app.webhook_sync.schedule(webhook_id)
+            text = f'Now you will be notified about updates from {name}'
+            return self.app.send(bot, update, text=text)
+        if subscription:
             text = 'You already subscribed on this updates'
             return self.app.send(bot, update, text=text)
 
@@ -127,6 +160,7 @@ class CreateSubscribeCommand(AbstractCommand):
 
         status = self.app.db.create_subscription(data)
         if status:
+            self.app.webhook_sync.schedule(webhook.get('_id'))
             text = f'Now you will be notified about updates from {name}'
             return self.app.send(bot, update, text=text)
 
@@ -193,9 +227,12 @@ class UnsubscribeAllUpdatesCommand(AbstractCommand):
             return self.app.send(bot, update, text='Unsubscribing from all updates was declined')
 
         user = self.app.db.get_user_data(update.callback_query.message.chat_id)
+        webhook_ids = {sub.get('webhook_id') for sub in self.app.db.get_user_subscriptions(user.get('_id'))}
         status = self.app.db.delete_all_subscription(user.get('_id'))
 
         if status:
+            for webhook_id in webhook_ids:
+                self.app.webhook_sync.schedule(webhook_id)
             text = 'You are unsubscribed from all updates'
             return self.app.send(bot, update, text=text)
 
@@ -214,14 +251,53 @@ class UnsubscribeOneItemCommand(AbstractCommand):
         name = kwargs.get('name').upper()
         chat_id = update.message.chat_id
 
-        if not self.app.db.get_subscription(chat_id, name):
+        subscription = self.app.db.get_subscription(chat_id, name)
+        if not subscription:
             text = f'You were not subscribed to {name} {topic.lower()} updates'
             return self.app.send(bot, update, text=text)
 
         status = self.app.db.delete_subscription(chat_id, name)
         if status:
+            self.app.webhook_sync.schedule(subscription.get('webhook_id'))
             text = f'You were unsubscribed from {name} {topic.lower()} updates'
             return self.app.send(bot, update, text=text)
 
         text = f"Can't unsubscribe you from {name} {topic.lower()} updates, please try again later"
         return self.app.send(bot, update, text=text)
+
+
+class DigestCommand(AbstractCommand):
+    """
+    /digest hourly - Receive notifications on updates once an hour
+    /digest daily - Receive notifications on updates once a day
+    /digest off - Receive notifications on updates at once
+    """
+    periods = ('hourly', 'daily')
+    disable_option = 'off'
+
+    @property
+    def description(self):
+        return utils.read_file(os.path.join('bot', 'templates', 'digest_description.tpl'))
+
+    @login_required
+    def handler(self, bot, update, *args, **kwargs):
+        options = kwargs.get('args')
+        chat_id = update.message.chat_id
+
+        period = options[0].lower() if options else None
+        if period not in self.periods + (self.disable_option,):
+            return self.app.send(bot, update, text=self.description)
+
+        if period == self.disable_option:
+            status = self.app.db.update_user(chat_id, {'digest': None})
+            text = 'Now you will be notified about updates at once'
+        else:
+            status = self.app.db.update_user(chat_id, {'digest': period})
+            text = f'Now you will receive notifications about updates {period}'
+
+        if not status:
+            text = "Can't change the digest mode at this moment, please try again later"
+        return self.app.send(bot, update, text=text)
+
+    def command_callback(self):
+        return CommandHandler('digest', self.handler, pass_args=True)
@@ -51,6 +51,7 @@ class ScheduleCommands(metaclass=Singleton):
     and get registered commands as `schedule_commands.values()`.
     """
     __commands = dict()
+    __examples = None
 
     def register(self, command, cls):
         if not issubclass(cls, AbstractCommand):
@@ -71,6 +72,14 @@ class ScheduleCommands(metaclass=Singleton):
         # monkey patching for command error handler
         cls.handler = error_wrapper(cls.handler)
         self.__commands[command] = cls
+        self.__examples = None
+
+    @property
+    def examples(self):
+        """Example descriptions of all registered commands joined into one text"""
+        if self.__examples is None:
+            self.__examples = "--------\n".join(["{}\n".format(cls.example_description) for cls in self.values()])
+        return self.__examples
 
     def items(self):
         raise AttributeError("Not implemented")
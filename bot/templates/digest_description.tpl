@@ -0,0 +1,4 @@
+<b>Command description:</b>
+/digest hourly - Receive notifications on updates once an hour
+/digest daily - Receive notifications on updates once a day
+/digest off - Receive notifications on updates at once
\ No newline at end of file
@@ -8,6 +8,7 @@
 /unschedule - remove a command from schedule list
 /watch - subscribe to updates on projects and issues
 /unwatch - unsubscribe from updates on projects and issues
+/digest - receive notifications on updates hourly or daily
 /connect - login to a host using user/pass
 /oauth - login to a host using OAuth
 /disconnect - delete user credentials from DB
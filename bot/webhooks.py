@@ -0,0 +1,89 @@
+import logging
+import threading
+
+from decouple import config
+
+from lib.utils import build_webhook_jql
+from .commands.watch import WEBHOOK_NAME, CreateWebhookCommand
+
+logger = logging.getLogger('bot')
+
+# changes of subscriptions are collected for SYNC_DELAY seconds and synced into Jira at once
+SYNC_DELAY = config('WEBHOOK_SYNC_DELAY', default=30, cast=int)
+
+
+class WebhookFilterSync:
+    """
+    Keeps the JQL filter of webhooks registered in Jira in sync with subscriptions,
+    so Jira sends only updates of watched projects and issues. A sync is scheduled
+    into the job queue, the following changes of subscriptions made before it runs
+    don't schedule another one. Pending syncs are lost on restart, so filters of all
+    registered webhooks are synced at startup. Syncs requested by the web service
+    (e.g. after pruning unreachable chats) are picked up every SYNC_DELAY seconds
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, webhook_id):
+        """
+        Schedules a sync of a webhook filter
+        :param webhook_id: ObjectId of a webhook (webhook collection)
+        """
+        webhook_id = str(webhook_id)
+        with self._lock:
+            if webhook_id in self._pending:
+                return
+            self._pending.add(webhook_id)
+        self.app.updater.job_queue.run_once(self.sync_job, SYNC_DELAY, context=webhook_id)
+
+    def sync_job(self, bot, job):
+        with self._lock:
+            self._pending.discard(job.context)
+        try:
+            self.sync(job.context)
+        except Exception as e:
+            logger.error(f'Syncing a filter of the webhook {job.context} failed: {e}')
+
+    def sync_all_job(self, bot, job):
+        """Syncs filters of all webhooks registered in Jira, unchanged filters are skipped"""
+        for webhook_id in self.app.db.get_registered_webhooks():
+            try:
+                self.sync(webhook_id)
+            except Exception as e:
+                logger.error(f'Syncing a filter of the webhook {webhook_id} failed: {e}')
+
+    def sync_requested_job(self, bot, job):
+        """Syncs filters of webhooks marked by the web service"""
+        for webhook_id in self.app.db.get_webhooks_to_sync():
+            try:
+                self.sync(webhook_id)
+            except Exception as e:
+                logger.error(f'Syncing a filter of the webhook {webhook_id} failed: {e}')
+
+    def sync(self, webhook_id):
+        """
+        Updates the filter of a webhook registered in Jira if watched projects or issues were changed.
+        Credentials of the user who registered the webhook are used
+        """
+        webhook = self.app.db.get_webhook(webhook_id=webhook_id)
+        if not webhook or not webhook.get('jira_webhook_id'):
+            return
+
+        topics = self.app.db.get_webhook_topics(webhook.get('_id'))
+        jql = build_webhook_jql(topics['project'], topics['issue'])
+        if jql == webhook.get('jql'):
+            return
+
+        auth_data = self.app.authorization(webhook.get('owner_id'))
+        self.app.jira.update_webhook(
+            webhook.get('jira_webhook_id'),
+            WEBHOOK_NAME,
+            CreateWebhookCommand.generate_webhook_url(webhook_id),
+            jql,
+            auth_data=auth_data
+        )
+        self.app.db.update_webhook({'jql': jql}, webhook_id=webhook_id)
+        logger.info(f'Filter of the webhook {webhook_id} was updated: {jql or "disabled"}')
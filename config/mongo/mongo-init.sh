@@ -14,4 +14,6 @@ db.createUser({
 db.createCollection("users");
 db.createCollection("hosts");
 db.cache.createIndex({ "createdAt": 1 }, { expireAfterSeconds: 3600 });
+db.users.createIndex({ "telegram_id": 1 });
+db.subscriptions.createIndex({ "webhook_id": 1, "topic": 1, "name": 1 });
 EOF
@@ -4,8 +4,8 @@ import logging
 
 from bson.objectid import ObjectId
 from decouple import config
-from pymongo import MongoClient
-from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+from pymongo import ASCENDING, MongoClient, WriteConcern
+from pymongo.errors import CollectionInvalid, OperationFailure, ServerSelectionTimeoutError
 
 
 def create_connection(**kwargs):
@@ -68,6 +68,8 @@ class MongoBackend:
         'webhook': config('DB_WEBHOOK_COLLECTION', default='webhooks'),
         'subscriptions': config('DB_SUBSCRIPTIONS_COLLECTION', default='subscriptions'),
         'schedule': config("SCHEDULE_COLLECTION", "schedules"),
+        'dead_letter': config('DB_DEAD_LETTER_COLLECTION', default='dead_letters'),
+        'journal': config('DB_JOURNAL_COLLECTION', default='journal'),
     }
 
     def __init__(self, conn=None, **kwargs):
@@ -106,6 +108,32 @@ class MongoBackend:
         collection = self._get_collection('user')
         return collection.count({"telegram_id": telegram_id, "auth_method": {"$ne":None}}) > 0
 
+    def get_connected_users(self, telegram_ids):
+        """
+        Checks the connection of several users with one query
+        :param telegram_ids: iterable of telegram ids
+        :return: set of telegram ids of connected users
+        """
+        collection = self._get_collection('user')
+        users = collection.find(
+            {'telegram_id': {'$in': list(telegram_ids)}, 'auth_method': {'$ne': None}},
+            {'telegram_id': 1, '_id': 0}
+        )
+        return {user.get('telegram_id') for user in users}
+
+    def get_digest_chats(self, telegram_ids):
+        """
+        Returns users which receive notifications in digest mode with one query
+        :param telegram_ids: iterable of telegram ids
+        :return: dict with telegram ids and digest periods e.g. {208810129: 'hourly'}
+        """
+        collection = self._get_collection('user')
+        users = collection.find(
+            {'telegram_id': {'$in': list(telegram_ids)}, 'digest': {'$ne': None}},
+            {'telegram_id': 1, 'digest': 1, '_id': 0}
+        )
+        return {user.get('telegram_id'): user.get('digest') for user in users}
+
     def get_user_data(self, user_id):
         collection = self._get_collection('user')
         user = collection.find_one({'telegram_id': user_id})
@@ -206,6 +234,38 @@ class MongoBackend:
             webhook = collection.find_one({'host_url': host_url})
         return webhook
 
+    def request_webhooks_sync(self, webhook_ids):
+        """
+        Marks webhooks which filters have to be synced with subscriptions by the bot
+        :param webhook_ids: iterable of ObjectIds of webhooks
+        :return: updated webhooks count
+        """
+        collection = self._get_collection('webhook')
+        result = collection.update_many({'_id': {'$in': list(webhook_ids)}}, {'$set': {'sync_required': True}})
+        return result.modified_count
+
+    def get_webhooks_to_sync(self):
+        """
+        Returns ids of webhooks marked by `request_webhooks_sync`, the marks are removed
+        :return: list of string ObjectIds
+        """
+        collection = self._get_collection('webhook')
+        webhooks = [str(webhook.get('_id')) for webhook in collection.find({'sync_required': True}, {'_id': 1})]
+        if webhooks:
+            collection.update_many(
+                {'_id': {'$in': [ObjectId(webhook_id) for webhook_id in webhooks]}}, {'$unset': {'sync_required': ''}}
+            )
+        return webhooks
+
+    def get_registered_webhooks(self):
+        """
+        Returns ids of webhooks which are registered in Jira by the bot
+        :return: list of string ObjectIds
+        """
+        collection = self._get_collection('webhook')
+        webhooks = collection.find({'jira_webhook_id': {'$nin': [None, '']}}, {'_id': 1})
+        return [str(webhook.get('_id')) for webhook in webhooks]
+
     def create_subscription(self, data):
         """
         Creates a subscription on project or issue
@@ -226,6 +286,17 @@ class MongoBackend:
         subscription = collection.find_one({'chat_id': chat_id, 'name': name})
         return subscription
 
+    def get_subscribed_chats(self, name, chat_ids):
+        """
+        Returns chats from the list which are subscribed to a project or an issue
+        :param name: an issue key e.g. JTB-99
+        :param chat_ids: list of telegram chat ids
+        :return: set of chat_ids
+        """
+        collection = self._get_collection('subscriptions')
+        subs = collection.find({'chat_id': {'$in': list(chat_ids)}, 'name': name}, {'chat_id': 1, '_id': 0})
+        return {sub.get('chat_id') for sub in subs}
+
     def get_webhook_subscriptions(self, webhook_id):
         """
         Returns all subscriptions linked to a webhook
@@ -236,6 +307,76 @@ class MongoBackend:
         subs = collection.find({'webhook_id': webhook_id})
         return subs
 
+    def create_routing_indexes(self):
+        """
+        Creates indexes which are used for routing webhook updates to subscribers:
+        a compound (webhook_id, topic, name) index on subscriptions and a telegram_id
+        index on users. Creating an already existing index does nothing, so it is
+        safe to call at startup
+        """
+        self._get_collection('subscriptions').create_index(
+            [('webhook_id', ASCENDING), ('topic', ASCENDING), ('name', ASCENDING)],
+            background=True
+        )
+        self._get_collection('user').create_index('telegram_id', background=True)
+
+    def get_topic_subscribers(self, webhook_id, project, issue=None):
+        """
+        Returns chat ids subscribed to a project or an issue through a webhook.
+        The query uses the (webhook_id, topic, name) index, so only matching
+        subscriptions are fetched instead of every webhook subscription
+        :param webhook_id: ObjectId of an exists webhook (webhook collection)
+        :param project: project key e.g. JTB
+        :param issue: issue key e.g. JTB-99
+        :return: set of chat_ids
+        """
+        topics = [{'topic': 'project', 'name': project}]
+        if issue:
+            topics.append({'topic': 'issue', 'name': issue})
+
+        collection = self._get_collection('subscriptions')
+        subs = collection.find(
+            {'webhook_id': webhook_id, '$or': topics, 'disabled': {'$ne': True}},
+            {'chat_id': 1, '_id': 0}
+        )
+        return {sub.get('chat_id') for sub in subs}
+
+    def get_subscribers_by_topic(self, webhook_id, topics):
+        """
+        Returns chat ids subscribed to several topics through a webhook with one query
+        :param webhook_id: ObjectId of an exists webhook (webhook collection)
+        :param topics: iterable of (topic, name) pairs e.g. ('project', 'JTB'), ('issue', 'JTB-99')
+        :return: dict with (topic, name) keys and sets of chat_ids
+        """
+        topics = [{'topic': topic, 'name': name} for topic, name in set(topics)]
+        subscribers = dict()
+        if not topics:
+            return subscribers
+
+        collection = self._get_collection('subscriptions')
+        subs = collection.find(
+            {'webhook_id': webhook_id, '$or': topics, 'disabled': {'$ne': True}},
+            {'topic': 1, 'name': 1, 'chat_id': 1}
+        )
+        for sub in subs:
+            subscribers.setdefault((sub.get('topic'), sub.get('name')), set()).add(sub.get('chat_id'))
+        return subscribers
+
+    def get_webhook_topics(self, webhook_id):
+        """
+        Returns names of projects and issues watched through a webhook,
+        the query uses the (webhook_id, topic, name) index
+        :param webhook_id: ObjectId of an exists webhook (webhook collection)
+        :return: dict with topics and sorted lists of names e.g. {'project': ['JTB'], 'issue': ['JTB-99']}
+        """
+        collection = self._get_collection('subscriptions')
+        return {
+            topic: sorted(collection.distinct(
+                'name', {'webhook_id': webhook_id, 'topic': topic, 'disabled': {'$ne': True}}
+            ))
+            for topic in ('project', 'issue')
+        }
+
     def get_user_subscriptions(self, user_id):
         """
         Returns all subscriptions linked to a user
@@ -256,6 +397,16 @@ class MongoBackend:
         status = collection.remove({'chat_id': chat_id, 'name': name})
         return bool(status)
 
+    def delete_chats_subscription(self, name, chat_ids):
+        """
+        Deletes a subscription to a project or an issue for several chats
+        :param name: an issue key e.g. JTB-99
+        :param chat_ids: list of telegram chat ids
+        """
+        collection = self._get_collection('subscriptions')
+        status = collection.delete_many({'chat_id': {'$in': list(chat_ids)}, 'name': name})
+        return bool(status.deleted_count)
+
     def delete_all_subscription(self, user_id):
         """
         Deletes all subscriptions linked to a user
@@ -265,6 +416,46 @@ class MongoBackend:
         status = collection.remove({'user_id': user_id})
         return bool(status)
 
+    def get_chats_webhooks(self, chat_ids):
+        """
+        Returns webhooks which chats are subscribed through
+        :param chat_ids: iterable of telegram chat ids
+        :return: set of ObjectIds of webhooks
+        """
+        collection = self._get_collection('subscriptions')
+        return set(collection.distinct('webhook_id', {'chat_id': {'$in': list(chat_ids)}}))
+
+    def disable_chats_subscriptions(self, chat_ids):
+        """
+        Disables all subscriptions of several chats, disabled subscriptions are skipped by routing
+        :param chat_ids: list of telegram chat ids
+        :return: updated subscriptions count
+        """
+        collection = self._get_collection('subscriptions')
+        result = collection.update_many({'chat_id': {'$in': list(chat_ids)}}, {'$set': {'disabled': True}})
+        return result.modified_count
+
+    def enable_chat_subscriptions(self, chat_id):
+        """
+        Enables subscriptions of a chat which were disabled
+        :param chat_id: a telegram chat id e.g. 283902890
+        :return: updated subscriptions count
+        """
+        collection = self._get_collection('subscriptions')
+        result = collection.update_many({'chat_id': chat_id, 'disabled': True}, {'$unset': {'disabled': ''}})
+        return result.modified_count
+
+    def migrate_chat_subscriptions(self, chat_id, new_chat_id):
+        """
+        Moves subscriptions of a group which was upgraded to a supergroup
+        :param chat_id: old telegram chat id
+        :param new_chat_id: new telegram chat id
+        :return: updated subscriptions count
+        """
+        collection = self._get_collection('subscriptions')
+        result = collection.update_many({'chat_id': chat_id}, {'$set': {'chat_id': new_chat_id}})
+        return result.modified_count
+
     def get_schedule_commands(self, user_id):
         """Return list of schedules entries.
 
@@ -288,3 +479,75 @@ class MongoBackend:
         collection = self._get_collection('schedule')
         result = collection.delete_one({"_id": ObjectId(entry_id)})
         return result.deleted_count
+
+    def create_dead_letter(self, data):
+        """
+        Saves a message which couldn't be delivered into Telegram
+        :param data: dict with method, payload, reason and attempts
+        """
+        collection = self._get_collection('dead_letter')
+        data['createdAt'] = datetime.utcnow()
+        status = collection.insert_one(data)
+        return bool(status)
+
+    def get_dead_letters(self, limit):
+        """
+        Returns the oldest undelivered messages
+        :param limit: max number of messages
+        :return: list of dict messages
+        """
+        collection = self._get_collection('dead_letter')
+        return list(collection.find().sort('createdAt', ASCENDING).limit(limit))
+
+    def delete_dead_letters(self, ids):
+        """
+        Deletes undelivered messages with one query
+        :param ids: list of ObjectIds
+        :return: deleted messages count
+        """
+        collection = self._get_collection('dead_letter')
+        result = collection.delete_many({'_id': {'$in': list(ids)}})
+        return result.deleted_count
+
+    def create_journal(self, size):
+        """
+        Creates the capped collection of received webhook updates, the oldest updates
+        are overwritten when it reaches the size. An existing collection is kept as is
+        :param size: max size of the collection in bytes
+        """
+        try:
+            self._conn.create_collection(self.collection_mapping['journal'], capped=True, size=size)
+        except CollectionInvalid:  # already created
+            pass
+
+    def journal_update(self, data):
+        """
+        Appends a received webhook update into the journal. The write is not acknowledged,
+        so it doesn't wait for the database
+        :param data: dict with raw body of the update in `data` and webhook url arguments in `kwargs`
+        """
+        collection = self._get_collection('journal').with_options(write_concern=WriteConcern(w=0))
+        data['receivedAt'] = datetime.utcnow()
+        collection.insert_one(data)
+
+    def get_journal(self, since=None, until=None, webhook_id=None, limit=None):
+        """
+        Returns journaled webhook updates in order of their arrival
+        :param since: datetime of the first update
+        :param until: datetime after the last update
+        :param webhook_id: string ObjectId of a webhook, updates of all webhooks by default
+        :param limit: max number of updates, all by default
+        :return: cursor of dict updates
+        """
+        query = dict()
+        if since or until:
+            query['receivedAt'] = {}
+            if since:
+                query['receivedAt']['$gte'] = since
+            if until:
+                query['receivedAt']['$lt'] = until
+        if webhook_id:
+            query['kwargs.webhook_id'] = webhook_id
+
+        collection = self._get_collection('journal')
+        return collection.find(query).sort('$natural', ASCENDING).limit(limit or 0)
@@ -0,0 +1,174 @@
+# Every tenant has its own list of items and is put into the ring of active
+# tenants when its first item is queued. Items are taken in deficit round-robin
+# order: a tenant taken from the head of the ring gets quantum * weight more
+# credit and takes as many items as its credit allows. The tenant is out of the
+# ring until its items are processed, so items of one tenant are never processed
+# concurrently, and it is returned to the tail only if it still has items.
+# The active flag of a tenant in the ring never expires, however long the ring is;
+# a taken tenant's flag expires after the timeout, so a dead consumer doesn't keep
+# the tenant out of the ring forever (it is activated by its next item).
+# A lane is acquired when a tenant is activated, and by any item pushed while no lane
+# is held and the ring is not empty, so tenants waiting in the ring are processed again
+# after all consumers died and their lanes expired.
+# Keys of a taken tenant are built inside TAKE_SCRIPT, so the lists of all
+# tenants must be on the same Redis server.
+
+# KEYS - items, active flag, ring, weights and lanes
+# ARGV - item, tenant, weight and expiration of a lane
+# returns index of an acquired lane if the tenant was activated and a lane is free
+# or no lane is held while the ring isn't empty, otherwise -1
+PUSH_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[2], ARGV[3])
+if redis.call('SET', KEYS[2], 1, 'NX') then
+    redis.call('RPUSH', KEYS[3], ARGV[2])
+else
+    if redis.call('LLEN', KEYS[3]) == 0 then
+        return -1
+    end
+    for i = 5, #KEYS do
+        if redis.call('EXISTS', KEYS[i]) == 1 then
+            return -1
+        end
+    end
+end
+for i = 5, #KEYS do
+    if redis.call('SET', KEYS[i], 1, 'NX', 'EX', ARGV[4]) then
+        return i - 5
+    end
+end
+return -1
+"""
+
+# KEYS - ring, weights and deficits
+# ARGV - quantum, expiration of the active flag, templates of item and active flag keys
+TAKE_SCRIPT = """
+local tenant = redis.call('LPOP', KEYS[1])
+if not tenant then
+    return false
+end
+local items_key = string.gsub(ARGV[3], '{}', tenant)
+local weight = tonumber(redis.call('HGET', KEYS[2], tenant)) or 1
+local deficit = (tonumber(redis.call('HGET', KEYS[3], tenant)) or 0) + tonumber(ARGV[1]) * weight
+local share = math.floor(deficit)
+local items = {}
+if share > 0 then
+    items = redis.call('LRANGE', items_key, 0, share - 1)
+    redis.call('LTRIM', items_key, share, -1)
+end
+redis.call('HSET', KEYS[3], tenant, tostring(deficit - #items))
+redis.call('EXPIRE', string.gsub(ARGV[4], '{}', tenant), ARGV[2])
+return {tenant, items}
+"""
+
+# KEYS - items, active flag, ring and deficits, ARGV - tenant
+# returns 1 if the tenant was returned into the ring
+RELEASE_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) > 0 then
+    redis.call('PERSIST', KEYS[2])
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+    return 1
+end
+redis.call('HDEL', KEYS[4], ARGV[1])
+redis.call('DEL', KEYS[2])
+return 0
+"""
+
+# KEYS - lanes, ARGV - expiration
+ACQUIRE_LANE_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('SET', KEYS[i], 1, 'NX', 'EX', ARGV[1]) then
+        return i - 1
+    end
+end
+return -1
+"""
+
+
+class FairQueue:
+    """
+    Distributed queue with a separate list for every tenant, items of different
+    tenants are taken in deficit round-robin order. Tenants are processed by at most
+    `lanes` consumers at once, a consumer holds a lane while there are active tenants
+    :param redis: redis client
+    :param quantum: number of items a tenant of weight 1 takes per turn
+    :param lanes: max number of concurrent consumers
+    :param prefix: prefix of keys in Redis
+    :param timeout: seconds after which a tenant or a lane of a dead consumer is released
+    """
+
+    def __init__(self, redis, quantum=20, lanes=4, prefix='fair', timeout=300):
+        self.redis = redis
+        self.quantum = quantum
+        self.lanes = lanes
+        self.prefix = prefix
+        self.timeout = timeout
+        self.items_key = prefix + ':{}:items'
+        self.active_key = prefix + ':{}:active'
+        self.ring_key = prefix + ':ring'
+        self.weights_key = prefix + ':weights'
+        self.deficits_key = prefix + ':deficits'
+        self.lane_keys = [f'{prefix}:lane:{lane}' for lane in range(lanes)]
+        self._push = redis.register_script(PUSH_SCRIPT)
+        self._take = redis.register_script(TAKE_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._acquire_lane = redis.register_script(ACQUIRE_LANE_SCRIPT)
+
+    def push(self, tenant, item, weight=1):
+        """
+        Queues an item of a tenant
+        :param tenant: tenant id
+        :param item: str or bytes
+        :param weight: share of the tenant relative to the others
+        :return: index of a lane acquired for a new consumer or None
+        """
+        keys = [self.items_key.format(tenant), self.active_key.format(tenant), self.ring_key, self.weights_key]
+        lane = self._push(keys=keys + self.lane_keys, args=[item, tenant, weight, self.timeout])
+        return lane if lane >= 0 else None
+
+    def take(self):
+        """
+        Takes items of the next tenant, the tenant must be released after processing them
+        :return: (tenant, list of items) or None if there are no active tenants
+        """
+        keys = [self.ring_key, self.weights_key, self.deficits_key]
+        turn = self._take(keys=keys, args=[self.quantum, self.timeout, self.items_key, self.active_key])
+        if turn:
+            return turn[0].decode(), turn[1]
+
+    def release(self, tenant):
+        """
+        Returns a taken tenant into the ring if it has items
+        :return: True if the tenant is still active
+        """
+        keys = [self.items_key.format(tenant), self.active_key.format(tenant), self.ring_key, self.deficits_key]
+        return bool(self._release(keys=keys, args=[tenant]))
+
+    def acquire_lane(self):
+        """:return: index of an acquired lane or None if all lanes are busy"""
+        lane = self._acquire_lane(keys=self.lane_keys, args=[self.timeout])
+        return lane if lane >= 0 else None
+
+    def refresh_lane(self, lane):
+        self.redis.expire(self.lane_keys[lane], self.timeout)
+
+    def release_lane(self, lane):
+        """
+        Releases a lane of a consumer which found no active tenants
+        :return: index of a lane acquired again if a tenant was activated meanwhile, otherwise None
+        """
+        self.redis.delete(self.lane_keys[lane])
+        if self.redis.llen(self.ring_key):
+            return self.acquire_lane()
+
+    def backlog(self):
+        """
+        :return: dict with tenants and number of their queued items,
+                 only tenants which are in the ring or being processed are counted
+        """
+        tenants = set(self.redis.lrange(self.ring_key, 0, -1)) | set(self.redis.hkeys(self.deficits_key))
+        tenants = sorted(tenant.decode() for tenant in tenants)
+        pipe = self.redis.pipeline(transaction=False)
+        for tenant in tenants:
+            pipe.llen(self.items_key.format(tenant))
+        return dict(zip(tenants, pipe.execute()))
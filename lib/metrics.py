@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())))
+
+
+class Metrics:
+    """
+    Counters shared by all processes through a Redis hash.
+    They are rendered in the Prometheus text format together with gauges
+    which are calculated at the moment of rendering
+    :param redis: redis client
+    :param key: key of the hash with counters
+    """
+
+    def __init__(self, redis, key='metrics'):
+        self.redis = redis
+        self.key = key
+
+    def incr(self, name, amount=1, **labels):
+        """
+        Increments a counter
+        :param name: metric name e.g. jtb_updates_total
+        :param amount: increment
+        :param labels: labels of the series e.g. webhook='5a6f2d3e...'
+        """
+        self.redis.hincrby(self.key, _series(name, labels), amount)
+
+    def counters(self):
+        """:return: dict with series and their values"""
+        return {series.decode(): int(value) for series, value in self.redis.hgetall(self.key).items()}
+
+    def render(self, gauges=()):
+        """
+        :param gauges: list of (name, labels, value) tuples
+        :return: all counters and gauges in the Prometheus text format
+        """
+        metrics = OrderedDict()
+        for series, value in sorted(self.counters().items()):
+            metrics.setdefault((series.split('{')[0], 'counter'), list()).append((series, value))
+        for name, labels, value in gauges:
+            metrics.setdefault((name, 'gauge'), list()).append((_series(name, labels), value))
+
+        lines = list()
+        for (name, metric_type), samples in metrics.items():
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(f'{series} {value}' for series, value in samples)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,60 @@
+import time
+
+# Takes a token from every bucket only if all of them have one, otherwise
+# returns seconds until the emptiest bucket has a token. Buckets are refilled
+# lazily: the number of tokens is recalculated from the time of the last take.
+# KEYS - bucket keys, ARGV - current time and (rate, capacity) of every bucket
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    redis.call('HMSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return '0'
+"""
+
+
+class TokenBucketLimiter:
+    """
+    Distributed token-bucket rate limiter. State of the buckets is kept in Redis,
+    so all processes sharing a Redis server share the limits
+    :param redis: redis client
+    :param buckets: dict with bucket names and (rate per second, capacity)
+    :param prefix: prefix of bucket keys in Redis
+    """
+
+    def __init__(self, redis, buckets, prefix='ratelimit'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT)
+
+    def acquire(self, *buckets):
+        """
+        Takes a token from several buckets at once, nothing is taken if any of them is empty
+        :param buckets: (bucket name, key) pairs e.g. ('chat', 208810129)
+        :return: 0 if tokens were taken, otherwise seconds to wait before the next attempt
+        """
+        keys, args = list(), [time.time()]
+        for name, key in buckets:
+            keys.append(f'{self.prefix}:{name}:{key}')
+            args.extend(self.buckets[name])
+        return float(self._acquire(keys=keys, args=args))
@@ -0,0 +1,112 @@
+import os
+
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+# a local stand-in of the Bot API may be used for load testing (see benchmarks.telegram_mock)
+BASE_URL = config('TELEGRAM_API_URL', default='https://api.telegram.org')
+API_URL = BASE_URL + '/bot{}/{}'
+# (connect, read) timeouts of a request in seconds
+TIMEOUT = (
+    config('TELEGRAM_CONNECT_TIMEOUT', default=3.05, cast=float),
+    config('TELEGRAM_READ_TIMEOUT', default=10, cast=float),
+)
+# keep-alive connections of a process, should be not less than the worker concurrency
+POOL_SIZE = config('TELEGRAM_POOL_SIZE', default=30, cast=int)
+
+
+class TelegramConnectionError(Exception):
+    """Network error during a request to the Telegram Bot API. The message never contains the bot token"""
+
+
+class TelegramResponse:
+    """
+    Parsed response of the Telegram Bot API
+    :param status_code: HTTP status code
+    :param data: decoded JSON body of the response
+    """
+
+    def __init__(self, status_code, data):
+        parameters = data.get('parameters') or dict()
+        self.status_code = status_code
+        self.ok = bool(data.get('ok'))
+        self.result = data.get('result')
+        self.description = data.get('description', '')
+        self.retry_after = parameters.get('retry_after')
+        self.migrate_to_chat_id = parameters.get('migrate_to_chat_id')
+
+    @property
+    def message_id(self):
+        """Id of a sent or edited message"""
+        if isinstance(self.result, dict):
+            return self.result.get('message_id')
+
+    def __repr__(self):
+        return f'<TelegramResponse {self.status_code} {self.description or "OK"}>'
+
+
+class TelegramClient:
+    """
+    Outbound client of the Telegram Bot API. Requests are sent as POST with a JSON body
+    through a pool of keep-alive connections, the bot token is used only in the request path
+    :param token: bot token, BOT_TOKEN by default
+    :param timeout: (connect, read) timeouts in seconds
+    :param pool_size: max number of kept connections
+    """
+
+    def __init__(self, token=None, timeout=TIMEOUT, pool_size=POOL_SIZE):
+        self._token = token or config('BOT_TOKEN')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def call(self, method, payload):
+        """
+        Calls a method of the Bot API
+        :param method: method name e.g. sendMessage
+        :param payload: dict with method parameters
+        :return: TelegramResponse
+        :raise TelegramConnectionError: if the request failed or timed out
+        """
+        try:
+            response = self.session.post(API_URL.format(self._token, method), json=payload, timeout=self.timeout)
+        except requests.RequestException as error:
+            # errors of requests contain the url, so the token is cut from the message
+            raise TelegramConnectionError(f'{method}: {error}'.replace(self._token, '<token>')) from None
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'description': response.reason}
+        return TelegramResponse(response.status_code, data)
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        payload = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        return self.call('sendMessage', payload)
+
+    def edit_message_text(self, chat_id, message_id, text, parse_mode=None):
+        payload = {'chat_id': chat_id, 'message_id': message_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        return self.call('editMessageText', payload)
+
+
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    Returns the client of the current process. It is created on the first call,
+    so forked worker processes never share connections of their parent
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = TelegramClient()
+        _client_pid = os.getpid()
+    return _client
@@ -18,6 +18,10 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 HOSTNAME_RE = re.compile(r'^http[s]?://([^:/\s]+)?$')
 HTTP_PROTOCOL = re.compile(r'^http[s]?://')
 EMAIL_ADDRESS = re.compile(r'([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)')
+# max length of a Telegram message text
+MESSAGE_LIMIT = 4096
+# a webhook filter with more issues is widened to the projects of the issues
+WEBHOOK_JQL_MAX_ISSUES = config('WEBHOOK_JQL_MAX_ISSUES', default=300, cast=int)
 
 
 def encrypt_password(password):
@@ -106,19 +110,61 @@ def send_email(message):
         s.quit()
 
 
+class TemplateRegistry:
+    """
+    Loads all text templates from the directories once and keeps them in memory.
+    With `auto_reload` a template is read again after its file was modified
+    (useful in DEBUG mode to edit templates without restarting the bot).
+
+    Args:
+        directories (tuple): directories relative to BASE_DIR
+        auto_reload (bool): checks modification time of a file on every access
+    """
+
+    def __init__(self, directories, auto_reload=False):
+        self.auto_reload = auto_reload
+        self._templates = dict()
+        for directory in directories:
+            for root, _, filenames in os.walk(os.path.join(BASE_DIR, directory)):
+                for filename in filenames:
+                    self._load(os.path.join(root, filename))
+
+    def _load(self, path):
+        with open(path, "rt") as file:
+            text = file.read()
+        self._templates[path] = (os.path.getmtime(path), text, Template(text))
+        return self._templates[path]
+
+    def _get(self, filepath):
+        path = os.path.join(BASE_DIR, filepath)
+        entry = self._templates.get(path)
+        if entry is None or self.auto_reload and entry[0] != os.path.getmtime(path):
+            entry = self._load(path)
+        return entry
+
+    def get_text(self, filepath):
+        """Returns a text of the template"""
+        return self._get(filepath)[1]
+
+    def get_template(self, filepath):
+        """Returns a string.Template object of the template"""
+        return self._get(filepath)[2]
+
+
+templates = TemplateRegistry(
+    (os.path.join('bot', 'templates'), os.path.join('web', 'webhooks', 'templates')),
+    auto_reload=config('DEBUG', default=False, cast=bool)
+)
+
+
 def read_file(filename):
-    """Read and return file data."""
-    data = None
-    with open(os.path.join(BASE_DIR, filename), "rt") as file:
-        data = file.read()
-    return data
+    """Read and return file data. Templates are returned from the registry"""
+    return templates.get_text(filename)
 
 
 def read_template(filepath):
-    """Read a text file and return a string.Template object"""
-    with open(os.path.join(BASE_DIR, filepath)) as file:
-        template = Template(file.read())
-    return template
+    """Return a string.Template object from the templates registry"""
+    return templates.get_template(filepath)
 
 
 def escape_string(string):
@@ -138,6 +184,99 @@ def escape_string(string):
     return new_string
 
 
+def split_text(text, limit=MESSAGE_LIMIT):
+    """
+    Splits a text which exceeds the limit by lines,
+    a line which exceeds the limit itself is cut into pieces
+    :return: list of texts
+    """
+    if len(text) <= limit:
+        return [text]
+
+    lines = list()
+    for line in text.split('\n'):
+        lines.extend(line[i:i + limit] for i in range(0, max(len(line), 1), limit))
+    return join_messages(lines, '\n', limit)
+
+
+def join_messages(messages, separator='\n', limit=MESSAGE_LIMIT):
+    """
+    Joins messages into as few texts as possible, every text fits into the limit
+    :param messages: list of messages
+    :param separator: a string between joined messages
+    :param limit: max length of a text
+    :return: list of texts
+    """
+    texts = list()
+    current = None
+    for message in messages:
+        for part in split_text(message, limit):
+            if current is None:
+                current = part
+            elif len(current) + len(separator) + len(part) > limit:
+                texts.append(current)
+                current = part
+            else:
+                current += separator + part
+    if current is not None:
+        texts.append(current)
+    return texts
+
+
+def debounce(redis_conn, key, countdown, task, args=(), timeout=300):
+    """
+    Schedules a celery task unless it is already scheduled, so items queued for the task
+    meanwhile are handled by one run. The run has to call `release_debounce` after taking the items
+    :param redis_conn: redis connection
+    :param key: key of the lock held while the task is scheduled or running
+    :param countdown: seconds before the task runs
+    :param task: celery task
+    :param args: arguments of the task
+    :param timeout: seconds the lock outlives the countdown, so it expires by itself if a worker died
+    :return: True if the task was scheduled
+    """
+    if not redis_conn.set(key, 1, nx=True, ex=int(countdown) + timeout):
+        return False
+    task.apply_async(args, countdown=countdown)
+    return True
+
+
+def release_debounce(redis_conn, key, pending):
+    """
+    Releases the lock of a debounced task which took its items. The lock is released before
+    checking for items left, so an item queued meanwhile is handled either by a run scheduled
+    by its producer or by a run which the caller has to schedule
+    :param redis_conn: redis connection
+    :param key: key of the lock
+    :param pending: function which returns a number of items left
+    :return: True if items are left and the task has to be scheduled again
+    """
+    redis_conn.delete(key)
+    return bool(pending())
+
+
+def build_webhook_jql(projects, issues, max_issues=WEBHOOK_JQL_MAX_ISSUES):
+    """
+    Builds a JQL filter of a webhook which matches only watched projects and issues.
+    Issues of watched projects are skipped, too many issues are replaced by their projects
+    :param projects: project keys e.g. ['JTB']
+    :param issues: issue keys e.g. ['JTB-99']
+    :return: JQL string, empty if nothing is watched
+    """
+    projects = set(projects)
+    issues = {issue for issue in issues if issue.rsplit('-', 1)[0] not in projects}
+    if len(issues) > max_issues:
+        projects |= {issue.rsplit('-', 1)[0] for issue in issues}
+        issues = set()
+
+    clauses = list()
+    for field, keys in (('project', projects), ('issuekey', issues)):
+        if keys:
+            values = ', '.join('"{}"'.format(key.replace('"', '\\"')) for key in sorted(keys))
+            clauses.append(f'{field} in ({values})')
+    return ' OR '.join(clauses)
+
+
 class ConcatAction(argparse.Action):
     """
     Concatenates arguments in argparse
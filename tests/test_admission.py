@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from web.app import app, redis_conn
+from web.webhooks import admission, pipeline, views
+
+WEBHOOK_ID = 'test-admission'
+URL = f'/webhook/{WEBHOOK_ID}/JTB/JTB-99/'
+HEADERS = {'User-Agent': 'Atlassian HttpClient 1.0', 'Content-Type': 'application/json'}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    depth = {'value': 0}
+    monkeypatch.setattr(admission, 'SHED_DEPTH', 100)
+    monkeypatch.setattr(admission, 'queue_depth', lambda: depth['value'])
+    monkeypatch.setattr(pipeline, 'DEDUP_TTL', 60)
+    monkeypatch.setattr(views, 'ASYNC_PROCESSING', False)
+    monkeypatch.setattr(views.db, 'get_webhook', lambda webhook_id: {'_id': webhook_id, 'host_url': 'https://jira'})
+    monkeypatch.setattr(views, 'route_update', lambda webhook, data, **kwargs: True)
+
+    def set_depth(value):
+        # the state is recalculated by the next request
+        depth['value'] = value
+        monkeypatch.setitem(admission._state, 'checked', 0)
+
+    yield app.test_client(), set_depth
+    for key in redis_conn.scan_iter(pipeline.RECEIVED_KEY.format(WEBHOOK_ID, '*')):
+        redis_conn.delete(key)
+
+
+def update_body(timestamp):
+    return json.dumps({'webhookEvent': 'jira:issue_updated', 'timestamp': timestamp})
+
+
+def test_update_is_accepted_below_threshold(client):
+    test_client, set_depth = client
+    set_depth(admission.SHED_DEPTH - 1)
+    response = test_client.post(URL, data=update_body(1), headers=HEADERS)
+    assert response.status_code == 200
+    assert pipeline.is_received(WEBHOOK_ID, update_body(1))
+
+
+def test_update_is_rejected_above_threshold(client):
+    test_client, set_depth = client
+    set_depth(admission.SHED_DEPTH)
+    response = test_client.post(URL, data=update_body(2), headers=HEADERS)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(admission.RETRY_AFTER)
+    # the rejected update is not remembered, so the delivery from Jira is accepted later
+    assert not pipeline.is_received(WEBHOOK_ID, update_body(2))
+
+    set_depth(0)
+    response = test_client.post(URL, data=update_body(2), headers=HEADERS)
+    assert response.status_code == 200
+
+
+def test_update_of_unregistered_webhook_is_released(client, monkeypatch):
+    test_client, _ = client
+    monkeypatch.setattr(views.db, 'get_webhook', lambda webhook_id: None)
+    response = test_client.post(URL, data=update_body(3), headers=HEADERS)
+    assert response.status_code == 403
+    assert not pipeline.is_received(WEBHOOK_ID, update_body(3))
+
+    # the redelivery is accepted once the webhook is registered
+    monkeypatch.setattr(views.db, 'get_webhook', lambda webhook_id: {'_id': webhook_id, 'host_url': 'https://jira'})
+    response = test_client.post(URL, data=update_body(3), headers=HEADERS)
+    assert response.status_code == 200
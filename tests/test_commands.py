@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.commands.watch import CreateSubscribeCommand, DigestCommand
+
+CHAT_ID = 208810129
+
+
+class StubDB:
+
+    def __init__(self, status=True):
+        self.status = status
+        self.updates = list()
+        self.subscription = None
+
+    def is_user_exists(self, telegram_id):
+        return True
+
+    def update_user(self, telegram_id, data):
+        self.updates.append((telegram_id, data))
+        return self.status
+
+    def get_subscription(self, chat_id, name):
+        return self.subscription
+
+    def enable_chat_subscriptions(self, chat_id):
+        self.updates.append((chat_id, {'disabled': None}))
+        return 1
+
+    def get_chats_webhooks(self, chat_ids):
+        return {'webhook'}
+
+
+class StubApp:
+
+    def __init__(self, status=True):
+        self.db = StubDB(status)
+        self.texts = list()
+        self.webhook_sync = SimpleNamespace(scheduled=list())
+        self.webhook_sync.schedule = self.webhook_sync.scheduled.append
+
+    def authorization(self, telegram_id):
+        return None
+
+    def send(self, bot, update, **kwargs):
+        self.texts.append(kwargs['text'])
+
+
+def run_digest(app, *args):
+    update = SimpleNamespace(message=SimpleNamespace(chat_id=CHAT_ID))
+    DigestCommand(app).handler(None, update, args=list(args))
+
+
+@pytest.mark.parametrize('option, digest', [('hourly', 'hourly'), ('Daily', 'daily'), ('off', None)])
+def test_digest_mode_is_changed(option, digest):
+    app = StubApp()
+    run_digest(app, option)
+    assert app.db.updates == [(CHAT_ID, {'digest': digest})]
+    assert len(app.texts) == 1
+
+
+@pytest.mark.parametrize('args', [(), ('weekly',)])
+def test_digest_description_is_shown(args):
+    app = StubApp()
+    run_digest(app, *args)
+    assert app.db.updates == []
+    assert app.texts == [DigestCommand(app).description]
+
+
+def test_failed_digest_change_is_reported():
+    app = StubApp(status=False)
+    run_digest(app, 'daily')
+    assert app.texts == ["Can't change the digest mode at this moment, please try again later"]
+
+
+def watch(app, name):
+    update = SimpleNamespace(message=SimpleNamespace(chat_id=CHAT_ID))
+    CreateSubscribeCommand(app).handler(None, update, webhook={'_id': 'webhook'}, topic='issue', name=name)
+
+
+def test_watch_enables_disabled_subscription():
+    app = StubApp()
+    app.db.subscription = {'chat_id': CHAT_ID, 'name': 'JTB-99', 'disabled': True}
+    watch(app, 'jtb-99')
+    assert app.db.updates == [(CHAT_ID, {'disabled': None})]
+    assert app.webhook_sync.scheduled == ['webhook']
+    assert app.texts == ['Now you will be notified about updates from JTB-99']
+
+
+def test_watch_existing_subscription():
+    app = StubApp()
+    app.db.subscription = {'chat_id': CHAT_ID, 'name': 'JTB-99'}
+    watch(app, 'JTB-99')
+    assert app.db.updates == []
+    assert app.texts == ['You already subscribed on this updates']
@@ -65,6 +65,20 @@ class TestMongoBackend(JTBTest):
         assert existent_user is True
         assert fake_user is False
 
+    def test_get_connected_users(self):
+        telegram_id = self.test_user.get('telegram_id')
+        assert self.db.get_connected_users([telegram_id, 1256321]) == set()
+        self.db.update_user(telegram_id, {'auth_method': 'basic'})
+        assert self.db.get_connected_users([telegram_id, 1256321]) == {telegram_id}
+        self.db.update_user(telegram_id, {'auth_method': None})
+
+    def test_get_digest_chats(self):
+        telegram_id = self.test_user.get('telegram_id')
+        assert self.db.get_digest_chats([telegram_id, 1256321]) == dict()
+        self.db.update_user(telegram_id, {'digest': 'hourly'})
+        assert self.db.get_digest_chats([telegram_id, 1256321]) == {telegram_id: 'hourly'}
+        self.db.update_user(telegram_id, {'digest': None})
+
     def test_get_user_data(self):
         existent_user = self.db.get_user_data(self.test_user.get('telegram_id'))
         assert existent_user.get('telegram_id') == self.test_user.get('telegram_id')
@@ -179,11 +193,85 @@ class TestMongoBackend(JTBTest):
         subs = self.db.get_webhook_subscriptions(webhook.get('_id'))
         assert subs.count() >= 1
 
+    def test_get_topic_subscribers(self):
+        webhook = self.db.get_webhook(host_url=self.test_host.get('url'))
+        chat_id = self.test_user.get('telegram_id')
+        assert self.db.get_topic_subscribers(webhook.get('_id'), 'JTB', self.sub_name) == {chat_id}
+        assert self.db.get_topic_subscribers(webhook.get('_id'), 'JTB', 'JTB-1') == set()
+        assert self.db.get_topic_subscribers(webhook.get('_id'), 'JTB') == set()
+
+    def test_get_subscribers_by_topic(self):
+        webhook = self.db.get_webhook(host_url=self.test_host.get('url'))
+        chat_id = self.test_user.get('telegram_id')
+        topics = [('project', 'JTB'), (self.sub_topic, self.sub_name), ('issue', 'JTB-1')]
+        subscribers = self.db.get_subscribers_by_topic(webhook.get('_id'), topics)
+        assert subscribers == {(self.sub_topic, self.sub_name): {chat_id}}
+        assert self.db.get_subscribers_by_topic(webhook.get('_id'), []) == dict()
+
+    def test_get_webhook_topics(self):
+        webhook = self.db.get_webhook(host_url=self.test_host.get('url'))
+        topics = self.db.get_webhook_topics(webhook.get('_id'))
+        assert topics == {'project': [], 'issue': [self.sub_name]}
+
+    def test_disable_chats_subscriptions(self):
+        webhook = self.db.get_webhook(host_url=self.test_host.get('url'))
+        chat_id = self.test_user.get('telegram_id')
+        assert self.db.disable_chats_subscriptions([chat_id, 1256321]) == 1
+        assert self.db.get_topic_subscribers(webhook.get('_id'), 'JTB', self.sub_name) == set()
+        assert self.db.get_subscribers_by_topic(webhook.get('_id'), [(self.sub_topic, self.sub_name)]) == dict()
+        assert self.db.enable_chat_subscriptions(chat_id) == 1
+        assert self.db.get_topic_subscribers(webhook.get('_id'), 'JTB', self.sub_name) == {chat_id}
+
+    def test_webhooks_sync(self):
+        webhook = self.db.get_webhook(host_url=self.test_host.get('url'))
+        webhook_ids = self.db.get_chats_webhooks([self.test_user.get('telegram_id'), 1256321])
+        assert webhook_ids == {webhook.get('_id')}
+        assert self.db.request_webhooks_sync(webhook_ids) == 1
+        assert self.db.get_webhooks_to_sync() == [str(webhook.get('_id'))]
+        assert self.db.get_webhooks_to_sync() == []
+
+    def test_migrate_chat_subscriptions(self):
+        chat_id = self.test_user.get('telegram_id')
+        assert self.db.migrate_chat_subscriptions(chat_id, -1001256321) == 1
+        assert self.db.get_subscription(-1001256321, self.sub_name) is not None
+        assert self.db.migrate_chat_subscriptions(-1001256321, chat_id) == 1
+
     def test_get_user_subscriptions(self):
         user = self.db.get_user_data(self.test_user.get('telegram_id'))
         subs = self.db.get_user_subscriptions(user.get('_id'))
         assert subs.count() >= 1
 
+    def test_get_subscribed_chats(self):
+        chat_id = self.test_user.get('telegram_id')
+        assert self.db.get_subscribed_chats(self.sub_name, [chat_id, 1256321]) == {chat_id}
+        assert self.db.get_subscribed_chats('JTB-1', [chat_id]) == set()
+
     def test_delete_subscription(self):
         self.db.delete_subscription(self.test_user.get('telegram_id'), self.sub_name)
         assert self.db.get_subscription(self.test_user.get('telegram_id'), self.sub_name) is None
+
+    def test_delete_chats_subscription(self):
+        chat_id = self.test_user.get('telegram_id')
+        self.db.create_subscription({'chat_id': chat_id, 'topic': self.sub_topic, 'name': self.sub_name})
+        assert self.db.delete_chats_subscription(self.sub_name, [chat_id, 1256321]) is True
+        assert self.db.get_subscription(chat_id, self.sub_name) is None
+
+    def test_dead_letters(self):
+        payload = {'chat_id': self.test_user.get('telegram_id'), 'text': 'Test', 'parse_mode': 'HTML'}
+        assert self.db.create_dead_letter({'method': 'sendMessage', 'payload': payload, 'attempts': 1}) is True
+        letters = self.db.get_dead_letters(10)
+        assert [letter['payload'] for letter in letters] == [payload]
+        assert self.db.delete_dead_letters([letter['_id'] for letter in letters]) == 1
+        assert self.db.get_dead_letters(10) == []
+
+    def test_journal(self):
+        self.db.create_journal(1024 * 1024)
+        self.db.create_journal(1024 * 1024)  # an existing journal is kept
+        self.db.journal_update({'kwargs': {'webhook_id': 'a', 'project_key': 'JTB'}, 'data': '{"id": 1}'})
+        self.db.journal_update({'kwargs': {'webhook_id': 'b', 'project_key': 'JTB'}, 'data': '{"id": 2}'})
+        self.db.journal_update({'kwargs': {'webhook_id': 'a', 'project_key': 'JTB'}, 'data': '{"id": 3}'})
+
+        assert [entry['data'] for entry in self.db.get_journal()] == ['{"id": 1}', '{"id": 2}', '{"id": 3}']
+        assert [entry['data'] for entry in self.db.get_journal(webhook_id='a', limit=1)] == ['{"id": 1}']
+        entries = list(self.db.get_journal(webhook_id='a'))
+        assert [entry['data'] for entry in self.db.get_journal(since=entries[1]['receivedAt'])][-1] == '{"id": 3}'
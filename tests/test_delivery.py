@@ -0,0 +1,238 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from web.app import redis_conn
+from web.webhooks import delivery
+
+HOST = 'https://test-delivery.atlassian.net'
+OTHER_HOST = 'https://test-other.atlassian.net'
+ISSUE = 'JTB-99'
+CHAT_ID = 208810129
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queued = list()
+    monkeypatch.setattr(
+        delivery.send_messages, 'apply_async', lambda args, queue: queued.append((queue, len(args[0])))
+    )
+    yield queued
+    for host in (HOST, OTHER_HOST):
+        for key in redis_conn.scan_iter(delivery.TENANT_RATE_KEY.format(host, '*')):
+            redis_conn.delete(key)
+
+
+def payloads(count):
+    return [{'chat_id': chat_id, 'text': 'Test delivery', 'parse_mode': 'HTML'} for chat_id in range(count)]
+
+
+def test_busy_host_is_broadcast_in_bulk(queued, monkeypatch):
+    monkeypatch.setattr(delivery, 'TENANT_RATE', 5)
+    delivery.broadcast(payloads(3), host=HOST)
+    delivery.broadcast(payloads(2), host=HOST)
+    # the host exceeds its rate, other hosts keep the notifications queue
+    delivery.broadcast(payloads(1), host=HOST)
+    delivery.broadcast(payloads(1), host=OTHER_HOST)
+    assert queued == [
+        (delivery.NOTIFICATIONS_QUEUE, 3),
+        (delivery.NOTIFICATIONS_QUEUE, 2),
+        (delivery.BULK_QUEUE, 1),
+        (delivery.NOTIFICATIONS_QUEUE, 1),
+    ]
+
+
+def test_large_fanout_is_broadcast_in_bulk(queued):
+    delivery.broadcast(payloads(delivery.SMALL_FANOUT + 1))
+    assert [queue for queue, _ in queued] == [delivery.BULK_QUEUE] * len(queued)
+
+
+@pytest.fixture
+def live(monkeypatch):
+    sent = {'new': list(), 'edited': list()}
+    monkeypatch.setattr(delivery, 'LIVE_WINDOW', 60)
+    monkeypatch.setattr(
+        delivery.send_message, 'apply_async', lambda args, link: sent['new'].append((args[0], link.args))
+    )
+    monkeypatch.setattr(delivery.send_message, 'delay', lambda payload, method: sent['edited'].append(payload))
+    yield sent
+    for key in redis_conn.scan_iter(delivery.LIVE_WINDOW_KEY.format(HOST, ISSUE, '*')):
+        redis_conn.delete(key)
+    for _, (_, _, _, window, _, _) in sent['new']:
+        redis_conn.delete(delivery.LIVE_CHANGES_KEY.format(window), delivery.LIVE_MESSAGE_KEY.format(window))
+
+
+def status_change(old_status, new_status):
+    return {
+        'key': 'status',
+        'template': os.path.join('web', 'webhooks', 'templates', 'issue_status.txt'),
+        'data': {
+            'old_status': old_status,
+            'new_status': new_status,
+            'username': 'John Doe',
+            'link': f'{HOST}/browse/{ISSUE}',
+            'link_name': ISSUE,
+        },
+        'transition': ('old_status', 'new_status'),
+    }
+
+
+def test_live_message_is_edited_by_changes_of_window(live):
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('Open', 'In Progress')], 'HTML')
+    assert len(live['new']) == 1
+    payload, remember_args = live['new'][0]
+    assert payload['chat_id'] == CHAT_ID and 'In Progress' in payload['text']
+
+    # the message is not sent yet, the change is shown after sending
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('In Progress', 'Review')], 'HTML')
+    assert len(live['new']) == 1 and not live['edited']
+    delivery.remember_live_message(42, *remember_args)
+    assert [payload['message_id'] for payload in live['edited']] == [42]
+    assert '<b>Open</b> to <b>Review</b>' in live['edited'][-1]['text']
+
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('Review', 'Done')], 'HTML')
+    assert len(live['new']) == 1
+    assert [payload['message_id'] for payload in live['edited']] == [42, 42]
+    assert '<b>Open</b> to <b>Done</b>' in live['edited'][-1]['text']
+
+
+def test_window_is_closed_when_live_message_is_not_sent(live):
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('Open', 'In Progress')], 'HTML')
+    _, failed_args = live['new'][0]
+    delivery.remember_live_message(None, *failed_args)
+    assert not redis_conn.exists(delivery.LIVE_WINDOW_KEY.format(HOST, ISSUE, CHAT_ID))
+
+    # the next change is sent by a new message of a new window
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('In Progress', 'Done')], 'HTML')
+    assert len(live['new']) == 2 and not live['edited']
+    _, remember_args = live['new'][1]
+    assert remember_args[3] != failed_args[3]
+    assert '<b>In Progress</b> to <b>Done</b>' in live['new'][1][0]['text']
+
+    # a late result of the failed window doesn't close the new one
+    delivery.remember_live_message(None, *failed_args)
+    assert redis_conn.exists(delivery.LIVE_WINDOW_KEY.format(HOST, ISSUE, CHAT_ID))
+
+
+def test_cancelled_changes_open_no_window(live):
+    # a status which returned to its initial value is not shown
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('Open', 'Open')], 'HTML')
+    assert live == {'new': [], 'edited': []}
+    assert not redis_conn.exists(delivery.LIVE_WINDOW_KEY.format(HOST, ISSUE, CHAT_ID))
+
+    delivery.hold_live(HOST, ISSUE, [CHAT_ID], [status_change('Open', 'Done')], 'HTML')
+    assert len(live['new']) == 1
+    assert '<b>Open</b> to <b>Done</b>' in live['new'][0][0]['text']
+
+
+@pytest.fixture
+def coalesce(monkeypatch):
+    sent, scheduled = list(), list()
+    monkeypatch.setattr(delivery, 'COALESCE_WINDOW', 30)
+    monkeypatch.setattr(
+        delivery, 'broadcast', lambda payloads, queue=None, host=None: sent.append((payloads, queue))
+    )
+    monkeypatch.setattr(delivery.flush_changes, 'apply_async', lambda args, countdown: scheduled.append(args))
+    yield sent, scheduled
+    redis_conn.delete(delivery.CHANGES_KEY.format(HOST, ISSUE), delivery.FLUSH_LOCK_KEY.format(HOST, ISSUE))
+
+
+def texts_by_chat(sent):
+    texts = dict()
+    for payloads, _ in sent:
+        for payload in payloads:
+            texts.setdefault(payload['chat_id'], list()).append(payload['text'])
+    return texts
+
+
+def test_changes_are_flushed_per_recipients(coalesce):
+    sent, scheduled = coalesce
+    chats = [CHAT_ID, CHAT_ID + 1, CHAT_ID + 2]
+    delivery.hold_changes(HOST, ISSUE, chats[:2], [status_change('Open', 'In Progress')], 'HTML')
+    delivery.hold_changes(HOST, ISSUE, chats[1:], [status_change('In Progress', 'Done')], 'HTML')
+    assert scheduled == [(HOST, ISSUE)]
+
+    delivery.flush_changes(HOST, ISSUE)
+    # chats which received the same updates share one broadcast
+    assert len(sent) == 3
+    texts = texts_by_chat(sent)
+    assert len(texts[chats[0]]) == 1 and '<b>Open</b> to <b>In Progress</b>' in texts[chats[0]][0]
+    assert len(texts[chats[1]]) == 1 and '<b>Open</b> to <b>Done</b>' in texts[chats[1]][0]
+    assert len(texts[chats[2]]) == 1 and '<b>In Progress</b> to <b>Done</b>' in texts[chats[2]][0]
+    assert not redis_conn.exists(delivery.CHANGES_KEY.format(HOST, ISSUE))
+    assert not redis_conn.exists(delivery.FLUSH_LOCK_KEY.format(HOST, ISSUE))
+    assert scheduled == [(HOST, ISSUE)]
+
+
+def test_flush_is_rescheduled_for_changes_held_meanwhile(coalesce, monkeypatch):
+    sent, scheduled = coalesce
+    delivery.hold_changes(HOST, ISSUE, [CHAT_ID], [status_change('Open', 'In Progress')], 'HTML')
+
+    def broadcast(payloads, queue=None, host=None):
+        sent.append((payloads, queue))
+        # a change arrives while the flush is sending, its holder finds the lock taken
+        if len(sent) == 1:
+            delivery.hold_changes(HOST, ISSUE, [CHAT_ID], [status_change('In Progress', 'Done')], 'HTML')
+
+    monkeypatch.setattr(delivery, 'broadcast', broadcast)
+    delivery.flush_changes(HOST, ISSUE)
+    assert scheduled == [(HOST, ISSUE), (HOST, ISSUE)]
+    assert redis_conn.exists(delivery.FLUSH_LOCK_KEY.format(HOST, ISSUE))
+
+    delivery.flush_changes(HOST, ISSUE)
+    assert '<b>In Progress</b> to <b>Done</b>' in sent[-1][0][0]['text']
+    assert len(scheduled) == 2
+
+
+@pytest.fixture
+def digests(monkeypatch):
+    sent = list()
+    monkeypatch.setattr(
+        delivery, 'broadcast', lambda payloads, queue=None, host=None: sent.append((payloads, queue))
+    )
+    yield sent
+    for chat_id in (CHAT_ID, CHAT_ID + 1):
+        redis_conn.delete(delivery.DIGEST_KEY.format(chat_id))
+    for period in delivery.DIGEST_PERIODS:
+        redis_conn.srem(delivery.DIGEST_CHATS_KEY.format(period), CHAT_ID, CHAT_ID + 1)
+
+
+def test_digest_is_joined_per_parse_mode(digests):
+    digest_chats = {CHAT_ID: 'hourly', CHAT_ID + 1: 'daily'}
+    delivery.hold_digest([(CHAT_ID, '<b>first</b>\n'), (CHAT_ID + 1, 'daily')], 'HTML', digest_chats)
+    delivery.hold_digest([(CHAT_ID, '*second*')], 'Markdown', digest_chats)
+    delivery.hold_digest([(CHAT_ID, '<b>third</b>')], 'HTML', digest_chats)
+
+    delivery.flush_digests('hourly')
+    flushed = [([(p['chat_id'], p['text'], p['parse_mode']) for p in payloads], queue) for payloads, queue in digests]
+    assert flushed == [
+        ([(str(CHAT_ID), '<b>first</b>\n\n<b>third</b>', 'HTML')], delivery.SCHEDULED_QUEUE),
+        ([(str(CHAT_ID), '*second*', 'Markdown')], delivery.SCHEDULED_QUEUE),
+    ]
+    assert not redis_conn.exists(delivery.DIGEST_KEY.format(CHAT_ID))
+    # messages of a chat with another period are kept
+    assert redis_conn.llen(delivery.DIGEST_KEY.format(CHAT_ID + 1)) == 1
+
+
+class DigestChatsDB:
+
+    def get_digest_chats(self, chat_ids):
+        return {CHAT_ID + 1: 'daily'}
+
+
+def test_degraded_host_keeps_digest_periods(digests):
+    notifier = SimpleNamespace(
+        plan=[(CHAT_ID, 'first'), (CHAT_ID + 1, 'second')], host=HOST, db=DigestChatsDB(),
+        parse_mode='HTML', changes=None, issue=ISSUE,
+    )
+    redis_conn.set(delivery.DEGRADED_KEY.format(HOST), 1)
+    try:
+        delivery.deliver(notifier)
+    finally:
+        redis_conn.delete(delivery.DEGRADED_KEY.format(HOST))
+
+    assert not digests
+    assert redis_conn.sismember(delivery.DIGEST_CHATS_KEY.format('hourly'), CHAT_ID)
+    assert not redis_conn.sismember(delivery.DIGEST_CHATS_KEY.format('hourly'), CHAT_ID + 1)
+    assert redis_conn.sismember(delivery.DIGEST_CHATS_KEY.format('daily'), CHAT_ID + 1)
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from lib.fair_queue import FairQueue
+from web.app import redis_conn
+
+
+@pytest.fixture
+def fair_queue():
+    yield FairQueue(redis_conn, quantum=2, lanes=2, prefix='test:fair', timeout=1)
+    for key in redis_conn.scan_iter('test:fair:*'):
+        redis_conn.delete(key)
+
+
+def drain(fair_queue):
+    order = list()
+    while True:
+        turn = fair_queue.take()
+        if turn is None:
+            return order
+        tenant, items = turn
+        order.append((tenant, [item.decode() for item in items]))
+        fair_queue.release(tenant)
+
+
+def test_push_acquires_lane_once(fair_queue):
+    assert fair_queue.push('big', 'b1') == 0
+    assert fair_queue.push('big', 'b2') is None
+    assert fair_queue.push('small', 's1') == 1
+    assert fair_queue.push('other', 'o1') is None
+
+
+def test_lane_of_dead_consumers_is_acquired(fair_queue):
+    assert fair_queue.push('big', 'b0') == 0
+    # the consumer died before taking a turn and its lane expired
+    for key in fair_queue.lane_keys:
+        redis_conn.delete(key)
+    assert fair_queue.push('big', 'b1') == 0
+    assert fair_queue.push('big', 'b2') is None
+    assert drain(fair_queue) == [('big', ['b0', 'b1']), ('big', ['b2'])]
+
+
+def test_round_robin_with_weights(fair_queue):
+    for i in range(6):
+        fair_queue.push('big', f'b{i}', weight=1.5)
+    fair_queue.push('small', 's0')
+
+    assert drain(fair_queue) == [
+        ('big', ['b0', 'b1', 'b2']),
+        ('small', ['s0']),
+        ('big', ['b3', 'b4', 'b5']),
+    ]
+    assert fair_queue.backlog() == {}
+
+
+def test_taken_tenant_is_not_taken_twice(fair_queue):
+    fair_queue.push('big', 'b0')
+    tenant, _ = fair_queue.take()
+    fair_queue.push('big', 'b1')
+    assert fair_queue.take() is None
+    assert fair_queue.backlog() == {'big': 1}
+
+    assert fair_queue.release(tenant)
+    assert drain(fair_queue) == [('big', ['b1'])]
+
+
+def test_release_lane(fair_queue):
+    lane = fair_queue.push('big', 'b0')
+    assert fair_queue.release_lane(lane) == lane
+    drain(fair_queue)
+    assert fair_queue.release_lane(lane) is None
+
+
+def test_queued_tenant_is_not_queued_twice(fair_queue):
+    fair_queue.push('big', 'b0')
+    fair_queue.push('small', 's0')
+    # the tenants wait in the ring longer than the timeout
+    time.sleep(1.1)
+    fair_queue.push('big', 'b1')
+    assert redis_conn.lrange(fair_queue.ring_key, 0, -1) == [b'big', b'small']
+
+    tenant, _ = fair_queue.take()
+    fair_queue.push('big', 'b2')
+    assert fair_queue.release(tenant)
+    time.sleep(1.1)
+    fair_queue.push('big', 'b3')
+    assert drain(fair_queue) == [('small', ['s0']), ('big', ['b2', 'b3'])]
+
+
+def test_tenant_of_dead_consumer_is_activated(fair_queue):
+    fair_queue.push('big', 'b0')
+    fair_queue.take()
+    # the consumer died without releasing the tenant
+    time.sleep(1.1)
+    fair_queue.push('big', 'b1')
+    assert drain(fair_queue) == [('big', ['b1'])]
@@ -0,0 +1,83 @@
+import argparse
+import json
+from datetime import datetime
+
+import pytest
+
+from web.app import redis_conn
+from web.webhooks import pipeline
+from web.webhooks import journal
+from web.webhooks.journal import parse_time, replay
+
+WEBHOOK_ID = 'test-journal'
+
+
+@pytest.fixture
+def entries():
+    entries = [
+        {
+            '_id': timestamp, 'receivedAt': datetime(2019, 12, 17, 10, 0, timestamp),
+            'kwargs': {'webhook_id': WEBHOOK_ID, 'project_key': 'JTB'}, 'data': json.dumps({'timestamp': timestamp}),
+        }
+        for timestamp in (1, 2, 3)
+    ]
+    yield entries
+    for entry in entries:
+        redis_conn.delete(pipeline.received_key(WEBHOOK_ID, entry['data']))
+
+
+@pytest.fixture
+def notified(monkeypatch):
+    monkeypatch.setattr(pipeline, 'DEDUP_TTL', 60)
+    monkeypatch.setattr(journal.db, 'get_webhook', lambda webhook_id: {'_id': webhook_id, 'host_url': 'https://jira'})
+    monkeypatch.setattr(journal.db, 'get_topic_subscribers', lambda webhook_id, project_key, issue_key: {1})
+    notified = list()
+
+    def notify(jira_update, chat_ids, host, db, **kwargs):
+        if jira_update['timestamp'] == 3:
+            raise KeyError('issue')
+        notified.append(jira_update['timestamp'])
+
+    monkeypatch.setattr(journal, 'notify', notify)
+    return notified
+
+
+def test_replay_skips_received_updates(entries, notified):
+    # the first update was processed, the second one was released after a failure
+    assert pipeline.claim_update(WEBHOOK_ID, entries[0]['data'].encode())
+    assert pipeline.claim_update(WEBHOOK_ID, entries[1]['data'].encode())
+    pipeline.release_update(WEBHOOK_ID, entries[1]['data'].encode())
+
+    stats = replay(entries, speed=0)
+    assert notified == [2]
+    assert (stats['updates'], stats['skipped'], stats['failed']) == (2, 1, 1)
+    # the failed update is released, the replayed one is remembered
+    assert pipeline.is_received(WEBHOOK_ID, entries[1]['data'])
+    assert not pipeline.is_received(WEBHOOK_ID, entries[2]['data'])
+
+    # replaying the same window again doesn't send duplicates
+    stats = replay(entries, speed=0)
+    assert notified == [2]
+    assert (stats['updates'], stats['skipped'], stats['failed']) == (1, 2, 1)
+
+
+def test_resend_replays_received_updates(entries, notified):
+    assert pipeline.claim_update(WEBHOOK_ID, entries[0]['data'].encode())
+    stats = replay(entries, speed=0, resend=True)
+    assert notified == [1, 2]
+    assert (stats['updates'], stats['skipped'], stats['failed']) == (3, 0, 1)
+
+
+def test_parse_time():
+    assert parse_time('2019-12-17T10:05:30') == datetime(2019, 12, 17, 10, 5, 30)
+    assert parse_time('2019-12-17T10:05') == datetime(2019, 12, 17, 10, 5)
+    assert parse_time('2019-12-17') == datetime(2019, 12, 17)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_time('17.12.2019')
+
+
+def test_updates_of_deleted_webhook_are_missing(entries, notified, monkeypatch):
+    monkeypatch.setattr(journal.db, 'get_webhook', lambda webhook_id: None)
+    stats = replay(entries, speed=0)
+    assert notified == []
+    assert (stats['updates'], stats['skipped'], stats['missing']) == (0, 0, 3)
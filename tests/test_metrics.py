@@ -0,0 +1,26 @@
+import pytest
+from decouple import config
+from redis import StrictRedis
+
+from lib.metrics import Metrics
+
+
+@pytest.fixture
+def metrics():
+    redis = StrictRedis.from_url(config('REDIS_URL', default='redis://localhost:6379/0'))
+    yield Metrics(redis, key='test:metrics')
+    redis.delete('test:metrics')
+
+
+def test_render(metrics):
+    metrics.incr('jtb_updates_total', 2, webhook='a')
+    metrics.incr('jtb_updates_total', webhook='a')
+    metrics.incr('jtb_updates_total', webhook='b')
+
+    assert metrics.render([('jtb_backlog', {'webhook': 'a'}, 5)]) == (
+        '# TYPE jtb_updates_total counter\n'
+        'jtb_updates_total{webhook="a"} 3\n'
+        'jtb_updates_total{webhook="b"} 1\n'
+        '# TYPE jtb_backlog gauge\n'
+        'jtb_backlog{webhook="a"} 5\n'
+    )
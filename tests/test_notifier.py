@@ -0,0 +1,174 @@
+import json
+import os
+
+import pytest
+
+from web.webhooks import delivery
+from web.webhooks.delivery import merge_changes
+from web.webhooks.notifier import (
+    CommentNotify,
+    IssueNotify,
+    ProjectIssueNotify,
+    ProjectNotify,
+    join_messages,
+    sanitize_comment)
+
+
+HOST = 'https://jira.somecompany.com'
+CHAT_IDS = [208810129, 2010129, 2088129]
+
+with open(os.path.join(os.path.dirname(__file__), 'golden', 'comments.json')) as file:
+    GOLDEN_COMMENTS = json.load(file)
+
+
+@pytest.mark.parametrize('case', GOLDEN_COMMENTS, ids=[case['name'] for case in GOLDEN_COMMENTS])
+def test_sanitize_comment_golden(case):
+    comment, links = sanitize_comment(case['body'])
+    assert comment == case['comment']
+    assert CommentNotify._format_links(links) == case['links']
+
+
+class NoDigestsDB:
+    """Database of chats which are not in digest mode"""
+
+    def get_digest_chats(self, chat_ids):
+        return dict()
+
+
+@pytest.fixture
+def broadcast(monkeypatch):
+    payloads = list()
+    monkeypatch.setattr(delivery, 'broadcast', lambda messages, host=None: payloads.extend(messages))
+    return payloads
+
+
+def test_message_plan_per_recipient(broadcast):
+    update = {'webhookEvent': 'jira:issue_created', 'issue': {'key': 'JTB-99'}}
+    notifier = ProjectIssueNotify(
+        update, CHAT_IDS, HOST, NoDigestsDB(), connected_users=set(CHAT_IDS), project_key='JTB'
+    )
+    notifier.notify()
+    assert [chat_id for chat_id, _ in notifier.plan] == CHAT_IDS
+    delivery.deliver(notifier)
+    assert [payload['chat_id'] for payload in broadcast] == CHAT_IDS
+
+
+class SubscriptionsDB(NoDigestsDB):
+    """Database of chats where some of them are subscribed to an issue"""
+
+    def __init__(self, subscribed):
+        self.subscribed = subscribed
+        self.lookups = list()
+        self.deleted = list()
+
+    def get_subscribed_chats(self, name, chat_ids):
+        self.lookups.append((name, list(chat_ids)))
+        return {chat_id for chat_id in chat_ids if chat_id in self.subscribed}
+
+    def delete_chats_subscription(self, name, chat_ids):
+        self.deleted.append((name, set(chat_ids)))
+        return True
+
+
+def test_issue_deleted_unsubscribes_chats():
+    update = {'webhookEvent': 'jira:issue_deleted', 'issue': {'key': 'JTB-99'}}
+    db = SubscriptionsDB(subscribed={CHAT_IDS[0], CHAT_IDS[2]})
+    notifier = ProjectIssueNotify(update, CHAT_IDS, HOST, db, connected_users=set(CHAT_IDS), project_key='JTB')
+    notifier.notify()
+
+    # subscriptions of all chats are looked up and removed with one query each
+    assert db.lookups == [('JTB-99', CHAT_IDS)]
+    assert db.deleted == [('JTB-99', {CHAT_IDS[0], CHAT_IDS[2]})]
+    assert len(notifier.plan) == len(CHAT_IDS)
+    assert dict(notifier.plan) == {
+        CHAT_IDS[0]: 'Issue JTB-99 was deleted. You were unsubscribed\n',
+        CHAT_IDS[1]: 'Issue JTB-99 was deleted\n',
+        CHAT_IDS[2]: 'Issue JTB-99 was deleted. You were unsubscribed\n',
+    }
+
+
+def test_message_plan_deduplication(broadcast):
+    update = {'webhookEvent': 'project_updated', 'project': {'key': 'JTB'}}
+    notifier = ProjectNotify(
+        update, CHAT_IDS, HOST, NoDigestsDB(), connected_users={CHAT_IDS[0]}, project_key='JTB'
+    )
+    notifier.notify()
+    notifier.notify()
+    assert len(notifier.plan) == 2
+    # an identical message is delivered into a chat only once
+    delivery.deliver(notifier)
+    assert [payload['chat_id'] for payload in broadcast] == [CHAT_IDS[0]]
+
+
+def test_join_messages():
+    assert join_messages([]) == []
+    assert join_messages(['a', 'b', 'c']) == ['a\nb\nc']
+    assert join_messages(['aaa', 'bbb', 'ccc'], limit=7) == ['aaa\nbbb', 'ccc']
+    assert join_messages(['aaaa\nbbbb'], limit=6) == ['aaaa', 'bbbb']
+    assert join_messages(['a' * 10], limit=4) == ['aaaa', 'aaaa', 'aa']
+    assert all(len(text) <= 4096 for text in join_messages(['x' * 1000] * 20))
+
+
+def test_issue_notify_combined_messages():
+    update = {
+        'webhookEvent': 'jira:issue_updated',
+        'issue_event_type_name': 'issue_generic',
+        'user': {'displayName': 'John Doe'},
+        'changelog': {'items': [
+            {'field': 'status', 'fromString': 'Open', 'toString': 'Done'},
+            {'field': 'resolution', 'fromString': None, 'toString': 'Fixed'},
+        ]},
+    }
+    notifier = IssueNotify(update, CHAT_IDS, HOST, None, connected_users=set(CHAT_IDS), issue_key='JTB-99')
+    notifier.notify()
+    assert len(notifier.plan) == 2 * len(CHAT_IDS)
+
+    notifier = IssueNotify(update, CHAT_IDS, HOST, None, connected_users=set(CHAT_IDS), issue_key='JTB-99')
+    notifier.combine_messages = True
+    notifier.notify()
+    assert len(notifier.plan) == len(CHAT_IDS)
+    assert 'Done' in notifier.plan[0][1] and 'Fixed' in notifier.plan[0][1]
+
+
+def issue_update(items):
+    return {
+        'webhookEvent': 'jira:issue_updated',
+        'issue_event_type_name': 'issue_generic',
+        'user': {'displayName': 'John Doe'},
+        'changelog': {'items': items},
+    }
+
+
+def issue_changes(*updates):
+    changes = list()
+    for items in updates:
+        notifier = IssueNotify(
+            issue_update(items), CHAT_IDS, HOST, None, connected_users=set(CHAT_IDS), issue_key='JTB-99'
+        )
+        notifier.notify()
+        changes.extend(notifier.changes)
+    return changes
+
+
+def test_merge_changes_net_transition():
+    changes = issue_changes(
+        [{'field': 'status', 'fromString': 'Open', 'toString': 'In Progress'}],
+        [{'field': 'description'}],
+        [{'field': 'status', 'fromString': 'In Progress', 'toString': 'Done'}],
+        [{'field': 'description'}],
+    )
+    merged = merge_changes(changes)
+    assert [change['key'] for change in merged] == ['status', 'description']
+    assert merged[0]['data']['old_status'] == 'Open'
+    assert merged[0]['data']['new_status'] == 'Done'
+
+
+def test_merge_changes_reverted_transition():
+    changes = issue_changes(
+        [{'field': 'status', 'fromString': 'Open', 'toString': 'In Progress'}],
+        [{'field': 'status', 'fromString': 'In Progress', 'toString': 'Open'}],
+        [{'field': 'resolution', 'fromString': None, 'toString': 'Fixed'}],
+    )
+    merged = merge_changes(changes)
+    assert [change['key'] for change in merged] == ['resolution']
+    assert merged[0]['data']['old_resolution'] == 'Unresolved'
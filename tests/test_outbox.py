@@ -0,0 +1,24 @@
+from web.app import redis_conn
+from web.webhooks import outbox
+
+CHAT_IDS = [208810129, 2010129, 2088129]
+
+
+def test_store_payload_once():
+    payloads = [{'chat_id': chat_id, 'text': 'Test outbox', 'parse_mode': 'HTML'} for chat_id in CHAT_IDS]
+    messages = outbox.store(payloads)
+    assert [message['chat_id'] for message in messages] == CHAT_IDS
+    assert len({message['payload_id'] for message in messages}) == 1
+    assert outbox.resolve(messages) == payloads
+
+
+def test_resolve_compressed_and_expired():
+    payload = {'chat_id': CHAT_IDS[0], 'text': 'x' * 10 * outbox.COMPRESS_MIN, 'parse_mode': 'Markdown'}
+    message = outbox.store([payload])[0]
+    key = outbox.OUTBOX_KEY.format(message['payload_id'])
+    assert len(redis_conn.get(key)) < outbox.COMPRESS_MIN
+    assert outbox.resolve([message]) == [payload]
+
+    redis_conn.delete(key)
+    full = {'chat_id': CHAT_IDS[1], 'text': 'Test', 'parse_mode': 'HTML'}
+    assert outbox.resolve([message, full]) == [None, full]
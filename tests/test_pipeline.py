@@ -0,0 +1,146 @@
+import json
+
+import pytest
+
+from web.app import redis_conn
+from web.webhooks import pipeline
+from lib.fair_queue import FairQueue
+from web.webhooks.pipeline import is_supported, peek_event
+
+
+def test_peek_event():
+    # quotes inside strings are escaped, so a description before the event type doesn't match
+    update = {
+        'issue': {'fields': {'description': 'Set "webhookEvent": "jira:version_released"'}},
+        'webhookEvent': 'jira:issue_updated',
+    }
+    assert peek_event(json.dumps(update).encode()) == 'jira:issue_updated'
+    assert peek_event(b'{"timestamp": 1525698237764, "webhookEvent":"sprint_started"}') == 'sprint_started'
+    assert peek_event(b'{"timestamp": 1525698237764}') is None
+
+
+def test_is_supported():
+    assert is_supported(b'{"webhookEvent": "comment_created"}') is True
+    assert is_supported(b'{"webhookEvent": "jira:version_released"}') is False
+    assert is_supported(b'{"webhookEvent": "board_updated"}') is False
+
+
+def update_body(timestamp):
+    return json.dumps({'webhookEvent': 'jira:issue_updated', 'timestamp': timestamp}).encode()
+
+
+@pytest.fixture
+def dedup(monkeypatch):
+    monkeypatch.setattr(pipeline, 'DEDUP_TTL', 60)
+    yield 'test-dedup'
+    for key in redis_conn.scan_iter(pipeline.RECEIVED_KEY.format('test-dedup', '*')):
+        redis_conn.delete(key)
+
+
+def test_duplicate_update_is_rejected(dedup):
+    assert pipeline.claim_update(dedup, update_body(1)) is True
+    # Jira retries a delivery with the same body
+    assert pipeline.claim_update(dedup, update_body(1)) is False
+    # the same event at another time is another update
+    assert pipeline.claim_update(dedup, update_body(2)) is True
+    assert 0 < redis_conn.ttl(pipeline.received_key(dedup, update_body(1))) <= 60
+
+
+def test_released_update_is_accepted(dedup):
+    assert pipeline.claim_update(dedup, update_body(1))
+    pipeline.release_update(dedup, update_body(1))
+    assert not pipeline.is_received(dedup, update_body(1))
+    assert pipeline.claim_update(dedup, update_body(1)) is True
+
+
+def test_deduplication_disabled(dedup, monkeypatch):
+    monkeypatch.setattr(pipeline, 'DEDUP_TTL', 0)
+    assert pipeline.claim_update(dedup, update_body(1)) is True
+    assert pipeline.claim_update(dedup, update_body(1)) is True
+    assert not pipeline.is_received(dedup, update_body(1))
+
+
+def test_failed_update_of_batch_is_released(dedup, monkeypatch):
+    updates = [
+        {'data': json.dumps({'webhookEvent': 'comment_created', 'timestamp': i}), 'kwargs': {
+            'webhook_id': dedup, 'project_key': 'JTB', 'issue_key': f'JTB-{i}'
+        }}
+        for i in range(3)
+    ]
+    for update in updates:
+        assert pipeline.claim_update(dedup, update['data'].encode())
+
+    monkeypatch.setattr(pipeline.db, 'get_subscribers_by_topic', lambda webhook_id, topics: {('project', 'JTB'): {1}})
+    monkeypatch.setattr(pipeline.db, 'get_connected_users', lambda chat_ids: set())
+    notified = list()
+
+    def notify(jira_update, chat_ids, host, db, **kwargs):
+        if kwargs['issue_key'] == 'JTB-1':
+            raise KeyError('issue')
+        notified.append(kwargs['issue_key'])
+
+    monkeypatch.setattr(pipeline, 'notify', notify)
+    pipeline.route_batch({'_id': dedup, 'host_url': 'https://jira.test'}, updates)
+
+    assert notified == ['JTB-0', 'JTB-2']
+    # only the failed update is accepted again
+    assert pipeline.is_received(dedup, updates[0]['data'])
+    assert not pipeline.is_received(dedup, updates[1]['data'])
+    assert pipeline.is_received(dedup, updates[2]['data'])
+
+
+@pytest.fixture
+def failing_routing(monkeypatch):
+    monkeypatch.setattr(pipeline, 'DEDUP_TTL', 60)
+    monkeypatch.setattr(pipeline.db, 'get_webhook', lambda webhook_id: {'_id': webhook_id})
+
+    def route_batch(webhook, updates):
+        raise RuntimeError('Mongo is not available')
+
+    monkeypatch.setattr(pipeline, 'route_batch', route_batch)
+
+
+def test_failed_batch_is_released(failing_routing):
+    webhook_id = 'test-batch'
+    data = json.dumps({'webhookEvent': 'comment_created', 'timestamp': 1})
+    assert pipeline.claim_update(webhook_id, data.encode())
+    redis_conn.rpush(pipeline.UPDATES_KEY.format(webhook_id), json.dumps({'data': data, 'kwargs': {}}))
+
+    with pytest.raises(RuntimeError):
+        pipeline.process_batch(webhook_id)
+    # a retry of the delivery is accepted
+    assert not pipeline.is_received(webhook_id, data)
+    assert not redis_conn.exists(pipeline.DRAIN_LOCK_KEY.format(webhook_id))
+
+
+def test_failed_update_is_released(failing_routing, monkeypatch):
+    webhook_id = 'test-update'
+    data = json.dumps({'webhookEvent': 'comment_created', 'timestamp': 3})
+
+    def route_update(webhook, data, **kwargs):
+        raise RuntimeError('Mongo is not available')
+
+    monkeypatch.setattr(pipeline, 'route_update', route_update)
+    assert pipeline.claim_update(webhook_id, data.encode())
+    with pytest.raises(RuntimeError):
+        pipeline.process_update(data, webhook_id=webhook_id)
+    assert not pipeline.is_received(webhook_id, data)
+
+
+def test_failed_turn_is_released(failing_routing, monkeypatch):
+    webhook_id = 'test-turn'
+    data = json.dumps({'webhookEvent': 'comment_created', 'timestamp': 2})
+    fair_queue = FairQueue(redis_conn, prefix='test:fair')
+    monkeypatch.setattr(pipeline, 'fair_queue', fair_queue)
+    monkeypatch.setattr(pipeline.process_turn, 'delay', lambda lane: None)
+    assert pipeline.claim_update(webhook_id, data.encode())
+    lane = fair_queue.push(webhook_id, json.dumps({'data': data, 'kwargs': {}}))
+
+    try:
+        with pytest.raises(RuntimeError):
+            pipeline.process_turn(lane)
+        assert not pipeline.is_received(webhook_id, data)
+        assert fair_queue.backlog() == {}
+    finally:
+        for key in redis_conn.scan_iter('test:fair:*'):
+            redis_conn.delete(key)
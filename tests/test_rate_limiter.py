@@ -0,0 +1,25 @@
+import pytest
+
+from lib.rate_limiter import TokenBucketLimiter
+from web.app import redis_conn
+
+
+@pytest.fixture
+def limiter():
+    yield TokenBucketLimiter(redis_conn, {'global': (10, 2), 'chat': (1, 1)}, prefix='test:ratelimit')
+    for key in redis_conn.scan_iter('test:ratelimit:*'):
+        redis_conn.delete(key)
+
+
+def test_acquire_takes_tokens(limiter):
+    assert limiter.acquire(('global', 'bot')) == 0
+    assert limiter.acquire(('global', 'bot')) == 0
+    assert 0 < limiter.acquire(('global', 'bot')) <= 0.1
+
+
+def test_acquire_several_buckets(limiter):
+    assert limiter.acquire(('global', 'bot'), ('chat', 1)) == 0
+    # the empty chat bucket doesn't take a token from the global one
+    assert 0 < limiter.acquire(('global', 'bot'), ('chat', 1)) <= 1
+    assert limiter.acquire(('global', 'bot'), ('chat', 2)) == 0
+    assert limiter.acquire(('global', 'bot'), ('chat', 3)) > 0
@@ -36,6 +36,7 @@ class TestScheduleCommands:
     def prepare_schedule_commands(self):
         instance = copy.deepcopy(schedule_commands)
         instance._ScheduleCommands__commands = dict()
+        instance._ScheduleCommands__examples = None
         return instance
 
     def setup_method(self, method):
@@ -88,6 +89,12 @@ class TestScheduleCommands:
         assert commands.ListUnresolvedIssuesCommand in self.schedule_commands.values()
         assert commands.HelpCommand not in self.schedule_commands.values()
 
+    def test_examples(self):
+        self.schedule_commands.register('/liststatus', commands.ListStatusIssuesCommand)
+        assert commands.ListStatusIssuesCommand.example_description in self.schedule_commands.examples
+        self.schedule_commands.register('/listunresolved', commands.ListUnresolvedIssuesCommand)
+        assert commands.ListUnresolvedIssuesCommand.example_description in self.schedule_commands.examples
+
     def test_getitem(self):
         self.schedule_commands.register('/liststatus', commands.ListStatusIssuesCommand)
         assert self.schedule_commands['/liststatus'] == commands.ListStatusIssuesCommand
@@ -0,0 +1,213 @@
+import pytest
+
+from lib.telegram_api import TelegramResponse
+from web.app import redis_conn
+from web.webhooks import tasks
+
+CHAT_ID = 208810129
+PAYLOAD = {'chat_id': CHAT_ID, 'text': 'Test tasks', 'parse_mode': 'HTML'}
+
+
+class CannedClient:
+    """Answers every call of the Bot API with the same response"""
+
+    def __init__(self, response):
+        self.response = response
+        self.calls = list()
+
+    def call(self, method, payload):
+        self.calls.append((method, payload))
+        return self.response
+
+
+@pytest.fixture
+def outcome(monkeypatch):
+    outcome = {'requeued': list(), 'dead_letters': list()}
+    monkeypatch.setattr(tasks, 'throttle', lambda chat_id: 0)
+    monkeypatch.setattr(
+        tasks.send_message, 'apply_async',
+        lambda args, kwargs, **options: outcome['requeued'].append(dict(options, message=args[0], **kwargs))
+    )
+    monkeypatch.setattr(tasks.db, 'create_dead_letter', outcome['dead_letters'].append)
+    return outcome
+
+
+@pytest.fixture
+def pruned(monkeypatch):
+    scheduled = list()
+    redis_conn.delete(tasks.PRUNE_CHATS_KEY, tasks.PRUNE_LOCK_KEY)
+    monkeypatch.setattr(tasks.prune_chats, 'apply_async', lambda args, countdown: scheduled.append(countdown))
+    yield scheduled
+    redis_conn.delete(tasks.PRUNE_CHATS_KEY, tasks.PRUNE_LOCK_KEY)
+
+
+def respond(monkeypatch, status_code, data):
+    client = CannedClient(TelegramResponse(status_code, data))
+    monkeypatch.setattr(tasks, 'get_client', lambda: client)
+    return client
+
+
+def error(status_code, description, **parameters):
+    return {'ok': False, 'error_code': status_code, 'description': description, 'parameters': parameters}
+
+
+def test_sent_message(monkeypatch, outcome):
+    client = respond(monkeypatch, 200, {'ok': True, 'result': {'message_id': 42}})
+    assert tasks.send(PAYLOAD, PAYLOAD) == 42
+    assert client.calls == [('sendMessage', PAYLOAD)]
+    assert outcome == {'requeued': [], 'dead_letters': []}
+
+
+def test_throttled_message_is_not_failed_attempt(monkeypatch, outcome):
+    monkeypatch.setattr(tasks, 'throttle', lambda chat_id: 3)
+    client = respond(monkeypatch, 200, {'ok': True, 'result': {'message_id': 42}})
+    assert tasks.send(PAYLOAD, PAYLOAD, attempt=2) == tasks.REQUEUED
+    assert not client.calls
+    assert outcome['requeued'][0]['countdown'] == 3
+    assert outcome['requeued'][0]['retries'] == 2
+
+
+def test_throttled_chat_keeps_order_in_chunk(monkeypatch, outcome):
+    other_chat = CHAT_ID + 1
+    messages = [{'chat_id': chat_id, 'text': text} for chat_id, text in (
+        (CHAT_ID, 'first'), (CHAT_ID, 'second'), (other_chat, 'other'), (CHAT_ID, 'third'),
+    )]
+    monkeypatch.setattr(tasks.outbox, 'resolve', lambda messages: messages)
+    # the chat runs out of tokens on its second message
+    tokens = {CHAT_ID: 1, other_chat: 1}
+
+    def throttle(chat_id):
+        tokens[chat_id] -= 1
+        return 0 if tokens[chat_id] >= 0 else 2
+
+    monkeypatch.setattr(tasks, 'throttle', throttle)
+    requeued = list()
+    monkeypatch.setattr(
+        tasks.send_messages, 'apply_async', lambda args, **options: requeued.append(dict(options, messages=args[0]))
+    )
+    client = respond(monkeypatch, 200, {'ok': True, 'result': {'message_id': 42}})
+
+    tasks.send_messages(messages)
+    assert [payload['text'] for _, payload in client.calls] == ['first', 'other']
+    # the rest of the chat is queued again by one task in order
+    assert requeued == [{'countdown': 2, 'queue': tasks.RETRIES_QUEUE, 'messages': [messages[1], messages[3]]}]
+    assert outcome['requeued'] == []
+
+
+def test_retry_after_countdown(monkeypatch, outcome):
+    respond(monkeypatch, 429, error(429, 'Too Many Requests: retry after 5', retry_after=5))
+    callbacks = ['remember']
+    assert tasks.send(PAYLOAD, PAYLOAD, attempt=1, callbacks=callbacks) == tasks.REQUEUED
+    retry, = outcome['requeued']
+    assert 5 <= retry['countdown'] <= 6
+    assert retry['retries'] == 2
+    assert retry['queue'] == tasks.RETRIES_QUEUE
+    assert retry['link'] == callbacks
+    assert retry['message'] == PAYLOAD and retry['method'] == 'sendMessage'
+    assert not outcome['dead_letters']
+
+
+def test_server_error_backoff(monkeypatch, outcome):
+    respond(monkeypatch, 502, error(502, 'Bad Gateway'))
+    for attempt in range(4):
+        assert tasks.send(PAYLOAD, PAYLOAD, attempt=attempt) == tasks.REQUEUED
+    for attempt, retry in enumerate(outcome['requeued']):
+        assert 0 <= retry['countdown'] <= tasks.BACKOFF_BASE * 2 ** attempt
+        assert retry['retries'] == attempt + 1
+    assert not outcome['dead_letters']
+
+
+def test_dead_letter_after_max_attempts(monkeypatch, outcome):
+    respond(monkeypatch, 500, error(500, 'Internal Server Error'))
+    assert tasks.send(PAYLOAD, PAYLOAD, attempt=tasks.MAX_ATTEMPTS - 1) is None
+    assert not outcome['requeued']
+    dead_letter, = outcome['dead_letters']
+    assert dead_letter['payload'] == PAYLOAD
+    assert dead_letter['attempts'] == tasks.MAX_ATTEMPTS
+    assert dead_letter['reason'] == '500 Internal Server Error'
+
+
+def test_rejected_message_is_dead_letter(monkeypatch, outcome):
+    respond(monkeypatch, 400, error(400, "Bad Request: can't parse entities"))
+    assert tasks.send(PAYLOAD, PAYLOAD) is None
+    assert not outcome['requeued']
+    assert [dead_letter['attempts'] for dead_letter in outcome['dead_letters']] == [1]
+
+
+def test_not_modified_edit_is_success(monkeypatch, outcome):
+    payload = dict(PAYLOAD, message_id=42)
+    respond(monkeypatch, 400, error(
+        400, 'Bad Request: message is not modified: specified new message content and reply markup are '
+             'exactly the same as a current content and reply markup of the message'
+    ))
+    assert tasks.send(payload, payload, method='editMessageText') is None
+    assert outcome == {'requeued': [], 'dead_letters': []}
+
+
+@pytest.mark.parametrize('status_code, description', [
+    (403, 'Forbidden: bot was blocked by the user'),
+    (403, 'Forbidden: bot was kicked from the group chat'),
+    (400, 'Bad Request: chat not found'),
+    (400, 'Bad Request: user is deactivated'),
+])
+def test_unreachable_chat_is_pruned(monkeypatch, outcome, pruned, status_code, description):
+    respond(monkeypatch, status_code, error(status_code, description))
+    assert tasks.send(PAYLOAD, PAYLOAD) is None
+    assert outcome == {'requeued': [], 'dead_letters': []}
+    assert redis_conn.smembers(tasks.PRUNE_CHATS_KEY) == {str(CHAT_ID).encode()}
+    assert pruned == [tasks.PRUNE_WINDOW]
+
+
+def test_chats_are_pruned_by_one_task(pruned):
+    for chat_id in (CHAT_ID, CHAT_ID + 1, CHAT_ID + 2):
+        tasks.prune_chat(chat_id, '403 Forbidden: bot was blocked by the user')
+    assert redis_conn.scard(tasks.PRUNE_CHATS_KEY) == 3
+    assert len(pruned) == 1
+
+
+def test_bad_request_is_not_pruned(monkeypatch, outcome, pruned):
+    response = TelegramResponse(400, error(400, "Bad Request: can't parse entities"))
+    assert not tasks.is_unreachable(response)
+
+    respond(monkeypatch, 400, error(400, "Bad Request: can't parse entities"))
+    tasks.send(PAYLOAD, PAYLOAD)
+    assert not redis_conn.exists(tasks.PRUNE_CHATS_KEY)
+    assert not pruned
+    assert len(outcome['dead_letters']) == 1
+
+
+def test_migrated_chat(monkeypatch, outcome, pruned):
+    new_chat_id = -1001234567890
+    migrated = list()
+    monkeypatch.setattr(
+        tasks.db, 'migrate_chat_subscriptions', lambda *chat_ids: migrated.append(chat_ids) or 2
+    )
+    respond(monkeypatch, 400, error(
+        400, 'Bad Request: group chat was upgraded to a supergroup chat', migrate_to_chat_id=new_chat_id
+    ))
+    payload = dict(PAYLOAD, chat_id=-1234)
+    callbacks = ['remember']
+    assert tasks.send(payload, payload, attempt=1, callbacks=callbacks) == tasks.REQUEUED
+    assert migrated == [(-1234, new_chat_id)]
+
+    # the message is sent into the new chat without spending an attempt
+    retry, = outcome['requeued']
+    assert retry['message'] == dict(PAYLOAD, chat_id=new_chat_id)
+    assert retry['retries'] == 1
+    assert retry['link'] == callbacks
+    assert not outcome['dead_letters']
+    assert not pruned
+
+
+def test_pruned_chats_keep_credentials(monkeypatch, pruned):
+    calls = list()
+    monkeypatch.setattr(
+        tasks.db, 'disable_chats_subscriptions', lambda chat_ids: calls.append(('disable', chat_ids)) or 2
+    )
+    monkeypatch.setattr(tasks.db, 'get_chats_webhooks', lambda chat_ids: {'webhook'})
+    monkeypatch.setattr(tasks.db, 'request_webhooks_sync', lambda webhook_ids: calls.append(('sync', webhook_ids)))
+    monkeypatch.setattr(tasks.db, 'update_user', lambda *args: calls.append(('update_user', args)))
+    tasks.prune_chat(CHAT_ID, '403 Forbidden: bot was blocked by the user')
+
+    tasks.prune_chats()
+    assert calls == [('disable', [CHAT_ID]), ('sync', {'webhook'})]
@@ -0,0 +1,33 @@
+import pytest
+import requests
+
+from lib.telegram_api import TelegramClient, TelegramConnectionError, TelegramResponse
+
+
+def test_response_parsing():
+    response = TelegramResponse(200, {'ok': True, 'result': {'message_id': 42, 'text': 'Hi'}})
+    assert response.ok
+    assert response.message_id == 42
+
+    response = TelegramResponse(429, {
+        'ok': False, 'description': 'Too Many Requests: retry after 5', 'parameters': {'retry_after': 5}
+    })
+    assert not response.ok
+    assert response.message_id is None
+    assert response.retry_after == 5
+
+    response = TelegramResponse(400, {'ok': False, 'parameters': {'migrate_to_chat_id': -1001234}})
+    assert response.migrate_to_chat_id == -1001234
+
+
+def test_connection_error_without_token(monkeypatch):
+    client = TelegramClient(token='123:secret')
+
+    def post(url, *args, **kwargs):
+        raise requests.ConnectionError(f'Max retries exceeded with url: {url}')
+
+    monkeypatch.setattr(client.session, 'post', post)
+    with pytest.raises(TelegramConnectionError) as error:
+        client.send_message(208810129, 'Hi')
+    assert '123:secret' not in str(error.value)
+    assert 'sendMessage' in str(error.value)
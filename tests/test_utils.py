@@ -1,10 +1,12 @@
+import os
+
 import pendulum
 import pytest
 
-from web.webhooks.views import IssueWebhookView
 from bot.exceptions import DateTimeValidationError
 from bot.paginations import split_by_pages
 from lib import utils
+from web.app import redis_conn
 
 
 def test_password_encryption_decryption():
@@ -59,16 +61,49 @@ def test_calculate_tracking_time():
     assert 0.0 == utils.calculate_tracking_time(0)
 
 
-def test_filters_subscribers():
-    subs = [
-        {'topic': 'project', 'name': 'JA', 'chat_id': 208810129},
-        {'topic': 'project', 'name': 'JTB', 'chat_id': 2010129},
-        {'topic': 'project', 'name': 'IHB', 'chat_id': 2088129},
-        {'topic': 'project', 'name': 'CORP', 'chat_id': 8810129},
-        {'topic': 'issue', 'name': 'JTB-99', 'chat_id': 208810789},
-        {'topic': 'issue', 'name': 'IHB-1', 'chat_id': 208810987},
-        {'topic': 'issue', 'name': 'CORP-11', 'chat_id': 20881},
-        {'topic': 'issue', 'name': 'JA-241', 'chat_id': 10789},
-    ]
-    assert {208810129} == IssueWebhookView.filters_subscribers(subs, project='JA')
-    assert {2010129, 208810789} == IssueWebhookView.filters_subscribers(subs, project='JTB', issue='JTB-99')
+def test_templates_registry():
+    path = os.path.join('web', 'webhooks', 'templates', 'issue_status.txt')
+    template = utils.read_template(path)
+    assert template is utils.read_template(path)
+    assert template.template == utils.read_file(path)
+
+
+def test_build_webhook_jql():
+    assert utils.build_webhook_jql([], []) == ''
+    assert utils.build_webhook_jql(['JTB', 'ABC'], ['JTB-99', 'DEV-1']) == (
+        'project in ("ABC", "JTB") OR issuekey in ("DEV-1")'
+    )
+    # too many issues are replaced by their projects
+    assert utils.build_webhook_jql(['JTB'], ['DEV-1', 'DEV-2', 'OPS-3'], max_issues=2) == (
+        'project in ("DEV", "JTB", "OPS")'
+    )
+
+
+class ScheduledTask:
+    """Records scheduled runs instead of queueing them"""
+
+    def __init__(self):
+        self.runs = list()
+
+    def apply_async(self, args, countdown):
+        self.runs.append((args, countdown))
+
+
+def test_debounce():
+    key = 'test:debounce:lock'
+    task = ScheduledTask()
+    try:
+        assert utils.debounce(redis_conn, key, 5, task, ('JTB-99',)) is True
+        # an item queued before the run is handled by the scheduled run
+        assert utils.debounce(redis_conn, key, 5, task, ('JTB-99',)) is False
+        assert task.runs == [(('JTB-99',), 5)]
+        assert 0 < redis_conn.ttl(key) <= 305
+
+        assert utils.release_debounce(redis_conn, key, lambda: 0) is False
+        assert not redis_conn.exists(key)
+        assert utils.debounce(redis_conn, key, 0, task, ('JTB-99',)) is True
+        # an item queued while the task was running is left for the next run
+        assert utils.release_debounce(redis_conn, key, lambda: 1) is True
+        assert len(task.runs) == 2
+    finally:
+        redis_conn.delete(key)
@@ -0,0 +1,67 @@
+import pytest
+
+from bot.webhooks import WebhookFilterSync
+
+WEBHOOK_ID = '5c0a7e9f1d2e3f0001000001'
+
+
+class StubDB:
+
+    def __init__(self, jql):
+        self.webhook = {'_id': WEBHOOK_ID, 'jira_webhook_id': '10', 'owner_id': 1, 'jql': jql}
+        self.updates = list()
+
+    def get_webhook(self, webhook_id=None, host_url=None):
+        return self.webhook
+
+    def get_webhook_topics(self, webhook_id):
+        return {'project': ['JTB'], 'issue': ['OPS-1']}
+
+    def update_webhook(self, data, webhook_id=None, host_url=None):
+        self.updates.append((webhook_id, data))
+
+    def get_registered_webhooks(self):
+        return [WEBHOOK_ID]
+
+
+class StubJira:
+
+    def __init__(self):
+        self.calls = list()
+
+    def update_webhook(self, jira_webhook_id, name, url, jql, auth_data=None):
+        self.calls.append((jira_webhook_id, jql, auth_data))
+
+
+class StubApp:
+
+    def __init__(self, jql):
+        self.db = StubDB(jql)
+        self.jira = StubJira()
+
+    def authorization(self, telegram_id):
+        return f'auth of {telegram_id}'
+
+
+JQL = 'project in ("JTB") OR issuekey in ("OPS-1")'
+
+
+def test_unchanged_filter_is_not_synced():
+    app = StubApp(JQL)
+    WebhookFilterSync(app).sync(WEBHOOK_ID)
+    assert app.jira.calls == []
+    assert app.db.updates == []
+
+
+@pytest.mark.parametrize('jql', ['', 'project in ("JTB")'])
+def test_changed_filter_is_synced(jql):
+    app = StubApp(jql)
+    WebhookFilterSync(app).sync(WEBHOOK_ID)
+    assert app.jira.calls == [('10', JQL, 'auth of 1')]
+    assert app.db.updates == [(WEBHOOK_ID, {'jql': JQL})]
+
+
+def test_registered_webhooks_are_synced_at_startup():
+    app = StubApp('')
+    WebhookFilterSync(app).sync_all_job(None, None)
+    assert app.db.updates == [(WEBHOOK_ID, {'jql': JQL})]
@@ -2,14 +2,18 @@ import logging
 
 from flask import Flask
 from celery import Celery
+from celery.schedules import crontab
 from celery.signals import after_setup_logger
 from decouple import config
+from redis import StrictRedis
 
 from lib.db import MongoBackend
+from lib.metrics import Metrics
 
 import logger
 
 db = MongoBackend()
+db.create_routing_indexes()
 
 # Flask settings
 app = Flask(__name__)
@@ -17,8 +21,35 @@ app.secret_key = config('SECRET_KEY')
 
 logger = logger.logger
 
+redis_conn = StrictRedis.from_url(config('REDIS_URL', default='') or config('CELERY_BROKER_URL'))
+metrics = Metrics(redis_conn)
+
 celery = Celery(app.name)
 celery.conf.broker_url = config("CELERY_BROKER_URL")
+# outbound Telegram traffic is split into queues served by separate workers,
+# so a huge fan-out or a retry storm never delays small notifications
+NOTIFICATIONS_QUEUE = 'notifications'  # small fan-outs, live messages and direct replies
+BULK_QUEUE = 'bulk'  # large fan-outs
+SCHEDULED_QUEUE = 'scheduled'  # digests
+RETRIES_QUEUE = 'retries'  # throttled and failed messages
+celery.conf.task_routes = {
+    'web.webhooks.tasks.send_message': {'queue': NOTIFICATIONS_QUEUE},
+    'web.webhooks.tasks.send_messages': {'queue': NOTIFICATIONS_QUEUE},
+    'web.webhooks.delivery.remember_live_message': {'queue': NOTIFICATIONS_QUEUE},
+    'web.webhooks.delivery.flush_digests': {'queue': SCHEDULED_QUEUE},
+}
+celery.conf.beat_schedule = {
+    'hourly-digests': {
+        'task': 'web.webhooks.delivery.flush_digests',
+        'schedule': crontab(minute=0),
+        'args': ('hourly',),
+    },
+    'daily-digests': {
+        'task': 'web.webhooks.delivery.flush_digests',
+        'schedule': crontab(minute=0, hour=config('WEBHOOK_DIGEST_HOUR', default=9, cast=int)),
+        'args': ('daily',),
+    },
+}
 
 from .auth import auth as auth_blueprint
 app.register_blueprint(auth_blueprint, url_prefix='/auth')
@@ -2,10 +2,10 @@ from flask import redirect, request, session, url_for
 from flask.views import View
 from flask_oauthlib.client import OAuthException
 
-import requests
 import jira
 from decouple import config
 
+from lib.telegram_api import TelegramConnectionError, get_client
 from lib.utils import read_rsa_key
 from . import auth
 from .oauth import JiraOAuthApp
@@ -40,12 +40,12 @@ class SendToChatMixin:
     """
     Send message to user into chat.
     """
-    querystring = '/sendMessage?chat_id={}&text={}'
-    api_bot_url = 'https://api.telegram.org/bot{}'.format(config('BOT_TOKEN'))
 
     def send_to_chat(self, chat_id, message):
-        url = self.api_bot_url + self.querystring.format(chat_id, message)
-        requests.get(url)
+        try:
+            get_client().send_message(chat_id, message)
+        except TelegramConnectionError as error:
+            logger.error(f"Can't send a message into chat {chat_id}: {error}")
 
 
 class AuthorizeView(SendToChatMixin, OAuthJiraBaseView):
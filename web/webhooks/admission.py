@@ -0,0 +1,91 @@
+import time
+
+from decouple import config
+from redis import StrictRedis
+
+from .delivery import DEGRADED_KEY
+from .pipeline import fair_queue
+from ..app import BULK_QUEUE, NOTIFICATIONS_QUEUE, RETRIES_QUEUE, SCHEDULED_QUEUE, metrics, redis_conn
+
+# queued celery tasks and webhook updates at which busy webhooks are switched
+# to digest mode and at which updates are rejected, 0 - no limit
+DEGRADE_DEPTH = config('WEBHOOK_DEGRADE_DEPTH', default=0, cast=int)
+SHED_DEPTH = config('WEBHOOK_SHED_DEPTH', default=0, cast=int)
+# seconds after which Jira is asked to deliver a rejected update again
+RETRY_AFTER = config('WEBHOOK_RETRY_AFTER', default=60, cast=int)
+# a webhook sending more updates per minute is busy
+BUSY_RATE = config('WEBHOOK_BUSY_RATE', default=60, cast=int)
+# seconds a busy webhook stays in digest mode
+DEGRADE_TTL = config('WEBHOOK_DEGRADE_TTL', default=600, cast=int)
+# the queue depth is checked at most once per CHECK_INTERVAL seconds by a process
+CHECK_INTERVAL = 1
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+OVERLOADED = 'overloaded'
+STATES = (NORMAL, DEGRADED, OVERLOADED)
+
+QUEUES = ('celery', NOTIFICATIONS_QUEUE, BULK_QUEUE, SCHEDULED_QUEUE, RETRIES_QUEUE)
+RATE_KEY = 'admission:{}:rate:{}'
+
+# queues of the Redis broker are lists named after the queues,
+# the depth of another broker is not known, so only webhook updates are counted
+_broker_url = config('CELERY_BROKER_URL')
+broker_conn = StrictRedis.from_url(_broker_url) if _broker_url.startswith(('redis', 'unix')) else None
+
+_state = {'checked': 0, 'state': NORMAL, 'depth': 0}
+
+
+def queue_depth():
+    """:return: number of tasks in celery queues and updates waiting in the fair queue"""
+    depth = sum(fair_queue.backlog().values())
+    if broker_conn is not None:
+        pipe = broker_conn.pipeline(transaction=False)
+        for queue in QUEUES:
+            pipe.llen(queue)
+        depth += sum(pipe.execute())
+    return depth
+
+
+def get_state():
+    """
+    :return: (admission state, queue depth), they are recalculated at most once per CHECK_INTERVAL
+    """
+    if not (DEGRADE_DEPTH or SHED_DEPTH):
+        return NORMAL, 0
+
+    now = time.monotonic()
+    if now - _state['checked'] >= CHECK_INTERVAL:
+        depth = queue_depth()
+        if SHED_DEPTH and depth >= SHED_DEPTH:
+            state = OVERLOADED
+        elif DEGRADE_DEPTH and depth >= DEGRADE_DEPTH:
+            state = DEGRADED
+        else:
+            state = NORMAL
+        _state.update(checked=now, state=state, depth=depth)
+    return _state['state'], _state['depth']
+
+
+def note_update(webhook):
+    """
+    Counts updates of a webhook while the service is degraded, a busy
+    webhook is switched to digest mode for DEGRADE_TTL seconds
+    :param webhook: a webhook in dict type
+    """
+    key = RATE_KEY.format(webhook.get('_id'), int(time.time() // 60))
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.incr(key)
+    pipe.expire(key, 120)
+    rate, _ = pipe.execute()
+    if rate == BUSY_RATE:
+        redis_conn.set(DEGRADED_KEY.format(webhook.get('host_url')), 1, ex=DEGRADE_TTL)
+        metrics.incr('jtb_webhook_degraded_total')
+
+
+def gauges():
+    """:return: gauges of the admission state and the queue depth for the metrics"""
+    state, _ = get_state()
+    return [('jtb_webhook_admission_state', {'state': name}, int(name == state)) for name in STATES] + [
+        ('jtb_queue_depth', {}, queue_depth()),
+    ]
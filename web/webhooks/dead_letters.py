@@ -0,0 +1,42 @@
+"""
+Sends undelivered messages from dead letters again.
+
+Usage: python -m web.webhooks.dead_letters [--batch-size N] [--limit N]
+"""
+import argparse
+
+from .tasks import send_message
+from ..app import RETRIES_QUEUE, db, logger
+
+
+def replay(batch_size=100, limit=None):
+    """
+    Queues dead letters for sending in batches of the oldest messages.
+    A batch is removed from dead letters with one query after queueing,
+    a message which fails again returns into dead letters by itself
+    :param batch_size: number of messages read and removed at once
+    :param limit: max number of replayed messages, all by default
+    :return: number of replayed messages
+    """
+    replayed = 0
+    while limit is None or replayed < limit:
+        size = batch_size if limit is None else min(batch_size, limit - replayed)
+        letters = db.get_dead_letters(size)
+        if not letters:
+            break
+
+        for letter in letters:
+            send_message.apply_async((letter['payload'],), {'method': letter['method']}, queue=RETRIES_QUEUE)
+        db.delete_dead_letters([letter['_id'] for letter in letters])
+        replayed += len(letters)
+
+    logger.info(f'{replayed} dead letters were replayed')
+    return replayed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send undelivered messages from dead letters again.')
+    parser.add_argument('--batch-size', type=int, default=100, help='messages queued at once')
+    parser.add_argument('--limit', type=int, default=None, help='max number of messages, all by default')
+    args = parser.parse_args()
+    print(f'Replayed: {replay(args.batch_size, args.limit)}')
@@ -0,0 +1,359 @@
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+from decouple import config
+
+from lib.utils import debounce, join_messages, read_template, release_debounce
+from . import outbox
+from .tasks import send_message, send_messages
+from ..app import BULK_QUEUE, NOTIFICATIONS_QUEUE, SCHEDULED_QUEUE, celery, redis_conn
+
+# max number of messages sent by one task of a broadcast
+BROADCAST_CHUNK = config('WEBHOOK_BROADCAST_CHUNK', default=50, cast=int)
+# a broadcast of more messages is queued into the bulk queue
+SMALL_FANOUT = config('WEBHOOK_SMALL_FANOUT', default=50, cast=int)
+# broadcasts of a host which sent more than TENANT_RATE messages within a minute are queued
+# into the bulk queue, so an import on one Jira host doesn't delay notifications of the others, 0 - no limit
+TENANT_RATE = config('WEBHOOK_TENANT_RATE', default=600, cast=int)
+# changes of an issue are held for COALESCE_WINDOW seconds and sent by one message, 0 - sent at once
+COALESCE_WINDOW = config('WEBHOOK_COALESCE_WINDOW', default=0, cast=int)
+# the flush lock expires by itself if a worker died while flushing changes
+FLUSH_LOCK_TIMEOUT = 300
+DIGEST_PERIODS = ('hourly', 'daily')
+# the first message on changes of an issue is edited by changes of the next LIVE_WINDOW seconds,
+# 0 - every update is sent by a new message. Takes precedence over coalescing
+LIVE_WINDOW = config('WEBHOOK_LIVE_WINDOW', default=0, cast=int)
+
+CHANGES_KEY = 'coalesce:{}:{}:changes'
+FLUSH_LOCK_KEY = 'coalesce:{}:{}:flush'
+DIGEST_KEY = 'digest:{}:messages'
+DIGEST_CHATS_KEY = 'digest:{}:chats'
+LIVE_WINDOW_KEY = 'live:{}:{}:{}:window'
+LIVE_CHANGES_KEY = 'live:{}:changes'
+LIVE_MESSAGE_KEY = 'live:{}:message'
+# set by admission control for a busy host while the service is overloaded
+DEGRADED_KEY = 'admission:{}:degraded'
+TENANT_RATE_KEY = 'tenant:{}:sent:{}'
+
+
+def prepare_payloads(plan, parse_mode):
+    """
+    Generates payloads of sendMessage requests for sending messages into chats
+    :param plan: list of (chat_id, message)
+    :param parse_mode: parse mode of the messages
+    :return: list of dicts
+    """
+    return [{'chat_id': chat_id, 'text': m, 'parse_mode': parse_mode} for chat_id, m in plan]
+
+
+def is_busy(host, count):
+    """
+    Counts messages broadcast for a Jira host within the current minute
+    :param host: a Jira host, messages without a host are not counted
+    :param count: number of messages
+    :return: True if the host sent more than TENANT_RATE messages
+    """
+    if not (TENANT_RATE and host):
+        return False
+    key = TENANT_RATE_KEY.format(host, int(time.time() // 60))
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.incrby(key, count)
+    pipe.expire(key, 120)
+    sent, _ = pipe.execute()
+    return sent > TENANT_RATE
+
+
+def broadcast(payloads, queue=None, host=None):
+    """Broadcasting messaging. Every distinct payload is stored in the outbox once,
+    queued messages only refer to it. Messages are queued by chunks,
+    so a broadcast takes one broker message per BROADCAST_CHUNK messages
+    :param payloads: prepared payloads of sendMessage requests
+    :type payloads: list
+    :param queue: celery queue, by default notifications for a small fan-out
+                  and bulk for a large one or for a busy host
+    :param host: a Jira host of the messages
+    """
+    messages = outbox.store(payloads)
+    if queue is None:
+        busy = is_busy(host, len(messages))
+        queue = NOTIFICATIONS_QUEUE if len(messages) <= SMALL_FANOUT and not busy else BULK_QUEUE
+    for i in range(0, len(messages), BROADCAST_CHUNK):
+        send_messages.apply_async((messages[i:i + BROADCAST_CHUNK],), queue=queue)
+
+
+def deliver(notifier):
+    """
+    Delivers the message plan of a notifier. Messages to chats in digest mode
+    (all chats of a host degraded by admission control) are put aside until
+    the next digest, changes of an issue are held for the coalescing window,
+    the rest of the plan is sent at once
+    :param notifier: a notifier with the rendered message plan
+    """
+    plan = list(OrderedDict.fromkeys(notifier.plan))
+    if not plan:
+        return
+
+    digest_chats = notifier.db.get_digest_chats({chat_id for chat_id, _ in plan})
+    if redis_conn.exists(DEGRADED_KEY.format(notifier.host)):
+        # chats which chose a digest period keep it, the others get hourly digests
+        digest_chats = {**{chat_id: 'hourly' for chat_id, _ in plan}, **digest_chats}
+    if digest_chats:
+        hold_digest([entry for entry in plan if entry[0] in digest_chats], notifier.parse_mode, digest_chats)
+        plan = [entry for entry in plan if entry[0] not in digest_chats]
+
+    if (LIVE_WINDOW or COALESCE_WINDOW) and notifier.changes and plan:
+        chat_ids = list(OrderedDict.fromkeys(chat_id for chat_id, _ in plan))
+        if LIVE_WINDOW:
+            hold_live(notifier.host, notifier.issue, chat_ids, notifier.changes, notifier.parse_mode)
+        else:
+            hold_changes(notifier.host, notifier.issue, chat_ids, notifier.changes, notifier.parse_mode)
+        return
+
+    broadcast(prepare_payloads(plan, notifier.parse_mode), host=notifier.host)
+
+
+def merge_changes(changes):
+    """
+    Merges changes of an issue in order of their arrival. A later change of a field
+    supersedes the earlier one; a transition keeps the initial value, so only the net
+    transition is shown and a field which returned to its initial value is dropped
+    :param changes: list of dicts with key, template, data and transition of a change
+    :return: list of merged changes
+    """
+    merged = OrderedDict()
+    for change in changes:
+        previous = merged.pop(change['key'], None)
+        if previous and change['transition'] and previous['transition'] == change['transition']:
+            old_field = change['transition'][0]
+            change = dict(change, data=dict(change['data'], **{old_field: previous['data'][old_field]}))
+        merged[change['key']] = change
+
+    result = list()
+    for change in merged.values():
+        if change['transition']:
+            old_field, new_field = change['transition']
+            if change['data'][old_field] == change['data'][new_field]:
+                continue
+        result.append(change)
+    return result
+
+
+def render_changes(changes):
+    """Renders merged changes into texts which fit into the Telegram message limit"""
+    messages = [read_template(change['template']).substitute(**change['data']).strip() for change in changes]
+    return join_messages(messages)
+
+
+def hold_changes(host, issue, chat_ids, changes, parse_mode):
+    """
+    Holds changes of an issue for the coalescing window. The first held changes
+    schedule flushing, so all changes of the window are sent by one message
+    :param host: a Jira host of the issue
+    :param issue: an issue key e.g. JTB-99
+    :param chat_ids: recipients of the changes
+    :param changes: list of dicts with key, template, data and transition of a change
+    :param parse_mode: parse mode of the rendered changes
+    """
+    item = {'chat_ids': chat_ids, 'changes': changes, 'parse_mode': parse_mode}
+    redis_conn.rpush(CHANGES_KEY.format(host, issue), json.dumps(item))
+    schedule_flush(host, issue)
+
+
+def schedule_flush(host, issue):
+    """Schedules flushing of held changes of the issue if it is not scheduled yet"""
+    debounce(
+        redis_conn, FLUSH_LOCK_KEY.format(host, issue), COALESCE_WINDOW, flush_changes, (host, issue),
+        timeout=FLUSH_LOCK_TIMEOUT
+    )
+
+
+def hold_digest(plan, parse_mode, digest_chats):
+    """
+    Puts messages aside until the next digest of their chats
+    :param plan: list of (chat_id, message)
+    :param parse_mode: parse mode of the messages
+    :param digest_chats: dict with chat ids and their digest periods
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for chat_id, message in plan:
+        pipe.rpush(DIGEST_KEY.format(chat_id), json.dumps([parse_mode, message]))
+        pipe.sadd(DIGEST_CHATS_KEY.format(digest_chats[chat_id]), chat_id)
+    pipe.execute()
+
+
+def hold_live(host, issue, chat_ids, changes, parse_mode):
+    """
+    Adds changes of an issue to live messages of the chats. A chat without an open
+    window of the issue receives a new message which is edited by changes of the window
+    :param host: a Jira host of the issue
+    :param issue: an issue key e.g. JTB-99
+    :param chat_ids: recipients of the changes
+    :param changes: list of dicts with key, template, data and transition of a change
+    :param parse_mode: parse mode of the rendered changes
+    """
+    texts = render_changes(merge_changes(changes))
+    # every window has its own id, so changes of a closed window are never shown in a new one.
+    # Changes which cancel each other open no window, they are only added to open windows
+    pipe = redis_conn.pipeline(transaction=False)
+    for chat_id in chat_ids:
+        window_key = LIVE_WINDOW_KEY.format(host, issue, chat_id)
+        if texts:
+            pipe.set(window_key, uuid.uuid4().hex, nx=True, ex=LIVE_WINDOW)
+        pipe.get(window_key)
+    results = pipe.execute()
+    flags, windows = (results[::2], results[1::2]) if texts else ([False] * len(chat_ids), results)
+
+    started, continued = list(), list()
+    for chat_id, opened, window in zip(chat_ids, flags, windows):
+        if window is None:
+            continue
+        window = window.decode()
+        pipe.rpush(LIVE_CHANGES_KEY.format(window), *(json.dumps(change) for change in changes))
+        pipe.expire(LIVE_CHANGES_KEY.format(window), 2 * LIVE_WINDOW)
+        (started if opened else continued).append((chat_id, window))
+    pipe.execute()
+
+    for chat_id, window in started:
+        payloads = prepare_payloads([(chat_id, text) for text in texts], parse_mode)
+        broadcast(payloads[:-1], host=host)
+        # the last message is edited by next changes of the window
+        send_message.apply_async(
+            (payloads[-1],), link=remember_live_message.s(host, issue, chat_id, window, len(changes), parse_mode)
+        )
+    if continued:
+        edit_live_messages(host, issue, continued, parse_mode)
+
+
+def edit_live_messages(host, issue, windows, parse_mode):
+    """
+    Edits live messages of the chats to show all changes of their windows.
+    A message which is not sent yet is edited after sending, if it isn't sent
+    at all, its window is closed by remember_live_message
+    :param host: a Jira host of the issue
+    :param issue: an issue key e.g. JTB-99
+    :param windows: list of (chat_id, window id)
+    :param parse_mode: parse mode of the rendered changes
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for _, window in windows:
+        pipe.get(LIVE_MESSAGE_KEY.format(window))
+        pipe.lrange(LIVE_CHANGES_KEY.format(window), 0, -1)
+    results = pipe.execute()
+
+    rendered = dict()
+    for (chat_id, window), message_id, changes in zip(windows, results[::2], results[1::2]):
+        if not message_id:
+            continue
+
+        changes = tuple(changes)
+        if changes not in rendered:
+            rendered[changes] = render_changes(merge_changes([json.loads(change) for change in changes]))
+        texts = rendered[changes]
+        if not texts:
+            # changes of the window cancelled each other, the message is left as it is
+            continue
+
+        payload = {'chat_id': chat_id, 'message_id': int(message_id), 'text': texts[0], 'parse_mode': parse_mode}
+        send_message.delay(payload, method='editMessageText')
+        if len(texts) > 1:
+            # the changes don't fit into one message anymore, next changes start a new window
+            redis_conn.delete(LIVE_WINDOW_KEY.format(host, issue, chat_id))
+            broadcast(prepare_payloads([(chat_id, text) for text in texts[1:]], parse_mode), host=host)
+
+
+@celery.task
+def remember_live_message(message_id, host, issue, chat_id, window, count, parse_mode):
+    """Remembers a sent live message, so next changes of its window edit it.
+
+    Changes added while the message was being sent are shown at once.
+    If the message wasn't sent, the window is closed, so the next change
+    of the issue is sent by a new message instead of editing nothing.
+
+    Arguments:
+        message_id (int): id of the sent message, None if it wasn't sent
+        host (str): a Jira host of the issue
+        issue (str): an issue key e.g. JTB-99
+        chat_id (int): a telegram chat id
+        window (str): id of the live window
+        count (int): number of changes shown by the message
+        parse_mode (str): parse mode of the rendered changes
+    """
+    if not message_id:
+        window_key = LIVE_WINDOW_KEY.format(host, issue, chat_id)
+        # a window opened after this one expired is kept
+        if redis_conn.get(window_key) == window.encode():
+            redis_conn.delete(window_key)
+        return
+
+    redis_conn.set(LIVE_MESSAGE_KEY.format(window), message_id, ex=2 * LIVE_WINDOW)
+    if redis_conn.llen(LIVE_CHANGES_KEY.format(window)) > count:
+        edit_live_messages(host, issue, [(chat_id, window)], parse_mode)
+
+
+@celery.task
+def flush_changes(host, issue):
+    """Sends changes of an issue held during the coalescing window.
+
+    Every chat receives one message with merged changes of the updates
+    it was a recipient of. Chats with the same updates share rendered texts.
+
+    Arguments:
+        host (str): a Jira host of the issue
+        issue (str): an issue key e.g. JTB-99
+    """
+    key = CHANGES_KEY.format(host, issue)
+    pipe = redis_conn.pipeline()
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    items, _ = pipe.execute()
+
+    try:
+        items = [json.loads(item) for item in items]
+        updates = OrderedDict()
+        for index, item in enumerate(items):
+            for chat_id in item['chat_ids']:
+                updates.setdefault(chat_id, list()).append(index)
+
+        recipients = OrderedDict()
+        for chat_id, indexes in updates.items():
+            recipients.setdefault(tuple(indexes), list()).append(chat_id)
+
+        for indexes, chat_ids in recipients.items():
+            changes = [change for index in indexes for change in items[index]['changes']]
+            texts = render_changes(merge_changes(changes))
+            plan = [(chat_id, text) for chat_id in chat_ids for text in texts]
+            broadcast(prepare_payloads(plan, items[indexes[0]]['parse_mode']), host=host)
+    finally:
+        if release_debounce(redis_conn, FLUSH_LOCK_KEY.format(host, issue), lambda: redis_conn.llen(key)):
+            schedule_flush(host, issue)
+
+
+@celery.task
+def flush_digests(period):
+    """Sends put aside messages to chats in digest mode of the period.
+
+    Messages of a chat are joined into as few texts as possible,
+    messages with different parse modes are sent separately.
+
+    Arguments:
+        period (str): hourly or daily
+    """
+    chats_key = DIGEST_CHATS_KEY.format(period)
+    for chat_id in redis_conn.smembers(chats_key):
+        chat_id = chat_id.decode()
+        pipe = redis_conn.pipeline()
+        pipe.lrange(DIGEST_KEY.format(chat_id), 0, -1)
+        pipe.delete(DIGEST_KEY.format(chat_id))
+        pipe.srem(chats_key, chat_id)
+        items = pipe.execute()[0]
+
+        messages = OrderedDict()
+        for item in items:
+            parse_mode, message = json.loads(item)
+            messages.setdefault(parse_mode, list()).append(message.strip())
+
+        for parse_mode, texts in messages.items():
+            plan = [(chat_id, text) for text in join_messages(texts, separator='\n\n')]
+            broadcast(prepare_payloads(plan, parse_mode), queue=SCHEDULED_QUEUE)
@@ -4,6 +4,8 @@ def connect_required(func):
     """
     Decorator for commands: to check the availability and connect of user.
     If the checks are successful, users chat_id appended to list of listeners.
+    Connection of all users is checked with one query, or taken from
+    the `connected_users` keyword argument if it was already resolved.
     """
     def wrapper(*args, **kwargs):
         try:
@@ -13,14 +15,15 @@ def connect_required(func):
             func(*args, **kwargs)
             return
 
-        filtered_chat_ids = []
-
-        for chat_id in chat_ids:
-            # do not proceed any actions for disconnected user
-            if not db.is_user_connected(chat_id):
-                logging.debug('connect_required decorator: User disconnected')
-            else:
-                filtered_chat_ids.append(chat_id)
+        connected_users = kwargs.pop('connected_users', None)
+        if connected_users is None:
+            connected_users = db.get_connected_users(chat_ids)
+        # do not proceed any actions for disconnected users
+        filtered_chat_ids = [chat_id for chat_id in chat_ids if chat_id in connected_users]
+        if len(filtered_chat_ids) < len(chat_ids):
+            logging.debug('connect_required decorator: {} users disconnected'.format(
+                len(chat_ids) - len(filtered_chat_ids)
+            ))
 
         func(self, update, filtered_chat_ids, host, db, *other_args, **kwargs)
 
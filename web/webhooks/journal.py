@@ -0,0 +1,163 @@
+"""
+Replays webhook updates from the journal through notifiers.
+
+Usage: python -m web.webhooks.journal [--since TIME] [--until TIME] [--webhook ID] [--limit N] [--speed X]
+                                     [--dry-run] [--resend]
+"""
+import argparse
+import time
+from datetime import datetime
+
+import ujson
+from decouple import config
+from pymongo.errors import PyMongoError
+
+from .delivery import deliver
+from .notifier import notify
+from .pipeline import claim_update, release_update
+from ..app import db, logger
+
+# max size of the journal of received updates in megabytes, the oldest updates
+# are overwritten when it is full, 0 - updates are not journaled
+JOURNAL_SIZE = config('WEBHOOK_JOURNAL_SIZE', default=0, cast=int)
+# formats of --since and --until in UTC
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+if JOURNAL_SIZE:
+    db.create_journal(JOURNAL_SIZE * 1024 * 1024)
+
+
+def record_update(data, **kwargs):
+    """
+    Appends an accepted update into the journal. A failed write is only logged,
+    the update is processed anyway
+    :param data: raw body of the Jira update in text
+    :param kwargs: webhook_id, project_key and issue_key from the webhook url
+    """
+    if not JOURNAL_SIZE:
+        return
+    try:
+        db.journal_update({'kwargs': kwargs, 'data': data})
+    except PyMongoError as e:
+        logger.warning(f'Update of the webhook {kwargs.get("webhook_id")} was not journaled: {e}')
+
+
+def parse_time(value):
+    """Parses UTC time of --since and --until"""
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f'{value} is not in a format YYYY-MM-DD[THH:MM[:SS]]')
+
+
+class DryRunSink:
+    """Counts rendered messages instead of delivering them"""
+
+    def __init__(self):
+        self.messages = 0
+        self.chats = set()
+
+    def __call__(self, notifier):
+        plan = set(notifier.plan)
+        self.messages += len(plan)
+        self.chats.update(chat_id for chat_id, _ in plan)
+
+
+class DryRunDB:
+    """Database of a dry run, subscriptions on deleted issues are kept"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def delete_chats_subscription(self, name, chat_ids):
+        return True
+
+
+def replay(entries, speed=1, dry_run=False, resend=False):
+    """
+    Routes journaled updates to current subscribers and renders them. Updates are fed
+    with their original intervals divided by the speed. In a dry run messages are counted only,
+    otherwise they are delivered as usual and celery workers have to be running.
+    An update is claimed as received before routing it, so updates which were processed
+    or are being processed (i.e. remembered within DEDUP_TTL) are skipped, and an update
+    which failed is released to be replayed again
+    :param entries: journaled updates in order of their arrival
+    :param speed: replay speed relatively to the original one, 0 - as fast as possible
+    :param dry_run: True - don't send messages and don't change subscriptions
+    :param resend: True - replay updates which were already processed too
+    :return: dict with numbers of replayed, skipped, failed updates and updates of deleted webhooks,
+             rendered messages and elapsed seconds
+    """
+    sink = DryRunSink() if dry_run else deliver
+    replay_db = DryRunDB(db) if dry_run else db
+    webhooks = dict()
+    # users would receive duplicates of delivered notifications
+    claim = not (dry_run or resend)
+    stats = {'updates': 0, 'skipped': 0, 'missing': 0, 'failed': 0, 'messages': 0, 'elapsed': 0}
+
+    start = time.monotonic()
+    first_received = None
+    for entry in entries:
+        if first_received is None:
+            first_received = entry['receivedAt']
+        if speed:
+            pause = (entry['receivedAt'] - first_received).total_seconds() / speed - (time.monotonic() - start)
+            if pause > 0:
+                time.sleep(pause)
+
+        kwargs = entry['kwargs']
+        webhook_id = kwargs.get('webhook_id')
+        if webhook_id not in webhooks:
+            webhooks[webhook_id] = db.get_webhook(webhook_id=webhook_id)
+        webhook = webhooks[webhook_id]
+        if not webhook:
+            # the webhook was deleted since the update was received
+            stats['missing'] += 1
+            continue
+        if claim and not claim_update(webhook_id, entry['data']):
+            stats['skipped'] += 1
+            continue
+
+        stats['updates'] += 1
+        try:
+            chat_ids = db.get_topic_subscribers(webhook.get('_id'), kwargs.get('project_key'), kwargs.get('issue_key'))
+            if chat_ids:
+                notify(ujson.loads(entry['data']), chat_ids, webhook.get('host_url'), replay_db, sink=sink, **kwargs)
+        except Exception as e:
+            if claim:
+                release_update(webhook_id, entry['data'])
+            stats['failed'] += 1
+            logger.error(f'Replaying the update {entry["_id"]} failed: {e}')
+
+    stats['elapsed'] = time.monotonic() - start
+    if dry_run:
+        stats['messages'] = sink.messages
+    logger.info(f'{stats["updates"]} journaled updates were replayed')
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay webhook updates from the journal.')
+    parser.add_argument('--since', type=parse_time, default=None, help='UTC time of the first update')
+    parser.add_argument('--until', type=parse_time, default=None, help='UTC time after the last update')
+    parser.add_argument('--webhook', default=None, help='webhook id, all webhooks by default')
+    parser.add_argument('--limit', type=int, default=None, help='max number of updates, all by default')
+    parser.add_argument('--speed', type=float, default=1, help='speed relatively to the original, 0 - no pauses')
+    parser.add_argument('--dry-run', action='store_true', help='render messages without sending them')
+    parser.add_argument('--resend', action='store_true', help='send updates which were already processed too')
+    args = parser.parse_args()
+
+    entries = db.get_journal(args.since, args.until, args.webhook, args.limit)
+    stats = replay(entries, args.speed, args.dry_run, args.resend)
+    rate = stats['updates'] / stats['elapsed'] if stats['elapsed'] else 0
+    print(
+        f'Replayed: {stats["updates"]}, skipped: {stats["skipped"]}, failed: {stats["failed"]}, '
+        f'of deleted webhooks: {stats["missing"]}, {rate:.1f} updates/s'
+    )
+    if args.dry_run:
+        print(f'Rendered messages: {stats["messages"]}')
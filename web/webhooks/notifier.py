@@ -4,26 +4,47 @@ from abc import ABCMeta, abstractmethod
 
 from decouple import config
 
-from lib.utils import calculate_tracking_time, read_template
-from .tasks import send_message
+from lib.utils import calculate_tracking_time, join_messages, read_template
+from .delivery import deliver
 from ..app import logger
 from .helpers import connect_required
 
 TEMPLATES_DIR = os.path.join('web', 'webhooks', 'templates')
-BOT_API = 'https://api.telegram.org/bot{}/sendMessage?chat_id={}&text={}&parse_mode={}'
-
-
-def broadcast(urls):
-    """Broadcasting messaging.
-    :param urls: prepared urls to telegram API
-    :type urls: list
+# all changelog items of one issue update are sent by one message
+COMBINED_MESSAGES = config('WEBHOOK_COMBINED_MESSAGES', default=False, cast=bool)
+
+COMMENT_MACRO_RE = re.compile(r'{(?:color|code|panel|noformat|quote)[^}]*}')
+COMMENT_LINK_RE = re.compile(r'\[([^|]*)\|?([^\]]*)\]')
+COMMENT_REPLACEMENTS = (
+    ('\xa0', ' '),
+    ('`', "'"),
+    ('&', '-'),
+    ('#', '-'),
+    ('+', '*'),
+    ('\r\n', '\n'),
+)
+
+
+def sanitize_comment(comment):
     """
-    for url in urls:
-        send_message.delay(url)
+    Replaces Jira wiki markup of a comment which breaks Telegram Markdown
+    and extracts links from the comment.
+    All macros are removed by one compiled regexp, characters are replaced
+    by C-level str.replace passes
+    :param comment: raw comment body
+    :return: tuple(sanitized comment, list of (text, url) links)
+    """
+    text = COMMENT_MACRO_RE.sub(' ', comment) if '{' in comment else comment
+    for search_item, replace_item in COMMENT_REPLACEMENTS:
+        if search_item in text:
+            text = text.replace(search_item, replace_item)
+    return text, COMMENT_LINK_RE.findall(comment)
 
 
 class BaseNotify(metaclass=ABCMeta):
     parse_mode = 'HTML'
+    # structured changes of an issue which may be coalesced with changes of later updates
+    changes = None
 
     @connect_required
     def __init__(self, update, chat_ids, host, db, **kwargs):
@@ -39,21 +60,28 @@ class BaseNotify(metaclass=ABCMeta):
         self.project = kwargs.get('project_key')
         self.issue = kwargs.get('issue_key')
         self.db = db
+        # message plan: list of (chat_id, message) which have to be delivered
+        self.plan = list()
 
     @abstractmethod
     def notify(self):
+        """Renders messages of the update into the message plan"""
         pass
 
-    def prepare_messages(self, messages):
-        """Generates links with messages for sending into chats"""
-        urls = list()
+    def add_messages(self, messages, chat_ids=None):
+        """
+        Adds messages into the message plan
+        :param messages: a message or list of messages
+        :param chat_ids: recipients of the messages, all chats of the update by default
+        """
         if not isinstance(messages, list):
             messages = [messages]
+        if chat_ids is None:
+            chat_ids = self.chat_ids
 
-        for chat_id in self.chat_ids:
+        for chat_id in chat_ids:
             for m in messages:
-                urls.append(BOT_API.format(config('BOT_TOKEN'), chat_id, m, self.parse_mode))
-        return urls
+                self.plan.append((chat_id, m))
 
 
 class WorklogNotify(BaseNotify):
@@ -89,8 +117,7 @@ class WorklogNotify(BaseNotify):
         except KeyError as error:
             logger.error(f"Worklog parser can't send a message: {error}")
         else:
-            urls = self.prepare_messages(msg)
-            broadcast(urls)
+            self.add_messages(msg)
 
     def worklog_logged(self):
         start_time = int(self.update['changelog']['items'][-1]['from'])
@@ -129,58 +156,24 @@ class CommentNotify(BaseNotify):
 
     message_template = 'User *{username}* {action} comment in [{link_name}]({link}):\n\nComment:```{comment}```{links}'
 
-    def _comment_prepare(self, comment):
-        regexp_replace = {
-            r'{color:?[^}]*}': ' ',
-            r'{code:?[^}]*}': ' ',
-            r'{panel:?[^}]*}': ' ',
-            r'{noformat[^}]*}': ' ',
-            r'{quote[^}]*}': ' ',
-        }
-        for search_pattern, replace_pattern in regexp_replace.items():
-            find_strings = set(re.findall(re.compile(search_pattern, re.DOTALL), comment))
-            if not find_strings:
-                continue
-            for find_string in find_strings:
-                comment = comment.replace(find_string, replace_pattern)
-        simple_replace = {
-            u'\xa0': ' ',
-            '`': "'",
-            '&': '-',
-            '#': '-',
-            '+': '*',
-            '\r\n': '\n'
-        }
-        for search_item, replace_item in simple_replace.items():
-            if search_item in comment:
-                comment = comment.replace(search_item, replace_item)
-        return comment
-
-    def _get_comment_links(self, comment):
-        links = ''
-        link_pattern = '\[([^\|]*)\|?([^\]]*)\]'
-        raw_links = re.findall(link_pattern, comment)
-        if raw_links:
-            links += '\n\nLinks from comment:'
-            for raw_link in raw_links:
-                if raw_link[1]:
-                    links += f'\n[{raw_link[0]}]({raw_link[1]})'
-                else:
-                    links += f'\n[{raw_link[0]}]({raw_link[0]})'
-        return links
+    @staticmethod
+    def _format_links(links):
+        if not links:
+            return ''
+        return '\n\nLinks from comment:' + ''.join(f'\n[{text}]({url or text})' for text, url in links)
 
     def notify(self):
+        comment, links = sanitize_comment(self.update['comment']['body'])
         data = {
             'username': self.update['comment']['author']['displayName'],
             'action': self.update.get('webhookEvent').replace('comment_', ''),
             'link': f'{self.host}/browse/{self.issue.upper()}',
             'link_name': self.issue.upper(),
-            'comment': self._comment_prepare(self.update['comment']['body']),
-            'links': self._get_comment_links(self.update['comment']['body'])
+            'comment': comment,
+            'links': self._format_links(links)
         }
         msg = self.message_template.format(**data)
-        urls = self.prepare_messages(msg)
-        broadcast(urls)
+        self.add_messages(msg)
 
 
 class IssueNotify(BaseNotify):
@@ -200,6 +193,8 @@ class IssueNotify(BaseNotify):
     status_action = 'status'
     resolution_action = 'resolution'
 
+    combine_messages = COMBINED_MESSAGES
+
     message_template = {
         'assignee': os.path.join(TEMPLATES_DIR, 'issue_assignee.txt'),
         'status': os.path.join(TEMPLATES_DIR, 'issue_status.txt'),
@@ -212,6 +207,7 @@ class IssueNotify(BaseNotify):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.messages = []
+        self.changes = []
         self.generic_data = {}
 
     def notify(self):
@@ -242,28 +238,43 @@ class IssueNotify(BaseNotify):
             elif self.update['issue_event_type_name'] in (self.updated, self.generic) and field == self.assignee_action:
                 self.issue_reassigned(item, template)
             else:
-                text = read_template(template)
-                self.messages.append(text.substitute(**self.generic_data))
+                self.add_change(field, template, dict())
 
-        urls = self.prepare_messages(self.messages)
-        broadcast(urls)
+        if self.combine_messages:
+            # one message per update, split only if it doesn't fit into the Telegram limit
+            self.messages = join_messages([m.strip() for m in self.messages])
+        self.add_messages(self.messages)
+
+    def add_change(self, field, template, data, key=None, transition=None):
+        """
+        Renders a change of the issue and keeps it for coalescing with later updates
+        :param field: a changed field
+        :param template: path to the template of the change
+        :param data: data of the change for the template
+        :param key: changes with the same key supersede each other, the field by default
+        :param transition: names of the initial and the new value in data if the change is a transition
+        """
+        data.update(self.generic_data)
+        self.messages.append(read_template(template).substitute(**data))
+        self.changes.append({
+            'key': key or field,
+            'template': template,
+            'data': data,
+            'transition': transition,
+        })
 
     def issue_assigned(self, item, template):
         data = {
             'user': item.get('toString'),
         }
-        data.update(self.generic_data)
-        template = read_template(template)
-        self.messages.append(template.substitute(**data))
+        self.add_change(self.assignee_action, template, data)
 
     def issue_status(self, item, template):
         data = {
             'old_status': item.get('fromString'),
             'new_status': item.get('toString'),
         }
-        data.update(self.generic_data)
-        template = read_template(template)
-        self.messages.append(template.substitute(**data))
+        self.add_change(self.status_action, template, data, transition=('old_status', 'new_status'))
 
     def issue_resolution(self, item, template):
         old_resolution = item.get('fromString')
@@ -272,9 +283,7 @@ class IssueNotify(BaseNotify):
             'old_resolution': old_resolution or 'Unresolved',
             'new_resolution': new_resolution or 'Unresolved',
         }
-        data.update(self.generic_data)
-        template = read_template(template)
-        self.messages.append(template.substitute(**data))
+        self.add_change(self.resolution_action, template, data, transition=('old_resolution', 'new_resolution'))
 
     def file_attachment(self, item, template):
         filename = item.get('toString')
@@ -288,18 +297,15 @@ class IssueNotify(BaseNotify):
                 'filename': item.get('fromString'),
                 'action': 'deleted',
             }
-        data.update(self.generic_data)
-        template = read_template(template)
-        self.messages.append(template.substitute(**data))
+        # every file is a separate change, attaching and deleting of a file supersede each other
+        self.add_change(self.attachment_action, template, data, key=f"{self.attachment_action}:{data['filename']}")
 
     def issue_reassigned(self, item, template):
         username = item.get('toString')
         data = {
             'user': username or 'Unassigned',
         }
-        data.update(self.generic_data)
-        template = read_template(template)
-        self.messages.append(template.substitute(**data))
+        self.add_change(self.assignee_action, template, data)
 
 
 class ProjectNotify(BaseNotify):
@@ -307,7 +313,7 @@ class ProjectNotify(BaseNotify):
     Processing updates for Jira projects
     Actions: a project may be created, updated and deleted
     """
-    message_template = os.path.join(TEMPLATES_DIR, 'issue_created.txt')
+    message_template = os.path.join(TEMPLATES_DIR, 'project.txt')
 
     def notify(self):
         data = {
@@ -317,8 +323,7 @@ class ProjectNotify(BaseNotify):
         }
         text = read_template(self.message_template)
         message = text.substitute(**data)
-        urls = self.prepare_messages(message)
-        broadcast(urls)
+        self.add_messages(message)
 
 
 class ProjectIssueNotify(BaseNotify):
@@ -328,29 +333,26 @@ class ProjectIssueNotify(BaseNotify):
         'issue_deleted_unsubscribed': os.path.join(TEMPLATES_DIR, 'issue_deleted_unsubscribed.txt')
     }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.messages = []
-
     def notify(self):
         issue = self.update['issue']['key']
         _, action = self.update['webhookEvent'].split(":")
-        for chat_id in self.chat_ids:
-            if action == 'issue_deleted':
-                issue_subscribed = self.db.get_subscription(chat_id, issue)
-                if issue_subscribed:
-                    action = 'issue_deleted_unsubscribed'
-                    self.db.delete_subscription(chat_id, issue)
-            template = self.message_template[action]
-            text = read_template(template)
-            data = {
-                "issue_link": f"{self.host}/browse/{issue}",
-                "issue_name": issue
-            }
-            message = text.substitute(**data)
-            self.messages.append(message)
-        urls = self.prepare_messages(self.messages)
-        broadcast(urls)
+        data = {
+            "issue_link": f"{self.host}/browse/{issue}",
+            "issue_name": issue
+        }
+
+        chat_ids = self.chat_ids
+        if action == 'issue_deleted':
+            # subscriptions on the deleted issue are removed with one query for all chats
+            subscribed_chats = self.db.get_subscribed_chats(issue, self.chat_ids)
+            if subscribed_chats:
+                self.db.delete_chats_subscription(issue, subscribed_chats)
+                text = read_template(self.message_template['issue_deleted_unsubscribed'])
+                self.add_messages(text.substitute(**data), subscribed_chats)
+            chat_ids = [chat_id for chat_id in self.chat_ids if chat_id not in subscribed_chats]
+
+        text = read_template(self.message_template[action])
+        self.add_messages(text.substitute(**data), chat_ids)
 
 
 class NotifierFactory:
@@ -372,9 +374,11 @@ class NotifierFactory:
         return cls.events.get(event)
 
 
-def notify(update, chat_ids, host, db, **kwargs):
-    """Send broadcast notification"""
+def notify(update, chat_ids, host, db, sink=deliver, **kwargs):
+    """Send broadcast notification, the rendered notifier is passed into the sink (deliver by default)"""
     event = update.get('webhookEvent')
     notifier = NotifierFactory.get_notifier(event)
     if notifier:
-        notifier(update, chat_ids, host, db, **kwargs).notify()
+        notifier = notifier(update, chat_ids, host, db, **kwargs)
+        notifier.notify()
+        sink(notifier)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import zlib
+
+from decouple import config
+
+from ..app import redis_conn
+
+# stored payloads are kept longer than a message may wait for all its attempts
+OUTBOX_TTL = config('WEBHOOK_OUTBOX_TTL', default=86400, cast=int)
+# payloads larger than COMPRESS_MIN bytes are stored compressed
+COMPRESS_MIN = 1024
+
+OUTBOX_KEY = 'outbox:{}'
+
+
+def pack(data):
+    if len(data) < COMPRESS_MIN:
+        return b'j' + data
+    return b'z' + zlib.compress(data)
+
+
+def unpack(value):
+    data = zlib.decompress(value[1:]) if value[:1] == b'z' else value[1:]
+    return json.loads(data.decode())
+
+
+def store(payloads):
+    """
+    Stores every distinct payload once under an id derived from its content
+    and returns compact messages which refer to the stored payloads, so a message
+    sent into many chats is not copied into every queued task
+    :param payloads: list of dicts with chat_id, text and parse_mode
+    :return: list of dicts with chat_id and payload_id
+    """
+    messages, ids, contents = list(), dict(), dict()
+    for payload in payloads:
+        content = tuple(sorted((key, value) for key, value in payload.items() if key != 'chat_id'))
+        if content not in ids:
+            data = json.dumps(dict(content)).encode()
+            ids[content] = hashlib.sha1(data).hexdigest()
+            contents[ids[content]] = data
+        messages.append({'chat_id': payload['chat_id'], 'payload_id': ids[content]})
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for payload_id, data in contents.items():
+        pipe.set(OUTBOX_KEY.format(payload_id), pack(data), ex=OUTBOX_TTL)
+    pipe.execute()
+    return messages
+
+
+def resolve(messages):
+    """
+    Gets payloads of compact messages with one query, full payloads are returned as is
+    :param messages: list of dicts with chat_id and payload_id or full payloads
+    :return: list of payloads, None for a message which payload has expired
+    """
+    ids = list({message['payload_id'] for message in messages if 'payload_id' in message})
+    values = redis_conn.mget([OUTBOX_KEY.format(payload_id) for payload_id in ids]) if ids else list()
+    contents = {payload_id: unpack(value) for payload_id, value in zip(ids, values) if value}
+
+    payloads = list()
+    for message in messages:
+        if 'payload_id' not in message:
+            payloads.append(message)
+        elif message['payload_id'] in contents:
+            payloads.append(dict(contents[message['payload_id']], chat_id=message['chat_id']))
+        else:
+            payloads.append(None)
+    return payloads
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import re
+
+import ujson
+from decouple import config
+
+from lib.fair_queue import FairQueue
+from lib.utils import debounce, release_debounce
+
+from .notifier import NotifierFactory, notify
+from ..app import celery, db, logger, metrics, redis_conn
+
+# updates of one webhook are collected for BATCH_WINDOW seconds and processed
+# by one task (at most BATCH_SIZE updates at once), 0 - every update is processed separately
+BATCH_WINDOW = config('WEBHOOK_BATCH_WINDOW', default=0, cast=float)
+BATCH_SIZE = config('WEBHOOK_BATCH_SIZE', default=100, cast=int)
+# the drain lock expires by itself if a worker died while processing a batch
+DRAIN_LOCK_TIMEOUT = 300
+# updates of different webhooks are processed in deficit round-robin order by at most
+# FAIR_LANES tasks at once, a webhook takes FAIR_QUANTUM * weight updates per turn,
+# so a webhook with a huge backlog doesn't delay updates of the others
+FAIR_QUEUING = config('WEBHOOK_FAIR_QUEUING', default=False, cast=bool)
+FAIR_QUANTUM = config('WEBHOOK_FAIR_QUANTUM', default=20, cast=int)
+FAIR_LANES = config('WEBHOOK_FAIR_LANES', default=4, cast=int)
+# a delivery of the same update within DEDUP_TTL seconds is dropped, 0 - no deduplication
+DEDUP_TTL = config('WEBHOOK_DEDUP_TTL', default=3600, cast=int)
+
+UPDATES_KEY = 'webhook:{}:updates'
+DRAIN_LOCK_KEY = 'webhook:{}:drain'
+RECEIVED_KEY = 'webhook:{}:received:{}'
+
+# a quote inside a JSON string is escaped, so only a key of the update object matches
+EVENT_PATTERN = re.compile(rb'"webhookEvent"\s*:\s*"([^"\\]*)"')
+
+fair_queue = FairQueue(redis_conn, quantum=FAIR_QUANTUM, lanes=FAIR_LANES, timeout=DRAIN_LOCK_TIMEOUT)
+
+
+def peek_event(data):
+    """
+    Finds the event type of a raw update without parsing it. Jira puts
+    `webhookEvent` at the beginning of the body, so only a few bytes of it are scanned
+    :param data: raw body of the Jira update in bytes
+    :return: event type e.g. jira:issue_updated or None
+    """
+    match = EVENT_PATTERN.search(data)
+    if match:
+        return match.group(1).decode()
+
+
+def is_supported(data):
+    """:return: True if there is a notifier for the event type of a raw update"""
+    return NotifierFactory.get_notifier(peek_event(data)) is not None
+
+
+def received_key(webhook_id, data):
+    """:return: key of a received update, data is a raw body in bytes or text"""
+    if isinstance(data, str):
+        data = data.encode()
+    return RECEIVED_KEY.format(webhook_id, hashlib.sha1(data).hexdigest())
+
+
+def is_received(webhook_id, data):
+    """:return: True if the update was received within DEDUP_TTL and wasn't released after a failure"""
+    return bool(redis_conn.exists(received_key(webhook_id, data)))
+
+
+def claim_update(webhook_id, data):
+    """
+    Marks an update as received. Jira retries a delivery which timed out with the same body,
+    so an update is identified by the hash of its body (which contains the event timestamp)
+    :param webhook_id: string ObjectId of the webhook
+    :param data: raw body of the Jira update in bytes
+    :return: False if the update was already received
+    """
+    if not DEDUP_TTL:
+        return True
+    if redis_conn.set(received_key(webhook_id, data), 1, nx=True, ex=DEDUP_TTL):
+        return True
+    metrics.incr('jtb_webhook_duplicates_total')
+    return False
+
+
+def release_update(webhook_id, data):
+    """Forgets an update which failed to be processed, so a retry of its delivery is accepted"""
+    if DEDUP_TTL:
+        redis_conn.delete(received_key(webhook_id, data))
+
+
+def release_batch(webhook_id, items):
+    """
+    Forgets queued updates of a webhook which failed to be processed before routing them
+    (e.g. subscribers couldn't be resolved). The updates are not queued
+    again, so an update which always fails doesn't block the queue of the webhook,
+    but a retry of their delivery or a replay from the journal is accepted
+    :param webhook_id: string ObjectId of the webhook
+    :param items: queued items with raw `data` and `kwargs` of the updates
+    """
+    logger.error(f'{len(items)} updates of the webhook {webhook_id} failed to be processed')
+    if DEDUP_TTL and items:
+        redis_conn.delete(*(received_key(webhook_id, json.loads(item)['data']) for item in items))
+
+
+def route_update(webhook, data, **kwargs):
+    """
+    Resolves subscribers of an update and sends notifications to them.
+    The update is parsed only if somebody is subscribed to it
+    :param webhook: a webhook in dict type
+    :param data: raw body of the Jira update
+    :param kwargs: project_key and issue_key
+    :return: False if the update has no subscribers
+    """
+    chat_ids = db.get_topic_subscribers(webhook.get('_id'), kwargs.get('project_key'), kwargs.get('issue_key'))
+    if not chat_ids:
+        return False
+
+    jira_update = ujson.loads(data)
+    notify(jira_update, chat_ids, webhook.get('host_url'), db, **kwargs)
+    return True
+
+
+def route_batch(webhook, updates):
+    """
+    Routes several updates of one webhook. Subscribers of all projects and issues
+    and their connection are resolved with two queries for the whole batch.
+    An update which failed to be routed is released and the others are routed anyway
+    :param webhook: a webhook in dict type
+    :param updates: list of dicts with raw `data` and `kwargs` of the updates in arrival order
+    """
+    topics = list()
+    for update in updates:
+        topics.append(('project', update['kwargs'].get('project_key')))
+        if update['kwargs'].get('issue_key'):
+            topics.append(('issue', update['kwargs'].get('issue_key')))
+
+    subscribers = db.get_subscribers_by_topic(webhook.get('_id'), topics)
+    connected_users = db.get_connected_users(set().union(*subscribers.values()))
+
+    for update in updates:
+        kwargs = update['kwargs']
+        chat_ids = set(subscribers.get(('project', kwargs.get('project_key')), set()))
+        if kwargs.get('issue_key'):
+            chat_ids |= subscribers.get(('issue', kwargs.get('issue_key')), set())
+        if not chat_ids:
+            continue
+
+        try:
+            jira_update = ujson.loads(update['data'])
+            notify(jira_update, chat_ids, webhook.get('host_url'), db, connected_users=connected_users, **kwargs)
+        except Exception:
+            # the other updates are already taken from the queue, so they are routed anyway
+            logger.exception(f"An update of the webhook {kwargs.get('webhook_id')} failed to be processed")
+            release_update(kwargs.get('webhook_id'), update['data'])
+
+
+def enqueue_update(data, weight=1, **kwargs):
+    """
+    Queues an update accepted by a webhook view for processing in celery workers
+    :param data: raw body of the Jira update
+    :param weight: share of the webhook in fair queuing
+    :param kwargs: webhook_id, project_key and issue_key from the webhook url
+    """
+    if FAIR_QUEUING:
+        lane = fair_queue.push(kwargs.get('webhook_id'), json.dumps({'data': data, 'kwargs': kwargs}), weight)
+        if lane is not None:
+            process_turn.delay(lane)
+        return
+
+    if not BATCH_WINDOW:
+        process_update.delay(data, **kwargs)
+        return
+
+    webhook_id = kwargs.get('webhook_id')
+    redis_conn.rpush(UPDATES_KEY.format(webhook_id), json.dumps({'data': data, 'kwargs': kwargs}))
+    schedule_batch(webhook_id, BATCH_WINDOW)
+
+
+def schedule_batch(webhook_id, countdown):
+    """Schedules draining of the webhook updates if it is not scheduled yet"""
+    debounce(
+        redis_conn, DRAIN_LOCK_KEY.format(webhook_id), countdown, process_batch, (webhook_id,),
+        timeout=DRAIN_LOCK_TIMEOUT
+    )
+
+
+@celery.task
+def process_update(data, **kwargs):
+    """Routes and renders an update accepted by a webhook view in asynchronous mode.
+
+    Arguments:
+        data (str): raw body of the Jira update
+        kwargs: webhook_id, project_key and issue_key from the webhook url
+    """
+    try:
+        webhook = db.get_webhook(webhook_id=kwargs.get('webhook_id'))
+        if not webhook:
+            logger.warning(f"Webhook {kwargs.get('webhook_id')} was deleted before processing an update")
+            return
+
+        route_update(webhook, data, **kwargs)
+    except Exception:
+        # a retry of the delivery or a replay from the journal is accepted
+        release_update(kwargs.get('webhook_id'), data)
+        raise
+
+
+@celery.task
+def process_batch(webhook_id):
+    """Drains queued updates of a webhook and routes them as one batch.
+
+    Arguments:
+        webhook_id (str): string ObjectId of the webhook
+    """
+    key = UPDATES_KEY.format(webhook_id)
+    pipe = redis_conn.pipeline()
+    pipe.lrange(key, 0, BATCH_SIZE - 1)
+    pipe.ltrim(key, BATCH_SIZE, -1)
+    items, _ = pipe.execute()
+
+    try:
+        webhook = db.get_webhook(webhook_id=webhook_id)
+        if not webhook:
+            logger.warning(f'Webhook {webhook_id} was deleted before processing {len(items)} updates')
+        elif items:
+            route_batch(webhook, [json.loads(item) for item in items])
+    except Exception:
+        release_batch(webhook_id, items)
+        raise
+    finally:
+        if release_debounce(redis_conn, DRAIN_LOCK_KEY.format(webhook_id), lambda: redis_conn.llen(key)):
+            schedule_batch(webhook_id, 0)
+
+
+@celery.task
+def process_turn(lane):
+    """Routes updates of the next webhook in the fair queue and queues the next turn.
+    The lane is released when there are no webhooks with queued updates.
+
+    Arguments:
+        lane (int): index of the lane held by the task
+    """
+    turn = fair_queue.take()
+    if turn is None:
+        lane = fair_queue.release_lane(lane)
+        if lane is not None:
+            process_turn.delay(lane)
+        return
+
+    webhook_id, items = turn
+    try:
+        webhook = db.get_webhook(webhook_id=webhook_id)
+        if not webhook:
+            logger.warning(f'Webhook {webhook_id} was deleted before processing {len(items)} updates')
+        elif items:
+            route_batch(webhook, [json.loads(item) for item in items])
+            metrics.incr('jtb_webhook_updates_total', len(items), webhook=webhook_id)
+    except Exception:
+        release_batch(webhook_id, items)
+        raise
+    finally:
+        fair_queue.release(webhook_id)
+        fair_queue.refresh_lane(lane)
+        process_turn.delay(lane)
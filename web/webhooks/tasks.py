@@ -1,23 +1,270 @@
-import requests
+import random
+import time
+from collections import OrderedDict
 
-from ..app import celery, logger
+from decouple import config
 
+from lib.rate_limiter import TokenBucketLimiter
+from lib.telegram_api import TelegramConnectionError, get_client
+from lib.utils import debounce, release_debounce
+from . import outbox
+from ..app import RETRIES_QUEUE, celery, db, logger, metrics, redis_conn
 
-@celery.task(bind=True, rate_limit='30/s')
-def send_message(self, url):
-    """Send message into a user chat.
+# Telegram limits: about 30 messages per second overall,
+# 1 message per second into a chat with short bursts of a few messages allowed
+# and 20 messages per minute into a group. (messages per second, burst size) of every bucket
+limiter = TokenBucketLimiter(redis_conn, {
+    'global': (
+        config('TELEGRAM_GLOBAL_RATE', default=30, cast=float),
+        config('TELEGRAM_GLOBAL_BURST', default=30, cast=int),
+    ),
+    'chat': (
+        config('TELEGRAM_CHAT_RATE', default=1, cast=float),
+        config('TELEGRAM_CHAT_BURST', default=3, cast=int),
+    ),
+    'group': (
+        config('TELEGRAM_GROUP_RATE', default=20 / 60, cast=float),
+        config('TELEGRAM_GROUP_BURST', default=20, cast=int),
+    ),
+})
+# a shorter wait for a token is slept through, a longer one returns the message into the queue
+MAX_THROTTLE_SLEEP = 0.25
+# a message which wasn't delivered after MAX_ATTEMPTS attempts is moved to dead letters
+MAX_ATTEMPTS = config('TELEGRAM_MAX_ATTEMPTS', default=8, cast=int)
+# a retry is delayed for a random time up to BACKOFF_BASE * 2 ** attempt, but not more than BACKOFF_CAP seconds
+BACKOFF_BASE = 1
+BACKOFF_CAP = 300
+# an edit which doesn't change a message is not an error
+NOT_MODIFIED = 'message is not modified'
+# descriptions of 400 errors which mean the chat doesn't exist anymore,
+# any 403 error means the bot was blocked or kicked from the chat
+GONE_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'group chat was deleted')
+# unreachable chats are collected for PRUNE_WINDOW seconds and pruned by one task
+PRUNE_WINDOW = config('TELEGRAM_PRUNE_WINDOW', default=60, cast=int)
+# result of an attempt after which the message was queued again
+REQUEUED = 'requeued'
 
-    If response status is 429 - returns message into queue and tries
-    message sending again later. You should run this task in queue with
-    30 concurrency workers.
+PRUNE_CHATS_KEY = 'prune:chats'
+PRUNE_LOCK_KEY = 'prune:lock'
 
-    Arguments:
-        url (str): prepared url to telegram API
+
+def throttle(chat_id):
+    """
+    Takes tokens of the global, chat and group (for a group chat) buckets
+    :param chat_id: telegram chat id, ids of groups are negative
+    :return: 0 if the message may be sent, otherwise seconds to wait
+    """
+    buckets = [('global', 'bot'), ('chat', chat_id)]
+    if str(chat_id).startswith('-'):
+        buckets.append(('group', chat_id))
+
+    wait = limiter.acquire(*buckets)
+    while 0 < wait <= MAX_THROTTLE_SLEEP:
+        time.sleep(wait)
+        wait = limiter.acquire(*buckets)
+    return wait
+
+
+def backoff(attempt):
+    """
+    Exponential backoff with full jitter, so messages failed at the same moment
+    are retried at different times instead of coming back together
+    :param attempt: number of the failed attempt, starting with 0
+    :return: seconds before the next attempt
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def dead_letter(payload, method, reason, attempts):
+    """Moves an undelivered message to dead letters, they may be sent again by the replay command"""
+    logger.error(f"{method} into chat {payload.get('chat_id')} failed after {attempts} attempts: {reason}")
+    db.create_dead_letter({'method': method, 'payload': payload, 'reason': reason, 'attempts': attempts})
+    metrics.incr('jtb_dead_letters_total')
+
+
+def is_unreachable(response):
+    """:return: True if messages into the chat will never be delivered"""
+    if response.status_code == 403:
+        return True
+    return response.status_code == 400 and any(error in response.description for error in GONE_CHAT_ERRORS)
+
+
+def prune_chat(chat_id, reason):
+    """Queues an unreachable chat for pruning, chats are pruned by batches"""
+    logger.info(f'Chat {chat_id} is unreachable and will be pruned: {reason}')
+    redis_conn.sadd(PRUNE_CHATS_KEY, chat_id)
+    schedule_prune()
+
+
+def schedule_prune():
+    """Schedules pruning of queued chats if it is not scheduled yet"""
+    debounce(redis_conn, PRUNE_LOCK_KEY, PRUNE_WINDOW, prune_chats, timeout=PRUNE_WINDOW)
+
+
+def migrate_chat(message, payload, method, new_chat_id, attempt, callbacks):
+    """Moves subscriptions of a group upgraded to a supergroup and sends the message into the new chat"""
+    chat_id = payload.get('chat_id')
+    count = db.migrate_chat_subscriptions(int(chat_id), new_chat_id)
+    logger.info(f'Chat {chat_id} was migrated to {new_chat_id}, {count} subscriptions were moved')
+    metrics.incr('jtb_migrated_chats_total')
+    send_message.apply_async(
+        (dict(message, chat_id=new_chat_id),), {'method': method}, link=callbacks, retries=attempt, queue=RETRIES_QUEUE
+    )
+
+
+def send(message, payload, method='sendMessage', attempt=0, callbacks=None):
+    """
+    Makes an attempt to send a message. The message is sent only if global, chat
+    and group limits of Telegram allow it, otherwise it is queued again for the time
+    the limits allow it, so a throttled chat never blocks the workers for other chats
+    :param message: a queued message, a compact message refers to a payload in the outbox
+    :param payload: parameters of the Bot API method: chat_id, text, parse_mode
+    :param method: sendMessage or editMessageText
+    :param attempt: number of failed attempts
+    :param callbacks: signatures called with the result of a queued again message
+    :return: id of the sent or edited message, REQUEUED if the message was queued again,
+             None if sending failed
+    """
+    wait = throttle(payload.get('chat_id'))
+    if wait:
+        # waiting for the limits is not a failed attempt
+        send_message.apply_async(
+            (message,), {'method': method}, countdown=wait, link=callbacks, retries=attempt, queue=RETRIES_QUEUE
+        )
+        return REQUEUED
+    return call_api(message, payload, method, attempt, callbacks)
+
+
+def call_api(message, payload, method='sendMessage', attempt=0, callbacks=None):
+    """
+    Calls the Bot API method for a message which passed the limits.
+
+    If response status is 429 - the message is retried after `retry_after`
+    seconds, on 5xx and network errors - after an exponential backoff with jitter.
+    A message into a group upgraded to a supergroup is sent into the new chat,
+    a blocked or deleted chat is pruned. A message which failed MAX_ATTEMPTS times
+    or was rejected by Telegram is moved to dead letters.
+    :param message: a queued message, a compact message refers to a payload in the outbox
+    :param payload: parameters of the Bot API method: chat_id, text, parse_mode
+    :param method: sendMessage or editMessageText
+    :param attempt: number of failed attempts
+    :param callbacks: signatures called with the result of a queued again message
+    :return: id of the sent or edited message, REQUEUED if the message was queued again,
+             None if sending failed
     """
     try:
-        status = requests.get(url)
-    except requests.RequestException as error:
-        logger.error(f'{url}\n{error}')
+        response = get_client().call(method, payload)
+    except TelegramConnectionError as error:
+        countdown, reason = backoff(attempt), str(error)
     else:
-        if status.status_code == 429:
-            raise self.retry()
+        if response.ok:
+            return response.message_id
+        if NOT_MODIFIED in response.description:
+            return
+
+        reason = f'{response.status_code} {response.description}'
+        if response.migrate_to_chat_id:
+            migrate_chat(message, payload, method, response.migrate_to_chat_id, attempt, callbacks)
+            return REQUEUED
+        if is_unreachable(response):
+            prune_chat(payload.get('chat_id'), reason)
+            return
+        if response.status_code == 429:
+            # throttled messages get a bit of jitter, so they don't come back at the same moment
+            countdown = (response.retry_after or 1) + random.uniform(0, 1)
+        elif response.status_code >= 500:
+            countdown = backoff(attempt)
+        else:
+            dead_letter(payload, method, reason, attempt + 1)
+            return
+
+    if attempt + 1 >= MAX_ATTEMPTS:
+        dead_letter(payload, method, reason, attempt + 1)
+        return
+    logger.warning(f"{method} into chat {payload.get('chat_id')} is retried in {countdown:.1f}s: {reason}")
+    send_message.apply_async(
+        (message,), {'method': method}, countdown=countdown, link=callbacks, retries=attempt + 1, queue=RETRIES_QUEUE
+    )
+    return REQUEUED
+
+
+def expired(message):
+    logger.error(f"Payload {message.get('payload_id')} of a message into chat {message.get('chat_id')} has expired")
+
+
+@celery.task(bind=True)
+def send_message(self, message, method='sendMessage'):
+    """Send message into a user chat.
+
+    Arguments:
+        message (dict): parameters of the Bot API method: chat_id, text, parse_mode
+            or a compact message with chat_id and payload_id of the payload in the outbox
+        method (str): sendMessage or editMessageText
+    Returns:
+        (int): id of the sent or edited message, None if sending failed or the message was queued again
+    """
+    payload = outbox.resolve([message])[0]
+    if payload is None:
+        expired(message)
+        return
+    result = send(message, payload, method, self.request.retries, self.request.callbacks)
+    if result == REQUEUED:
+        # callbacks are passed to the message queued again, they are called with its result only
+        self.request.callbacks = None
+        return
+    return result
+
+
+@celery.task
+def send_messages(messages):
+    """Send several messages by one task, so a broadcast is queued by a few broker messages.
+
+    Payloads of all messages are taken from the outbox by one query.
+    When a chat is throttled, its message and all the following messages
+    of the chat are queued again by one task, so they keep their order.
+
+    Arguments:
+        messages (list): compact messages with chat_id and payload_id
+    """
+    throttled = OrderedDict()
+    for message, payload in zip(messages, outbox.resolve(messages)):
+        if payload is None:
+            expired(message)
+            continue
+        chat_id = payload.get('chat_id')
+        if chat_id in throttled:
+            throttled[chat_id][1].append(message)
+            continue
+        wait = throttle(chat_id)
+        if wait:
+            throttled[chat_id] = (wait, [message])
+            continue
+        call_api(message, payload)
+
+    for wait, chat_messages in throttled.values():
+        send_messages.apply_async((chat_messages,), countdown=wait, queue=RETRIES_QUEUE)
+
+
+@celery.task
+def prune_chats():
+    """Disables subscriptions of unreachable chats until /start is sent in them again.
+
+    Chats queued by failed messages are pruned by one task per PRUNE_WINDOW.
+    Credentials of users are kept. Filters of the webhooks of the chats
+    are synced by the bot.
+    """
+    pipe = redis_conn.pipeline()
+    pipe.smembers(PRUNE_CHATS_KEY)
+    pipe.delete(PRUNE_CHATS_KEY)
+    members, _ = pipe.execute()
+    if release_debounce(redis_conn, PRUNE_LOCK_KEY, lambda: redis_conn.scard(PRUNE_CHATS_KEY)):
+        schedule_prune()
+    if not members:
+        return
+
+    chat_ids = [int(chat_id) for chat_id in members]
+    subscriptions = db.disable_chats_subscriptions(chat_ids)
+    if subscriptions:
+        db.request_webhooks_sync(db.get_chats_webhooks(chat_ids))
+    metrics.incr('jtb_pruned_chats_total', len(chat_ids))
+    logger.info(f'{len(chat_ids)} unreachable chats were pruned: {subscriptions} subscriptions were disabled')
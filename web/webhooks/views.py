@@ -1,87 +1,95 @@
-import json
+import hmac
 
+from decouple import config
 from flask import request
 from flask.views import MethodView
 
-from . import webhooks
-from .notifier import notify
-from ..app import db
+from . import admission, webhooks
+from .journal import record_update
+from .pipeline import claim_update, enqueue_update, fair_queue, is_supported, release_update, route_update
+from ..app import db, metrics
 
 
 JIRA_AGENT = 'Atlassian HttpClient'
+# acknowledge Jira immediately and process updates in celery workers
+ASYNC_PROCESSING = config('WEBHOOK_ASYNC_PROCESSING', default=False, cast=bool)
+# metrics are available only with the token, the endpoint is disabled without it
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
 
 
-def filters_subscribers(subscribers, project, issue=None):
-    """
-    Filtering subscribers through its topics: project or issue
-    :param subscribers: list of user subscribers info in dictionary type
-    :param project: project key e.g. JTB
-    :param issue: issue key e.g. JTB-99
-    :return: set of chat_ids
-    TODO: rewrite this function
-    """
-    sub_users = list()
-    for sub in subscribers:
-        sub_topic = sub.get('topic')
-        sub_name = sub.get('name')
-        sub_chat_id = sub.get('chat_id')
-        project_cond = sub_topic == 'project' and project == sub_name
+class WebhookView(MethodView):
+    """Base view for processing updates from Jira webhooks"""
 
-        if project:
-            if sub_topic == 'project' and project == sub_name:
-                sub_users.append(sub_chat_id)
+    def post(self, **kwargs):
+        if not request.content_length or JIRA_AGENT not in request.headers['User-Agent']:
+            return 'Endpoint is processing only updates from jira webhook', 403
 
-        if issue:
-            if sub_topic == 'issue' and issue == sub_name or project_cond:
-                sub_users.append(sub_chat_id)
+        # unsupported events and repeated deliveries are dropped before any work
+        if not is_supported(request.data):
+            return 'Unsupported event', 200
 
-    return set(sub_users)
+        # Jira delivers a rejected update again later
+        state, _ = admission.get_state()
+        if state == admission.OVERLOADED:
+            metrics.incr('jtb_webhook_rejected_total')
+            return 'Service is overloaded', 503, {'Retry-After': str(admission.RETRY_AFTER)}
 
+        if not claim_update(kwargs.get('webhook_id'), request.data):
+            return 'Duplicate update', 200
 
-class IssueWebhookView(MethodView):
-    """Processing updates from Jira issues"""
+        try:
+            webhook = db.get_webhook(webhook_id=kwargs.get('webhook_id'))
+            if not webhook:
+                # the update is accepted if the webhook is registered before its redelivery
+                release_update(kwargs.get('webhook_id'), request.data)
+                return 'Unregistered webhook', 403
 
-    def post(self, **kwargs):
-        if not request.content_length or JIRA_AGENT not in request.headers['User-Agent']:
-            return 'Endpoint is processing only updates from jira webhook', 403
+            if state == admission.DEGRADED:
+                admission.note_update(webhook)
 
-        webhook = db.get_webhook(webhook_id=kwargs.get('webhook_id'))
-        if not webhook:
-            return 'Unregistered webhook', 403
+            record_update(request.get_data(as_text=True), **kwargs)
 
-        subs = db.get_webhook_subscriptions(webhook.get('_id'))
-        if not subs.count():
-            return 'No subscribers', 200
+            if ASYNC_PROCESSING:
+                enqueue_update(request.get_data(as_text=True), weight=webhook.get('weight', 1), **kwargs)
+                return 'Accepted', 202
 
-        jira_update = json.loads(request.data)
-        chat_ids = filters_subscribers(subs, kwargs.get('project_key'), kwargs.get('issue_key'))
-        notify(jira_update, chat_ids, webhook.get('host_url'), db, **kwargs)
+            if not route_update(webhook, request.data, **kwargs):
+                return 'No subscribers', 200
+        except Exception:
+            release_update(kwargs.get('webhook_id'), request.data)
+            raise
 
         return 'OK', 200
 
 
-class ProjectWebhookView(MethodView):
-    """Processing updates from Jira projects"""
+class IssueWebhookView(WebhookView):
+    """Processing updates from Jira issues"""
 
-    def post(self, **kwargs):
-        if not request.content_length or JIRA_AGENT not in request.headers['User-Agent']:
-            return 'Endpoint is processing only updates from jira webhook', 403
 
-        webhook = db.get_webhook(webhook_id=kwargs.get('webhook_id'))
-        if not webhook:
-            return 'Unregistered webhook', 403
+class ProjectWebhookView(WebhookView):
+    """Processing updates from Jira projects"""
+
 
-        subs = db.get_webhook_subscriptions(webhook.get('_id'))
-        if not subs.count():
-            return 'No subscribers', 200
+class MetricsView(MethodView):
+    """Metrics of the webhook pipeline in the Prometheus text format"""
 
-        jira_update = json.loads(request.data)
-        chat_ids = filters_subscribers(subs, kwargs.get('project_key'))
-        notify(jira_update, chat_ids, webhook.get('host_url'), db, **kwargs)
+    def get(self):
+        if not METRICS_TOKEN:
+            return 'Not found', 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+            return 'Invalid token', 403
 
-        return 'OK', 200
+        gauges = [
+            ('jtb_webhook_backlog', {'webhook': webhook_id}, count)
+            for webhook_id, count in fair_queue.backlog().items()
+        ] + admission.gauges()
+        return metrics.render(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4'}
 
 
+webhooks.add_url_rule(
+    '/metrics',
+    view_func=MetricsView.as_view('metrics')
+)
 webhooks.add_url_rule(
     '/<webhook_id>/<project_key>/',
     view_func=ProjectWebhookView.as_view('project-webhook')